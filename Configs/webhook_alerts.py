@@ -176,17 +176,35 @@ def enviar_alertas_inactividad(conn):
 '''
 
 import json
-import requests
-from datetime import datetime, timedelta
+import threading
+import time
+from datetime import date, datetime, timedelta
 import jwt  # pip install PyJWT
 from Datos.db_conexion_extras import ejecutar_sql_reintento, ejecutar_sql_fetch
 from Datos.db_conexion import ejecutar_sql
+from Datos.db_table import CODIGOS_AD
+from Configs.webhook_envio import (
+    despachar, WEBHOOK_CONCURRENCIA, WEBHOOK_TIMEOUT_CONEXION, WEBHOOK_TIMEOUT_LECTURA,
+    WEBHOOK_LOTE_ITEMS, WEBHOOK_LOTE_BYTES
+)
+from Configs.webhook_outbox import (
+    encolar_outbox, procesar_outbox, entregador_activo, avisar_entregador
+)
 
 import os
 from cryptography.fernet import Fernet
 
 WEBHOOK_CONFIG_PATH = "Configs/personal_info/webhook_config.json"
 KEY_FILE = "secret.key"
+JWT_MARGEN = 60   # Segundos antes de "exp" en que se firma un token nuevo
+
+# Config ya leída y desencriptada; se vuelve a leer solo si cambia el mtime
+# del archivo
+cache_config = {"mtime": None, "cfg": None}
+
+# Último token Bearer firmado; se reutiliza hasta JWT_MARGEN antes de vencer
+cache_jwt = {"secret": None, "expiracion": None, "vence": None, "token": None}
+_lock_jwt = threading.Lock()
 
 
 # ----------------------------------------------------
@@ -226,11 +244,42 @@ def decrypt_value(value):
 # CARGAR CONFIGURACIÓN DEL WEBHOOK
 # ----------------------------------------------------
 def cargar_webhook_config():
+    """
+    Config del webhook desde cache: el archivo se relee (y el secret se
+    desencripta) solo si cambió su mtime. El dict devuelto es compartido,
+    no modificarlo.
+    """
+    try:
+        mtime = os.stat(WEBHOOK_CONFIG_PATH).st_mtime_ns
+    except OSError:
+        mtime = None
+
+    if cache_config["cfg"] is None or cache_config["mtime"] != mtime:
+        cache_config.update({"mtime": mtime, "cfg": _leer_webhook_config()})
+    return cache_config["cfg"]
+
+
+def _leer_webhook_config():
     """
     Devuelve dict con keys:
-      { "webhook_url": str or None, "min_seconds_inactivo": int, "webhook_secret": str or None }
+      { "webhook_url": str or None, "min_seconds_inactivo": int, "webhook_secret": str or None,
+        "concurrencia": int, "timeout": (conexión, lectura), "lote": dict or None,
+        "outbox": dict, "jwt_expiracion": int or None, "jwt_margen": int }
+    "jwt_expiracion" (segundos, "jwt_expiracion_segundos" en el archivo)
+    agrega "exp" al token; sin ella el token no vence, como antes.
+    "lote" solo se arma si el archivo trae "modo_lote": true (opcionales
+    "lote_max_items", "lote_max_bytes" y "lote_gzip"); si no, una alerta por POST.
+    "outbox" toma las claves "outbox_*" del archivo (ver Configs/webhook_outbox).
     """
-    default = {"webhook_url": None, "min_seconds_inactivo": 60, "webhook_secret": None}
+    default = {
+        "webhook_url": None, "min_seconds_inactivo": 60, "webhook_secret": None,
+        "concurrencia": WEBHOOK_CONCURRENCIA,
+        "timeout": (WEBHOOK_TIMEOUT_CONEXION, WEBHOOK_TIMEOUT_LECTURA),
+        "lote": None,
+        "outbox": {},
+        "jwt_expiracion": None,
+        "jwt_margen": JWT_MARGEN,
+    }
 
     try:
         with open(WEBHOOK_CONFIG_PATH, "r", encoding="utf-8") as f:
@@ -248,10 +297,49 @@ def cargar_webhook_config():
         except Exception:
             min_sec = 60
 
+        try:
+            concurrencia = max(1, int(data.get("concurrencia", WEBHOOK_CONCURRENCIA)))
+        except Exception:
+            concurrencia = WEBHOOK_CONCURRENCIA
+
+        try:
+            timeout = (
+                float(data.get("timeout_conexion", WEBHOOK_TIMEOUT_CONEXION)),
+                float(data.get("timeout_lectura", WEBHOOK_TIMEOUT_LECTURA)),
+            )
+        except Exception:
+            timeout = default["timeout"]
+
+        try:
+            jwt_expiracion = int(data.get("jwt_expiracion_segundos") or 0) or None
+            jwt_margen = max(0, int(data.get("jwt_margen_segundos", JWT_MARGEN)))
+        except Exception:
+            jwt_expiracion, jwt_margen = None, JWT_MARGEN
+
+        lote = None
+        if str(data.get("modo_lote", False)).lower() in ("true", "si", "sí", "yes", "1"):
+            try:
+                lote = {
+                    "max_items": max(1, int(data.get("lote_max_items", WEBHOOK_LOTE_ITEMS))),
+                    "max_bytes": max(1024, int(data.get("lote_max_bytes", WEBHOOK_LOTE_BYTES))),
+                    "gzip": bool(data.get("lote_gzip", False)),
+                }
+            except Exception:
+                lote = {"max_items": WEBHOOK_LOTE_ITEMS, "max_bytes": WEBHOOK_LOTE_BYTES, "gzip": False}
+
         return {
             "webhook_url": url,
             "min_seconds_inactivo": min_sec,
             "webhook_secret": secret,
+            "concurrencia": concurrencia,
+            "timeout": timeout,
+            "lote": lote,
+            "outbox": {
+                clave[len("outbox_"):]: valor
+                for clave, valor in data.items() if clave.startswith("outbox_")
+            },
+            "jwt_expiracion": jwt_expiracion,
+            "jwt_margen": jwt_margen,
         }
 
     except FileNotFoundError:
@@ -274,6 +362,8 @@ def guardar_webhook_config(data: dict):
         with open(WEBHOOK_CONFIG_PATH, "w", encoding="utf-8") as f:
             json.dump(final_data, f, indent=2)
 
+        # Releer en el próximo uso aunque el mtime no alcance a cambiar
+        cache_config.update({"mtime": None, "cfg": None})
         return True
     except Exception as e:
         print("[WEBHOOK_CFG] Error guardando:", e)
@@ -284,10 +374,11 @@ def guardar_webhook_config(data: dict):
 # GENERAR JWT OPCIONAL
 # ----------------------------------------------------
 
-def generar_jwt(secret):
-    payload = {
-        "iat": datetime.utcnow()  # Solo fecha de creación, sin expiración
-    }
+def generar_jwt(secret, expiracion_segundos=None):
+    ahora = datetime.utcnow()
+    payload = {"iat": ahora}
+    if expiracion_segundos:
+        payload["exp"] = ahora + timedelta(seconds=expiracion_segundos)
 
     token = jwt.encode(payload, secret, algorithm="HS256")
 
@@ -297,92 +388,85 @@ def generar_jwt(secret):
     return token
 
 
-'''
-def generar_jwt(secret, expiracion_segundos=3600):
-    payload = {
-        "exp": datetime.utcnow() + timedelta(seconds=expiracion_segundos),
-        "iat": datetime.utcnow()
-    }
-
-    token = jwt.encode(payload, secret, algorithm="HS256")
-
-    if isinstance(token, bytes):
-        token = token.decode("utf-8")
+def token_bearer(secret, expiracion_segundos=None, margen=JWT_MARGEN):
+    """
+    Token para "Authorization: Bearer". Se firma uno nuevo solo si cambió el
+    secret o la expiración, o si al actual le quedan menos de 'margen'
+    segundos; si no, se reutiliza (sin firmar por alerta).
+    """
+    with _lock_jwt:
+        vigente = (
+            cache_jwt["token"] is not None
+            and cache_jwt["secret"] == secret
+            and cache_jwt["expiracion"] == expiracion_segundos
+            and (cache_jwt["vence"] is None or time.monotonic() < cache_jwt["vence"] - margen)
+        )
+        if not vigente:
+            cache_jwt.update({
+                "secret": secret,
+                "expiracion": expiracion_segundos,
+                "vence": time.monotonic() + expiracion_segundos if expiracion_segundos else None,
+                "token": generar_jwt(secret, expiracion_segundos),
+            })
+        return cache_jwt["token"]
 
-    return token
-'''
 
 # ----------------------------------------------------
 # ENVIAR ALERTAS DE INACTIVIDAD
 # ----------------------------------------------------
+# Candidatos a alerta: el servidor calcula los segundos de inactividad
+# contra el 'ahora' del scanner (el mismo reloj que escribió InactivoDesde)
+QUERY_CANDIDATOS_ALERTA = """
+    SELECT e.Nombre, e.IP, e.InactivoDesde, e.Descripcion, e.Responsable, e.Ubicacion,
+           DATEDIFF(SECOND, e.InactivoDesde, ?) AS SegundosInactivo
+    FROM EquiposAD e
+    WHERE e.CodigoAD = ?
+      AND e.InactivoDesde <= DATEADD(SECOND, -?, ?)
+      AND NOT EXISTS (
+          SELECT 1 FROM AlertOutbox o
+          WHERE o.Nombre = e.Nombre AND o.Fecha = ?
+      )
+      AND NOT EXISTS (
+          SELECT 1 FROM AlertasEnviadas a
+          WHERE a.Nombre = e.Nombre AND a.Fecha = ?
+      )
+"""
+
+
 def enviar_alertas_inactividad(conn):
     cfg = cargar_webhook_config()
     webhook_url = cfg["webhook_url"]
     min_seconds = cfg["min_seconds_inactivo"]
-    secret = cfg.get("webhook_secret")
 
     if not webhook_url:
         print("[ALERTAS] No hay URL configurada. Saltando ciclo.")
         return
 
-    # Crear tabla AlertasEnviadas si no existe
-    crear_tabla_alertas = """
-        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='AlertasEnviadas' AND xtype='U')
-        CREATE TABLE AlertasEnviadas (
-            Nombre NVARCHAR(255),
-            Fecha DATE
-        )
-    """
-    ejecutar_sql_reintento(conn, crear_tabla_alertas, ())
-
-    # Buscar equipos inactivos
-    query_inactivos = """
-        SELECT Nombre, IP, InactivoDesde, Descripcion, Responsable, Ubicacion
-        FROM EquiposAD
-        WHERE InactivoDesde IS NOT NULL
-    """
-    inactivos = ejecutar_sql_fetch(conn, query_inactivos)
-
-    if not inactivos:
-        print("[ALERTAS] Ningún equipo está inactivo.")
-        return
+    # AlertasEnviadas la crea la migración del esquema (Datos/db_table)
 
+    # Una sola consulta: equipos dentro de AD inactivos hace al menos
+    # min_seconds y sin alerta hoy (anti-join contra AlertOutbox y
+    # AlertasEnviadas). Usa IX_EquiposAD_CodigoAD_InactivoDesde.
     ahora = datetime.now()
     hoy = ahora.date()
+    # Mismo orden que los '?' de la consulta: DATEDIFF, CodigoAD,
+    # DATEADD(-min_seconds, ahora), AlertOutbox.Fecha, AlertasEnviadas.Fecha
+    vencidos = ejecutar_sql_fetch(conn, QUERY_CANDIDATOS_ALERTA, (
+        ahora, CODIGOS_AD["Dentro de AD"], min_seconds, ahora, hoy, hoy
+    ))
+
+    if not vencidos:
+        print("[ALERTAS] Ningún equipo con alerta pendiente.")
+        return
 
-    for row in inactivos:
-        nombre, ip, inactivo_desde, descripcion, responsable, ubicacion = row
-
-        if not inactivo_desde:
-            continue
-
-        # Convertir si viene como string
-        if isinstance(inactivo_desde, str):
-            try:
-                inactivo_desde = datetime.fromisoformat(inactivo_desde)
-            except Exception:
-                try:
-                    inactivo_desde = datetime.strptime(inactivo_desde, "%Y-%m-%d %H:%M:%S")
-                except Exception:
-                    print(f"[ALERTAS] No pude parsear InactivoDesde para {nombre}: {inactivo_desde}")
-                    continue
-
-        # Ver tiempo inactivo
-        diff = ahora - inactivo_desde
-        segundos_inactivo = diff.total_seconds()
-
-        if segundos_inactivo < min_seconds:
-            print(f"[ALERTAS] {nombre} inactivo {int(segundos_inactivo)}s < {min_seconds}s → se salta")
-            continue
-
-        # Evitar alertas duplicadas en el mismo día
-        query_verificar = "SELECT 1 FROM AlertasEnviadas WHERE Nombre = ? AND Fecha = ?"
-        ya = ejecutar_sql_fetch(conn, query_verificar, params=(nombre, hoy))
-        if ya:
-            continue
+    entradas = []
+    for row in vencidos:
+        nombre, ip, inactivo_desde, descripcion, responsable, ubicacion, segundos_inactivo = row
+        clave = f"{nombre}:{hoy.isoformat()}"
 
-        # Payload a enviar
-        payload = {
+        # Payload a enviar ("id_alerta" deja al receptor descartar duplicados)
+        entradas.append((clave, nombre, hoy, {
+            "id_alerta": clave,
             "servidor": nombre,
             "ip": ip,
             "descripcion": descripcion,
@@ -390,32 +474,85 @@ def enviar_alertas_inactividad(conn):
             "ubicacion": ubicacion,
             "inactivo_desde": inactivo_desde.isoformat(),
             "segundos_inactivo": int(segundos_inactivo)
-        }
+        }))
 
-        headers = {}
-        if secret:
-            headers["Authorization"] = f"Bearer {generar_jwt(secret)}"
+    # El escaneo solo encola: el envío y los reintentos son del entregador
+    encolar_outbox(conn, entradas)
+    print(f"[ALERTAS] {len(entradas)} alertas encoladas.")
 
-        # -----------------------------------------------
-        # ENVÍO DE ALERTA
-        # -----------------------------------------------
-        try:
-            resp = requests.post(webhook_url, json=payload, headers=headers, timeout=8)
-            print(f"[ALERTA] Enviada → {nombre} → {resp.status_code}")
+    if entregador_activo():
+        avisar_entregador()
+    else:
+        procesar_outbox(conn, entregar_alertas, cfg["outbox"])
 
-            if resp.status_code == 200:
-                # Registrar que se envió hoy
-                query_insert = "INSERT INTO AlertasEnviadas (Nombre, Fecha) VALUES (?, ?)"
-                ejecutar_sql_reintento(conn, query_insert, params=(nombre, hoy))
 
-                # 🔥 Actualizar UltimoWebhook
-                query_update_webhook = """
-                    UPDATE EquiposAD
-                    SET UltimoWebhook = GETDATE()
-                    WHERE Nombre = ?
-                """
-                ejecutar_sql_reintento(conn, query_update_webhook, params=(nombre,))
+def entregar_alertas(conn, envios):
+    """
+    Función de entrega del outbox (Configs/webhook_outbox): envía
+    [(clave, payload), ...] y registra las confirmadas en una sola tanda.
+    Devuelve [(clave, ok, detalle), ...], o None si no hay URL configurada
+    (las alertas siguen pendientes sin gastar intentos).
+    """
+    cfg = cargar_webhook_config()
+    webhook_url = cfg["webhook_url"]
+    secret = cfg.get("webhook_secret")
 
-        except Exception as e:
-            print(f"[ERROR ALERTA] No se pudo enviar a {nombre}: {e}")
-            print("[ALERTAS] Se reintentará en el próximo ciclo.")
+    if not webhook_url:
+        return None
+
+    headers = {}
+    if secret:
+        headers["Authorization"] = f"Bearer {token_bearer(secret, cfg['jwt_expiracion'], cfg['jwt_margen'])}"
+
+    # -----------------------------------------------
+    # ENVÍO DE ALERTAS (concurrente, sesión compartida;
+    # en modo lote, varias alertas por POST)
+    # -----------------------------------------------
+    resultados = despachar(
+        webhook_url, envios, headers=headers,
+        concurrencia=cfg["concurrencia"], timeout=cfg["timeout"], lote=cfg["lote"]
+    )
+
+    enviados = {}
+    for clave, ok, detalle in resultados:
+        nombre, fecha = clave.rsplit(":", 1)
+        if ok:
+            print(f"[ALERTA] Enviada → {nombre} → {detalle}")
+            enviados.setdefault(fecha, []).append(nombre)
+        else:
+            print(f"[ERROR ALERTA] No se pudo enviar a {nombre}: {detalle}")
+
+    for fecha, nombres in enviados.items():
+        registrar_enviadas(conn, nombres, date.fromisoformat(fecha))
+
+    return resultados
+
+
+# ----------------------------------------------------
+# REGISTRAR ALERTAS ENVIADAS (una tanda por ciclo)
+# ----------------------------------------------------
+ALERTAS_LOTE = 500   # Nombres por sentencia (SQL Server admite 2100 parámetros)
+
+
+def registrar_enviadas(conn, nombres, hoy):
+    """
+    Marca en AlertasEnviadas y EquiposAD.UltimoWebhook todas las alertas
+    confirmadas del ciclo, en una sentencia por lote en lugar de dos por
+    equipo. Idempotente: puede reenviarse desde el spool local.
+    """
+    for i in range(0, len(nombres), ALERTAS_LOTE):
+        lote = nombres[i:i + ALERTAS_LOTE]
+        valores = ", ".join("(?)" for _ in lote)
+        marcas = ", ".join("?" for _ in lote)
+        query = f"""
+            INSERT INTO AlertasEnviadas (Nombre, Fecha)
+            SELECT v.Nombre, ? FROM (VALUES {valores}) AS v(Nombre)
+            WHERE NOT EXISTS (
+                SELECT 1 FROM AlertasEnviadas a WHERE a.Nombre = v.Nombre AND a.Fecha = ?
+            );
+
+            UPDATE EquiposAD
+            SET UltimoWebhook = GETDATE()
+            WHERE Nombre IN ({marcas});
+        """
+        ejecutar_sql_reintento(conn, query, params=(hoy, *lote, hoy, *lote))
@@ -0,0 +1,209 @@
+# ---------------------------------------
+# Archivo: Configs/webhook_envio.py
+# Despachador de webhooks: sesión HTTP compartida (keep-alive) y envíos
+# concurrentes acotados, con timeout por pedido. Opcionalmente agrupa
+# varias alertas por POST (modo lote)
+# ---------------------------------------
+
+import gzip
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+WEBHOOK_CONCURRENCIA = 8       # Envíos simultáneos como máximo
+WEBHOOK_TIMEOUT_CONEXION = 3   # Segundos para abrir la conexión
+WEBHOOK_TIMEOUT_LECTURA = 8    # Segundos para recibir la respuesta
+WEBHOOK_LOTE_ITEMS = 100       # Modo lote: alertas por POST como máximo
+WEBHOOK_LOTE_BYTES = 256 * 1024  # Modo lote: tamaño máximo del cuerpo (sin comprimir)
+
+# Sesión compartida entre ciclos: las conexiones quedan abiertas en el pool
+# de urllib3 y se reutilizan (sin handshake TCP/TLS por alerta)
+estado_envio = {
+    "sesion": None,
+    "tamano": 0,   # pool_maxsize con el que se montó el adaptador
+}
+
+_lock_sesion = threading.Lock()
+
+
+def obtener_sesion(concurrencia=WEBHOOK_CONCURRENCIA):
+    """
+    Devuelve la requests.Session compartida. El pool de conexiones por host
+    se dimensiona con 'concurrencia' para que ningún hilo espere un socket.
+    """
+    with _lock_sesion:
+        if estado_envio["sesion"] is None or estado_envio["tamano"] < concurrencia:
+            if estado_envio["sesion"] is not None:
+                estado_envio["sesion"].close()
+            sesion = requests.Session()
+            adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=concurrencia)
+            sesion.mount("https://", adaptador)
+            sesion.mount("http://", adaptador)
+            estado_envio.update({"sesion": sesion, "tamano": concurrencia})
+        return estado_envio["sesion"]
+
+
+def cerrar_sesion():
+    with _lock_sesion:
+        if estado_envio["sesion"] is not None:
+            estado_envio["sesion"].close()
+        estado_envio.update({"sesion": None, "tamano": 0})
+
+
+def _enviar_uno(sesion, url, clave, cuerpo, headers, timeout):
+    """
+    Un POST. Devuelve (clave, ok, detalle): detalle es el status HTTP o el
+    texto de la excepción.
+    """
+    try:
+        resp = sesion.post(url, json=cuerpo, headers=headers, timeout=timeout)
+        return clave, resp.status_code == 200, resp.status_code
+    except Exception as e:
+        return clave, False, str(e)
+
+
+def _estados_lote(resp, lote):
+    """
+    Interpreta la respuesta a un POST en lote. El receptor puede devolver el
+    estado de cada alerta, en el mismo orden del arreglo enviado o con su
+    "id_alerta" o su "servidor":
+      [{"servidor": "PC1", "status": 200}, {"servidor": "PC2", "ok": false}, ...]
+      {"resultados": [...]}  (o "items")
+    Sin estados por alerta, vale el status HTTP para todo el lote.
+    Devuelve [(clave, ok, detalle), ...].
+    """
+    claves = [clave for clave, _, _ in lote]
+    if resp.status_code not in (200, 207):
+        return [(clave, False, resp.status_code) for clave in claves]
+
+    try:
+        datos = resp.json()
+    except ValueError:
+        datos = None
+    if isinstance(datos, dict):
+        datos = datos.get("resultados", datos.get("items"))
+
+    if not isinstance(datos, list) or not datos:
+        ok = resp.status_code == 200
+        return [(clave, ok, resp.status_code) for clave in claves]
+
+    def estado(item):
+        if isinstance(item, dict):
+            if "status" in item:
+                return 200 <= int(item["status"]) < 300, item["status"]
+            return bool(item.get("ok")), item.get("error", resp.status_code)
+        if isinstance(item, bool):
+            return item, resp.status_code
+        return 200 <= int(item) < 300, item
+
+    por_id = {item["id_alerta"]: item for item in datos
+              if isinstance(item, dict) and "id_alerta" in item}
+    por_nombre = {item["servidor"]: item for item in datos
+                  if isinstance(item, dict) and "servidor" in item}
+    resultados = []
+    for i, (clave, _, servidor) in enumerate(lote):
+        if por_id:
+            item = por_id.get(clave)
+        elif por_nombre:
+            item = por_nombre.get(servidor)
+        else:
+            item = datos[i] if i < len(datos) else None
+        if item is None:
+            resultados.append((clave, False, "sin estado en la respuesta"))
+            continue
+        try:
+            ok, detalle = estado(item)
+        except (TypeError, ValueError):
+            ok, detalle = False, f"estado inválido: {item!r}"
+        resultados.append((clave, ok, detalle))
+    return resultados
+
+
+def _enviar_lote(sesion, url, lote, headers, timeout, comprimir):
+    """
+    Un POST con el arreglo de cuerpos del lote (ya serializados). Devuelve
+    el estado de cada alerta.
+    """
+    cuerpo = ("[" + ",".join(texto for _, texto, _ in lote) + "]").encode("utf-8")
+    headers = dict(headers, **{"Content-Type": "application/json"})
+    if comprimir:
+        cuerpo = gzip.compress(cuerpo)
+        headers["Content-Encoding"] = "gzip"
+
+    try:
+        resp = sesion.post(url, data=cuerpo, headers=headers, timeout=timeout)
+        return _estados_lote(resp, lote)
+    except Exception as e:
+        return [(clave, False, str(e)) for clave, _, _ in lote]
+
+
+def armar_lotes(envios, max_items=WEBHOOK_LOTE_ITEMS, max_bytes=WEBHOOK_LOTE_BYTES):
+    """
+    Parte [(clave, cuerpo), ...] en lotes de a lo sumo 'max_items' alertas y
+    'max_bytes' de JSON. Una alerta que sola supera 'max_bytes' va en un
+    lote propio. Devuelve [[(clave, json_texto, servidor), ...], ...].
+    """
+    lotes, actual, tamano = [], [], 2   # 2 = corchetes del arreglo
+    for clave, cuerpo in envios:
+        texto = json.dumps(cuerpo, ensure_ascii=False)
+        largo = len(texto.encode("utf-8")) + 1   # + coma separadora
+        if actual and (len(actual) >= max_items or tamano + largo > max_bytes):
+            lotes.append(actual)
+            actual, tamano = [], 2
+        actual.append((clave, texto, cuerpo.get("servidor") if isinstance(cuerpo, dict) else None))
+        tamano += largo
+    if actual:
+        lotes.append(actual)
+    return lotes
+
+
+def despachar(url, envios, headers=None, concurrencia=WEBHOOK_CONCURRENCIA,
+              timeout=(WEBHOOK_TIMEOUT_CONEXION, WEBHOOK_TIMEOUT_LECTURA), lote=None):
+    """
+    Envía [(clave, cuerpo), ...] a 'url' con hasta 'concurrencia' pedidos en
+    vuelo. Cada pedido tiene su propio timeout (conexión, lectura), así que
+    un endpoint lento cuesta a lo sumo un timeout por tanda y no uno por
+    alerta. Devuelve [(clave, ok, detalle), ...] en orden de llegada.
+    No toca SQL: el llamador registra los resultados en una sola tanda.
+
+    'lote' activa el modo lote: {"max_items": int, "max_bytes": int,
+    "gzip": bool}. Cada POST lleva un arreglo de alertas y la respuesta
+    puede traer el estado de cada una, así que un fallo parcial solo deja
+    pendientes las alertas rechazadas.
+    """
+    if not envios:
+        return []
+
+    headers = headers or {}
+    if lote:
+        tareas = [
+            (_enviar_lote, (url, grupo, headers, timeout, bool(lote.get("gzip"))))
+            for grupo in armar_lotes(
+                envios,
+                lote.get("max_items", WEBHOOK_LOTE_ITEMS),
+                lote.get("max_bytes", WEBHOOK_LOTE_BYTES),
+            )
+        ]
+    else:
+        tareas = [
+            (_enviar_uno, (url, clave, cuerpo, headers, timeout))
+            for clave, cuerpo in envios
+        ]
+
+    concurrencia = max(1, min(concurrencia, len(tareas)))
+    sesion = obtener_sesion(concurrencia)
+    resultados = []
+
+    with ThreadPoolExecutor(max_workers=concurrencia, thread_name_prefix="webhook") as executor:
+        futuros = [executor.submit(funcion, sesion, *args) for funcion, args in tareas]
+        for futuro in as_completed(futuros):
+            resultado = futuro.result()
+            if lote:
+                resultados.extend(resultado)
+            else:
+                resultados.append(resultado)
+
+    return resultados
@@ -0,0 +1,221 @@
+# ---------------------------------------
+# Archivo: Configs/webhook_outbox.py
+# Bandeja de salida de alertas (tabla AlertOutbox): el escaneo encola y un
+# hilo entregador aparte envía, reintenta con backoff y descarta
+# ---------------------------------------
+
+import json
+import threading
+from Configs.logs_utils import escribir_log
+from Datos.db_conexion_extras import ejecutar_sql_reintento, ejecutar_sql_fetch
+from Datos.db_pool import espera_backoff
+from Datos.db_table import CODIGOS_OUTBOX
+
+OUTBOX_LOTE = 200             # Alertas tomadas por pasada del entregador
+OUTBOX_ESPERA = 5             # Segundos entre pasadas si no hay aviso
+OUTBOX_MAX_INTENTOS = 8       # Después de esto la alerta queda "Descartada"
+OUTBOX_BACKOFF_BASE = 10      # Segundos de espera tras el primer fallo
+OUTBOX_BACKOFF_MAX = 1800     # Tope de la espera entre reintentos
+_FILAS_SENTENCIA = 400        # 4 parámetros por fila (SQL Server admite 2100)
+
+# Estado del hilo entregador (uno por proceso). Usa su propia conexión del
+# pool, así que un webhook lento nunca frena al escaneo.
+estado_outbox = {
+    "hilo": None,
+    "conn": None,        # PoolSQL (Datos/db_pool)
+    "entregar": None,    # entregar(conn, [(clave, payload)]) -> [(clave, ok, detalle)] o None
+    "evento": None,      # avisa que hay alertas nuevas
+    "detener": None,
+    "opciones": {},
+    "entregadas": 0,
+    "descartadas": 0,
+}
+
+
+def _opcion(opciones, clave, defecto, tipo=int):
+    try:
+        return tipo((opciones or {}).get(clave, defecto))
+    except (TypeError, ValueError):
+        return defecto
+
+
+# ----------------------------------------------------
+# ENCOLAR
+# ----------------------------------------------------
+def encolar_outbox(conn, entradas):
+    """
+    Agrega [(clave, nombre, fecha, payload), ...] a AlertOutbox. Una clave ya
+    encolada (pendiente, entregada o descartada) no se vuelve a agregar, así
+    que cada clave se entrega una sola vez. Idempotente: puede reenviarse
+    desde el spool local.
+    """
+    for i in range(0, len(entradas), _FILAS_SENTENCIA):
+        lote = entradas[i:i + _FILAS_SENTENCIA]
+        valores = ", ".join("(?, ?, ?, ?)" for _ in lote)
+        params = []
+        for clave, nombre, fecha, payload in lote:
+            params.extend((clave, nombre, fecha, json.dumps(payload, ensure_ascii=False)))
+
+        query = f"""
+            INSERT INTO AlertOutbox (Clave, Nombre, Fecha, Payload)
+            SELECT v.Clave, v.Nombre, v.Fecha, v.Payload
+            FROM (VALUES {valores}) AS v(Clave, Nombre, Fecha, Payload)
+            WHERE NOT EXISTS (SELECT 1 FROM AlertOutbox o WHERE o.Clave = v.Clave)
+        """
+        ejecutar_sql_reintento(conn, query, params=tuple(params))
+
+
+# ----------------------------------------------------
+# ENTREGAR
+# ----------------------------------------------------
+def _marcar_entregadas(conn, ids):
+    for i in range(0, len(ids), 1000):
+        lote = ids[i:i + 1000]
+        marcas = ", ".join("?" for _ in lote)
+        query = f"""
+            UPDATE AlertOutbox
+            SET Estado = ?, Intentos = Intentos + 1, Entregado = SYSDATETIME(), UltimoError = NULL
+            WHERE Id IN ({marcas})
+        """
+        ejecutar_sql_reintento(conn, query, params=(CODIGOS_OUTBOX["Entregada"], *lote))
+
+
+def _marcar_fallida(conn, id_, clave, intentos, detalle, opciones):
+    """
+    Suma el intento y reprograma con backoff exponencial + jitter; al llegar
+    a OUTBOX_MAX_INTENTOS la alerta pasa a "Descartada" (dead-letter) y
+    queda en la tabla para revisarla a mano.
+    """
+    error = str(detalle)[:500]
+    if intentos >= _opcion(opciones, "max_intentos", OUTBOX_MAX_INTENTOS):
+        query = """
+            UPDATE AlertOutbox
+            SET Estado = ?, Intentos = ?, UltimoError = ?
+            WHERE Id = ?
+        """
+        ejecutar_sql_reintento(conn, query, params=(CODIGOS_OUTBOX["Descartada"], intentos, error, id_))
+        estado_outbox["descartadas"] += 1
+        escribir_log(f"Alerta {clave} descartada tras {intentos} intentos: {error}", tipo="ERROR")
+        return
+
+    espera = espera_backoff(
+        intentos,
+        _opcion(opciones, "backoff_base", OUTBOX_BACKOFF_BASE, float),
+        _opcion(opciones, "backoff_max", OUTBOX_BACKOFF_MAX, float),
+    )
+    query = """
+        UPDATE AlertOutbox
+        SET Intentos = ?, UltimoError = ?, ProximoIntento = DATEADD(SECOND, ?, SYSDATETIME())
+        WHERE Id = ?
+    """
+    ejecutar_sql_reintento(conn, query, params=(intentos, error, int(espera), id_))
+
+
+def procesar_outbox(conn, entregar, opciones=None):
+    """
+    Una pasada: toma las alertas pendientes cuyo ProximoIntento ya venció,
+    las entrega con 'entregar' y registra el resultado de cada una.
+    Devuelve cuántas alertas tomó (0 si no había o si 'entregar' devolvió
+    None, por ejemplo sin URL configurada: no se cuenta como intento).
+
+    Si el proceso se corta entre el POST y la marca de entregada, esa
+    alerta se vuelve a enviar: el payload lleva "id_alerta" (la clave) para
+    que el receptor descarte el duplicado.
+    """
+    filas = ejecutar_sql_fetch(conn, """
+        SELECT TOP (?) Id, Clave, Payload, Intentos
+        FROM AlertOutbox
+        WHERE Estado = ? AND ProximoIntento <= SYSDATETIME()
+        ORDER BY ProximoIntento, Id
+    """, (_opcion(opciones, "lote", OUTBOX_LOTE), CODIGOS_OUTBOX["Pendiente"]))
+
+    if not filas:
+        return 0
+
+    por_clave = {clave: (id_, intentos) for id_, clave, _, intentos in filas}
+    resultados = entregar(conn, [(clave, json.loads(payload)) for _, clave, payload, _ in filas])
+    if resultados is None:
+        return 0
+
+    entregadas = []
+    for clave, ok, detalle in resultados:
+        id_, intentos = por_clave.pop(clave)
+        if ok:
+            entregadas.append(id_)
+        else:
+            _marcar_fallida(conn, id_, clave, intentos + 1, detalle, opciones)
+
+    # Las que 'entregar' no informó cuentan como fallidas
+    for clave, (id_, intentos) in por_clave.items():
+        _marcar_fallida(conn, id_, clave, intentos + 1, "sin resultado", opciones)
+
+    _marcar_entregadas(conn, entregadas)
+    estado_outbox["entregadas"] += len(entregadas)
+    return len(filas)
+
+
+# ----------------------------------------------------
+# HILO ENTREGADOR
+# ----------------------------------------------------
+def entregador_activo():
+    return estado_outbox["hilo"] is not None
+
+
+def _bucle_entregador():
+    conn = estado_outbox["conn"]
+    opciones = estado_outbox["opciones"]
+    lote = _opcion(opciones, "lote", OUTBOX_LOTE)
+    espera = _opcion(opciones, "espera", OUTBOX_ESPERA, float)
+    try:
+        while not estado_outbox["detener"].is_set():
+            try:
+                tomadas = procesar_outbox(conn, estado_outbox["entregar"], opciones)
+            except Exception as e:
+                escribir_log(f"Error en el entregador de alertas: {e}", tipo="ERROR")
+                tomadas = 0
+            if tomadas >= lote:
+                continue   # quedan más vencidas
+            estado_outbox["evento"].wait(espera)
+            estado_outbox["evento"].clear()
+    finally:
+        conn.descartar()  # cerrar la conexión del hilo entregador
+
+
+def iniciar_entregador(conn, opciones, entregar):
+    """
+    Arranca el hilo entregador sobre su propia conexión del pool 'conn'.
+    'opciones' (webhook_config.json, ver Configs/webhook_alerts): lote,
+    espera, max_intentos, backoff_base, backoff_max.
+    """
+    if estado_outbox["hilo"] is not None:
+        return
+
+    estado_outbox.update({
+        "conn": conn,
+        "entregar": entregar,
+        "opciones": dict(opciones or {}),
+        "evento": threading.Event(),
+        "detener": threading.Event(),
+    })
+    hilo = threading.Thread(target=_bucle_entregador, name="entregador-alertas", daemon=True)
+    estado_outbox["hilo"] = hilo
+    hilo.start()
+    escribir_log("Entregador de alertas iniciado", tipo="INFO")
+
+
+def avisar_entregador():
+    """
+    Despierta al entregador (hay alertas recién encoladas).
+    """
+    if estado_outbox["evento"] is not None:
+        estado_outbox["evento"].set()
+
+
+def detener_entregador():
+    hilo = estado_outbox["hilo"]
+    if hilo is None:
+        return
+    estado_outbox["detener"].set()
+    estado_outbox["evento"].set()
+    hilo.join()
+    estado_outbox.update({"hilo": None, "conn": None, "evento": None, "detener": None})
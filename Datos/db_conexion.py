@@ -1,30 +1,7 @@
 
 import pyodbc
-import time
-from cryptography.fernet import Fernet  # <-- nuevo
 from Configs.logs_utils import escribir_log
-
-KEY_FILE = "secret.key"
-
-def _cargar_fernet():
-    try:
-        with open(KEY_FILE, "rb") as f:
-            key = f.read()
-        return Fernet(key)
-    except Exception as e:
-        escribir_log(f"No se pudo cargar '{KEY_FILE}': {e}", tipo="WARNING")
-        return None
-
-def _maybe_decrypt(value):
-    if not value:
-        return value
-    f = _cargar_fernet()
-    if not f:
-        return value
-    try:
-        return f.decrypt(value.encode()).decode()
-    except Exception:
-        return value
+from Datos.db_pool import cadena_conexion, crear_pool, maybe_decrypt as _maybe_decrypt
 
 
 # ------------------------
@@ -56,28 +33,15 @@ def validar_sql(config):
         user = _maybe_decrypt(config.get("DB_USER", "")) if config.get("DB_USER") else ""
         password = _maybe_decrypt(config.get("DB_PASSWORD", "")) if config.get("DB_PASSWORD") else ""
 
-        # Construir string de conexión
-        if trusted == "yes":
-            conn_str = (
-                f"DRIVER={driver};"
-                f"SERVER={server};"
-                f"DATABASE={db};"
-                "Trusted_Connection=yes;"
-            )
-        else:
+        if trusted != "yes":
             if not user:
                 return (False, "DB_USER vacío o inválido")
 
             if not password:
                 return (False, "DB_PASSWORD vacío o inválido")
 
-            conn_str = (
-                f"DRIVER={driver};"
-                f"SERVER={server};"
-                f"DATABASE={db};"
-                f"UID={user};"
-                f"PWD={password};"
-            )
+        # Construir string de conexión
+        conn_str = cadena_conexion(config)
 
         # Intentar conectar
         try:
@@ -111,73 +75,33 @@ def validar_sql(config):
 # ------------------------
 # Conexión a SQL Server con reconexión
 # ------------------------
-def conectar_sql(config):
+def conectar_sql(config, spool=False):
     """
-    Intenta conectarse a SQL Server indefinidamente hasta que tenga éxito.
+    Intenta conectarse a SQL Server indefinidamente (con backoff y jitter)
+    hasta que tenga éxito.
     Recibe un diccionario 'config' con los datos de conexión.
-    Devuelve la conexión activa.
+    Devuelve el pool (Datos/db_pool.PoolSQL): se usa como una conexión
+    pyodbc, pero cada hilo trabaja con su propia conexión.
+    Con spool=True no se queda esperando: si el servidor no responde, las
+    escrituras van al spool local (Datos/db_spool) hasta que vuelva.
     """
-    while True:
-        try:
-            DB_DRIVER = config["DB_DRIVER"]
-            DB_SERVER = config["DB_SERVER"]
-            DB_NAME = config["DB_NAME"]
-            DB_TRUSTED = config.get("DB_TRUSTED", "yes")
-            # Intentar desencriptar si es necesario
-            DB_USER = _maybe_decrypt(config.get("DB_USER", "")) if config.get("DB_USER") else ""
-            DB_PASSWORD = _maybe_decrypt(config.get("DB_PASSWORD", "")) if config.get("DB_PASSWORD") else ""
-
-            if DB_TRUSTED.lower() == "yes":
-                conn_str = (
-                    f"DRIVER={DB_DRIVER};"
-                    f"SERVER={DB_SERVER};"
-                    f"DATABASE={DB_NAME};"
-                    "Trusted_Connection=yes;"
-                )
-            else:
-                conn_str = (
-                    f"DRIVER={DB_DRIVER};"
-                    f"SERVER={DB_SERVER};"
-                    f"DATABASE={DB_NAME};"
-                    f"UID={DB_USER};"
-                    f"PWD={DB_PASSWORD};"
-                )
-
-            conn = pyodbc.connect(conn_str, timeout=5)
-            print("[OK] Conectado a SQL Server correctamente.")
-            return conn
-
-        except pyodbc.Error as e:
-            print(f"[ERROR] No se pudo conectar a SQL Server: {e}")
-            print("  Reintentando en 5 segundos...")
-            time.sleep(5)
+    pool = crear_pool(config, spool=spool)
+    if pool.en_linea:
+        print("[OK] Conectado a SQL Server correctamente.")
+    return pool
 
 
 # ------------------------
 # Ejecutar query SQL con reintentos
 # ------------------------
-def ejecutar_sql(conn, query, params=(), reintentos=3, espera=5, config=None):
+def ejecutar_sql(conn, query, params=(), reintentos=3, espera=5, config=None, spool=True):
     """
-    Ejecuta un query SQL con reconexión automática en caso de fallo.
-    Si falla, reconecta usando 'config' y reintenta.
+    Ejecuta un query SQL con reconexión automática en caso de fallo
+    (ver PoolSQL.ejecutar). 'espera' y 'config' se conservan por
+    compatibilidad: el pool ya conoce la configuración y usa backoff.
+    Con spool=False (DDL de migraciones) nunca se difiere al spool local.
     """
-    for intento in range(1, reintentos + 1):
-        try:
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            conn.commit()
-            return True
-
-        except pyodbc.OperationalError as e:
-            print(f"[ERROR] Fallo de conexión: {e}")
-            if config:
-                print(f"  Reconectando y reintentando ({intento}/{reintentos})...")
-                conn = conectar_sql(config)
-            time.sleep(espera)
-
-        except pyodbc.Error as e:
-            print(f"[ERROR] SQL Error: {e}")
-            return False
-
-    print("[FATAL] No se pudo ejecutar la consulta tras varios intentos.")
-    return False
+    if conn.ejecutar(query, params, reintentos=reintentos, diferible=spool) is None:
+        print("[FATAL] No se pudo ejecutar la consulta tras varios intentos.")
+        return False
+    return True
@@ -3,40 +3,20 @@
 # Funciones adicionales para consultas SQL
 # ---------------------------------------
 
-import time
-import pyodbc
-from Datos.db_conexion import conectar_sql  # usa tu conexión actual con encriptación
-
 # -----------------------------------------------------
 # Query con reintentos y sin comprometer el original
 # -----------------------------------------------------
-def ejecutar_sql_reintento(conn, query, params=(), intentos=3, espera=2, fetch=False):
+def ejecutar_sql_reintento(conn, query, params=(), intentos=3, espera=2, fetch=False, clave=None):
     """
-    Ejecuta un SQL con reintentos seguros.
-    Compatible con tu arquitectura sin alterar db_conexion.py.
+    Ejecuta un SQL con reintentos seguros sobre el pool (Datos/db_pool):
+    reconecta solo si la conexión se cayó, con backoff y fuera de cualquier lock.
+    'clave' identifica la fila si la escritura termina en el spool local.
+    Devuelve las filas (fetch=True), True, o None si falló.
     """
-    ultimo_error = None
-
-    for i in range(1, intentos + 1):
-        try:
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-
-            if fetch:
-                datos = cursor.fetchall()
-                conn.commit()
-                return datos
-
-            conn.commit()
-            return True
-
-        except Exception as e:
-            ultimo_error = e
-            print(f"[SQL RETRY] Error intento {i}/{intentos}: {e}")
-            time.sleep(espera)
-
-    print(f"[SQL RETRY] Falló definitivamente: {ultimo_error}")
-    return None
+    resultado = conn.ejecutar(query, params, fetch=fetch, reintentos=intentos, clave=clave)
+    if resultado is None:
+        print(f"[SQL RETRY] Falló definitivamente: {query.strip().splitlines()[0]}")
+    return resultado
 
 
 # -----------------------------------------------------
@@ -46,10 +26,4 @@ def ejecutar_sql_fetch(conn, query, params=()):
     """
     Solo SELECT. Devuelve listas de filas o [] si falla.
     """
-    try:
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        return cursor.fetchall()
-    except Exception as e:
-        print("[SQL FETCH ERROR]", e)
-        return []
+    return conn.ejecutar(query, params, fetch=True) or []
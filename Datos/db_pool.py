@@ -0,0 +1,431 @@
+# ---------------------------------------
+# Archivo: Datos/db_pool.py
+# Pool de conexiones SQL: una conexión por hilo, verificación de salud,
+# reconexión con backoff y reutilización de cursores
+# ---------------------------------------
+
+import random
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+import pyodbc
+from cryptography.fernet import Fernet
+from Configs.logs_utils import escribir_log
+from Datos.db_spool import SQL_SPOOL_LOTE, SQL_SPOOL_PATH, SpoolLocal
+
+KEY_FILE = "secret.key"
+
+SQL_IDLE_CHECK = 60        # Segundos sin uso tras los cuales se verifica la conexión (SELECT 1)
+SQL_BACKOFF_BASE = 1       # Primera espera entre intentos de reconexión (segundos)
+SQL_BACKOFF_MAX = 30       # Tope de la espera entre intentos de reconexión
+SQL_REINTENTOS = 3         # Intentos por sentencia ante errores de conexión
+SQL_CONECTAR_INTENTOS = 3  # Intentos al arrancar antes de seguir solo con el spool
+
+# SQLSTATE que indican que la conexión se cayó (no un error de la consulta)
+ESTADOS_CONEXION = {"08001", "08003", "08004", "08007", "08S01", "HYT00", "HYT01"}
+
+
+def _cargar_fernet():
+    try:
+        with open(KEY_FILE, "rb") as f:
+            key = f.read()
+        return Fernet(key)
+    except Exception as e:
+        escribir_log(f"No se pudo cargar '{KEY_FILE}': {e}", tipo="WARNING")
+        return None
+
+
+def maybe_decrypt(value):
+    if not value:
+        return value
+    f = _cargar_fernet()
+    if not f:
+        return value
+    try:
+        return f.decrypt(value.encode()).decode()
+    except Exception:
+        return value
+
+
+def cadena_conexion(config):
+    """
+    Arma el connection string de pyodbc a partir de config (DB_DRIVER,
+    DB_SERVER, DB_NAME, DB_TRUSTED, DB_USER / DB_PASSWORD encriptados o no).
+    """
+    DB_USER = maybe_decrypt(config.get("DB_USER", "")) if config.get("DB_USER") else ""
+    DB_PASSWORD = maybe_decrypt(config.get("DB_PASSWORD", "")) if config.get("DB_PASSWORD") else ""
+
+    if config.get("DB_TRUSTED", "yes").lower() == "yes":
+        return (
+            f"DRIVER={config['DB_DRIVER']};"
+            f"SERVER={config['DB_SERVER']};"
+            f"DATABASE={config['DB_NAME']};"
+            "Trusted_Connection=yes;"
+        )
+    return (
+        f"DRIVER={config['DB_DRIVER']};"
+        f"SERVER={config['DB_SERVER']};"
+        f"DATABASE={config['DB_NAME']};"
+        f"UID={DB_USER};"
+        f"PWD={DB_PASSWORD};"
+    )
+
+
+def es_error_conexion(e):
+    """
+    True si la excepción de pyodbc indica una conexión caída (vale la pena
+    reconectar y reintentar); False si es un error de la consulta en sí.
+    """
+    if isinstance(e, (pyodbc.OperationalError, pyodbc.InterfaceError)):
+        return True
+    return bool(getattr(e, "args", None)) and str(e.args[0]) in ESTADOS_CONEXION
+
+
+class _GuardiaHilo:
+    """
+    Objeto que solo vive en el threading.local del hilo: cuando el hilo
+    termina, el local se libera y su finalizador cierra la conexión.
+    """
+
+
+def espera_backoff(intento, base=SQL_BACKOFF_BASE, tope=SQL_BACKOFF_MAX):
+    """
+    Espera exponencial con jitter (50 % - 150 %) para el intento número 'intento'
+    (desde 1): varios hilos reconectando no golpean al servidor a la vez.
+    """
+    return min(tope, base * 2 ** (intento - 1)) * random.uniform(0.5, 1.5)
+
+
+class PoolSQL:
+    """
+    Conexión "lógica" que se pasa como 'conn' por todo el scanner. Cada hilo
+    usa su propia conexión pyodbc (pyodbc no permite compartirlas entre
+    hilos) con un cursor reutilizado, así las sentencias repetidas no se
+    vuelven a preparar. cursor(), commit() y rollback() actúan sobre la
+    conexión del hilo que llama, igual que con una conexión pyodbc. La
+    conexión de un hilo se cierra cuando el hilo termina (los hilos de los
+    ThreadPoolExecutor de cada ciclo no dejan conexiones abiertas).
+    Con spool (Datos/db_spool), si SQL Server no responde las escrituras se
+    guardan en disco y se reenvían en orden al volver la conexión.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.cadena = cadena_conexion(config)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conexiones = set()
+        self.spool = None
+        self.en_linea = True
+        self._fallos = 0
+        self._reintento_en = 0.0
+        self._reenvio_lock = threading.Lock()
+        self.al_reconectar = None  # callable -> bool, antes de volver a escribir (ej. migraciones)
+        try:
+            self.idle_check = float(config.get("SQL_IDLE_CHECK", SQL_IDLE_CHECK))
+        except (TypeError, ValueError):
+            self.idle_check = SQL_IDLE_CHECK
+
+    # ------------------------
+    # Conexión del hilo
+    # ------------------------
+    def _abrir(self, intentos=None):
+        """
+        Abre una conexión reintentando con backoff y jitter. Con intentos=None
+        reintenta indefinidamente. Lanza el último pyodbc.Error si se agotan.
+        """
+        intento = 0
+        while True:
+            intento += 1
+            try:
+                conn = pyodbc.connect(self.cadena, timeout=5)
+                break
+            except pyodbc.Error as e:
+                if intentos is not None and intento >= intentos:
+                    raise
+                espera = espera_backoff(intento)
+                print(f"[ERROR] No se pudo conectar a SQL Server: {e}")
+                print(f"  Reintentando en {espera:.0f} segundos...")
+                time.sleep(espera)
+
+        with self._lock:
+            self._conexiones.add(conn)
+        self._local.conn = conn
+        self._local.cursor = None
+        self._local.ultimo_uso = time.monotonic()
+        # Al terminar el hilo se libera su local y con él la guardia
+        guardia = _GuardiaHilo()
+        self._local.guardia = guardia
+        self._local.al_terminar = weakref.finalize(guardia, self._cerrar, conn)
+        return conn
+
+    def _cerrar(self, conn):
+        with self._lock:
+            if conn not in self._conexiones:
+                return
+            self._conexiones.discard(conn)
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+
+    def _viva(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1").fetchone()
+            cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def conexion(self, intentos=None):
+        """
+        Conexión pyodbc del hilo actual. Si estuvo sin uso más de
+        SQL_IDLE_CHECK segundos se verifica antes; si está caída se reabre
+        (un solo intento si hay spool: no se bloquea esperando al servidor).
+        """
+        if intentos is None and self.spool is not None:
+            intentos = 1
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            if time.monotonic() - self._local.ultimo_uso < self.idle_check or self._viva(conn):
+                self._local.ultimo_uso = time.monotonic()
+                return conn
+            escribir_log("Conexión SQL inactiva o caída; se reabre", tipo="WARNING")
+            self.descartar()
+        return self._abrir(intentos)
+
+    def descartar(self):
+        """
+        Cierra y olvida la conexión del hilo actual (la próxima se abre de cero).
+        """
+        conn = getattr(self._local, "conn", None)
+        al_terminar = getattr(self._local, "al_terminar", None)
+        self._local.conn = None
+        self._local.cursor = None
+        self._local.guardia = None
+        self._local.al_terminar = None
+        if al_terminar is not None:
+            al_terminar.detach()
+        if conn is None:
+            return
+        self._cerrar(conn)
+
+    # ------------------------
+    # Interfaz tipo pyodbc
+    # ------------------------
+    def cursor(self):
+        conn = self.conexion()
+        if self._local.cursor is None:
+            self._local.cursor = conn.cursor()
+        return self._local.cursor
+
+    def commit(self):
+        conn = getattr(self._local, "conn", None) or self.conexion()
+        conn.commit()
+
+    def rollback(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            try:
+                conn.rollback()
+            except pyodbc.Error:
+                pass
+
+    def close(self):
+        """
+        Cierra las conexiones de todos los hilos.
+        """
+        with self._lock:
+            conexiones = list(self._conexiones)
+        for conn in conexiones:
+            self._cerrar(conn)
+        self._local = threading.local()
+        if self.spool is not None:
+            self.spool.cerrar()
+            self.spool = None
+
+    # ------------------------
+    # Spool local
+    # ------------------------
+    def usar_spool(self):
+        """
+        True si las escrituras tienen que ir al spool: SQL Server caído, o
+        todavía quedan entradas viejas por reenviar (para no adelantarlas).
+        """
+        return self.spool is not None and (not self.en_linea or self.spool.pendientes > 0)
+
+    def diferir(self, entradas):
+        """
+        Guarda [(query, params, clave), ...] en el spool. Devuelve True si quedaron en disco.
+        """
+        if self.spool is None:
+            return False
+        try:
+            self.spool.guardar([(query, tuple(params), clave) for query, params, clave in entradas])
+            return True
+        except Exception as e:
+            escribir_log(f"No se pudo escribir en el spool local: {e}", tipo="ERROR")
+            return False
+
+    def _marcar_caida(self):
+        self._fallos += 1
+        self._reintento_en = time.monotonic() + espera_backoff(self._fallos)
+        if self.en_linea:
+            self.en_linea = False
+            escribir_log(f"SQL Server no disponible; escrituras al spool local ({self.spool.ruta})", tipo="WARNING")
+
+    def _revisar_spool(self):
+        """
+        Si SQL Server estaba caído y venció el backoff, prueba reconectar;
+        con la conexión arriba reenvía lo pendiente del spool.
+        """
+        if not self.en_linea and time.monotonic() >= self._reintento_en:
+            try:
+                self.conexion(intentos=1)
+                listo = self.al_reconectar() if self.al_reconectar else True
+            except pyodbc.Error:
+                listo = False
+            if listo:
+                self.en_linea = True
+                self._fallos = 0
+                escribir_log(f"SQL Server disponible de nuevo; {self.spool.pendientes} escrituras en el spool", tipo="INFO")
+            else:
+                self._marcar_caida()
+        if self.en_linea and self.spool.pendientes:
+            self._reenviar()
+
+    def _reenviar(self):
+        """
+        Reenvía el spool en orden, de a SQL_SPOOL_LOTE sentencias por
+        transacción, y borra cada lote recién después del commit. Un solo
+        hilo reenvía a la vez; los demás siguen escribiendo al spool.
+        """
+        if not self._reenvio_lock.acquire(blocking=False):
+            return
+        try:
+            total = 0
+            while True:
+                entradas = self.spool.leer(SQL_SPOOL_LOTE)
+                if not entradas:
+                    break
+                try:
+                    with self.transaccion() as cursor:
+                        for _, query, params in entradas:
+                            cursor.execute(query, params)
+                except pyodbc.Error as e:
+                    if es_error_conexion(e):
+                        self._marcar_caida()
+                        return
+                    # Una sentencia inválida no puede trabar el spool: se reenvía de a una
+                    entradas = self._reenviar_de_a_una(entradas)
+                self.spool.borrar([id_ for id_, _, _ in entradas])
+                total += len(entradas)
+            escribir_log(f"Spool local reenviado a SQL Server: {total} escrituras", tipo="INFO")
+        finally:
+            self._reenvio_lock.release()
+
+    def _reenviar_de_a_una(self, entradas):
+        """
+        Reenvía cada entrada en su propia transacción; las que fallan por la
+        consulta se descartan con log. Devuelve las entradas resueltas (hasta
+        la primera que falló por conexión, que queda en el spool).
+        """
+        resueltas = []
+        for entrada in entradas:
+            id_, query, params = entrada
+            try:
+                with self.transaccion() as cursor:
+                    cursor.execute(query, params)
+            except pyodbc.Error as e:
+                if es_error_conexion(e):
+                    self._marcar_caida()
+                    break
+                escribir_log(f"Entrada {id_} del spool descartada: {e}", tipo="ERROR")
+            resueltas.append(entrada)
+        return resueltas
+
+    # ------------------------
+    # Ejecución con reconexión
+    # ------------------------
+    def ejecutar(self, query, params=(), fetch=False, reintentos=SQL_REINTENTOS, clave=None, diferible=True):
+        """
+        Ejecuta y confirma 'query'. Ante una conexión caída la descarta,
+        espera con backoff y reintenta; un error de la consulta no se
+        reintenta. Devuelve las filas (fetch=True) o True; None si falló.
+        Con spool, una escritura que no puede llegar a SQL Server se guarda
+        en disco (con 'clave' reemplaza a la anterior de la misma fila) y
+        devuelve True; una lectura devuelve None mientras el servidor no está.
+        diferible=False va siempre directo a SQL Server (migraciones).
+        """
+        diferible = diferible and self.spool is not None
+        if diferible:
+            self._revisar_spool()
+            if not fetch and self.usar_spool():
+                return True if self.diferir([(query, params, clave)]) else None
+            if fetch and not self.en_linea:
+                return None
+
+        for intento in range(1, reintentos + 1):
+            try:
+                cursor = self.cursor()
+                cursor.execute(query, params)
+                datos = cursor.fetchall() if fetch else True
+                self.commit()
+                return datos
+            except pyodbc.Error as e:
+                self.rollback()
+                if not es_error_conexion(e):
+                    escribir_log(f"SQL error: {e}", tipo="ERROR")
+                    return None
+                escribir_log(f"SQL intento {intento}/{reintentos} fallido (conexión): {e}", tipo="ERROR")
+                self.descartar()
+                if intento < reintentos:
+                    time.sleep(espera_backoff(intento))
+
+        if diferible:
+            self._marcar_caida()
+            if not fetch and self.diferir([(query, params, clave)]):
+                return True
+        return None
+
+    @contextmanager
+    def transaccion(self):
+        """
+        Cursor del hilo para varias sentencias en una transacción: commit al
+        salir, rollback si hay excepción (y descarte si la conexión se cayó).
+        """
+        cursor = self.cursor()
+        try:
+            yield cursor
+            self.commit()
+        except pyodbc.Error as e:
+            self.rollback()
+            if es_error_conexion(e):
+                self.descartar()
+            raise
+        except Exception:
+            self.rollback()
+            raise
+
+
+def crear_pool(config, intentos=None, spool=False):
+    """
+    Crea el pool y abre la conexión del hilo actual (reintentando con
+    backoff; indefinidamente si intentos=None). Con spool=True abre el spool
+    local (SQL_SPOOL_PATH) y, si SQL Server no responde tras
+    SQL_CONECTAR_INTENTOS, arranca igual con las escrituras al spool.
+    """
+    pool = PoolSQL(config)
+    if not spool:
+        pool.conexion(intentos)
+        return pool
+
+    pool.spool = SpoolLocal(config.get("SQL_SPOOL_PATH", SQL_SPOOL_PATH))
+    try:
+        pool.conexion(intentos or SQL_CONECTAR_INTENTOS)
+    except pyodbc.Error as e:
+        print(f"[WARN] SQL Server no disponible ({e}); los resultados se guardan en el spool local.")
+        pool._marcar_caida()
+    return pool
@@ -0,0 +1,111 @@
+# ---------------------------------------
+# Archivo: Datos/db_spool.py
+# Spool local (SQLite en modo WAL) para las escrituras que no pudieron
+# llegar a SQL Server; se reenvían en orden cuando vuelve la conexión
+# ---------------------------------------
+
+import json
+import sqlite3
+import threading
+from datetime import date, datetime
+
+SQL_SPOOL_PATH = "spool_sql.db"
+SQL_SPOOL_LOTE = 500   # Sentencias reenviadas por transacción
+
+
+def spool_activo(config):
+    """
+    SQL_SPOOL (por defecto "si"): con SQL Server caído, las escrituras van
+    al spool local en lugar de frenar el escaneo.
+    """
+    return str((config or {}).get("SQL_SPOOL", "si")).lower() in ("yes", "si", "sí", "true", "1")
+
+
+def _a_json(valor):
+    if isinstance(valor, datetime):
+        return {"__datetime": valor.isoformat()}
+    if isinstance(valor, date):
+        return {"__date": valor.isoformat()}
+    return valor
+
+
+def _desde_json(valor):
+    if isinstance(valor, dict):
+        if "__datetime" in valor:
+            return datetime.fromisoformat(valor["__datetime"])
+        if "__date" in valor:
+            return date.fromisoformat(valor["__date"])
+    return valor
+
+
+class SpoolLocal:
+    """
+    Cola durable de sentencias (query + parámetros) en un archivo SQLite.
+    Cada entrada puede llevar una 'clave' (por ejemplo "EquiposAD:<nombre>"):
+    una entrada nueva con la misma clave reemplaza a la anterior, porque solo
+    importa el último estado de esa fila. Las sentencias deben ser
+    idempotentes (MERGE, UPDATE, INSERT con NOT EXISTS): si el proceso se
+    corta entre el commit en SQL Server y el borrado local, se reenvían.
+    """
+
+    def __init__(self, ruta=SQL_SPOOL_PATH):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS Spool (
+                Id INTEGER PRIMARY KEY AUTOINCREMENT,
+                Clave TEXT NULL,
+                Query TEXT NOT NULL,
+                Params TEXT NOT NULL,
+                Creado TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS IX_Spool_Clave ON Spool (Clave)")
+        self.pendientes = self._conn.execute("SELECT COUNT(*) FROM Spool").fetchone()[0]
+
+    def guardar(self, entradas):
+        """
+        Agrega [(query, params, clave), ...] en una sola transacción.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for query, params, clave in entradas:
+                    if clave:
+                        self._conn.execute("DELETE FROM Spool WHERE Clave = ?", (clave,))
+                    self._conn.execute(
+                        "INSERT INTO Spool (Clave, Query, Params) VALUES (?, ?, ?)",
+                        (clave, query, json.dumps([_a_json(p) for p in params]))
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.pendientes = self._conn.execute("SELECT COUNT(*) FROM Spool").fetchone()[0]
+
+    def leer(self, cantidad=SQL_SPOOL_LOTE):
+        """
+        Las 'cantidad' entradas más viejas: [(id, query, params), ...].
+        """
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT Id, Query, Params FROM Spool ORDER BY Id LIMIT ?", (cantidad,)
+            ).fetchall()
+        return [(id_, query, tuple(_desde_json(p) for p in json.loads(params))) for id_, query, params in filas]
+
+    def borrar(self, ids):
+        """
+        Quita del spool las entradas ya confirmadas en SQL Server.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany("DELETE FROM Spool WHERE Id = ?", [(id_,) for id_ in ids])
+            self._conn.execute("COMMIT")
+            self.pendientes = self._conn.execute("SELECT COUNT(*) FROM Spool").fetchone()[0]
+
+    def cerrar(self):
+        with self._lock:
+            self._conn.close()
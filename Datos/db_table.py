@@ -1,10 +1,36 @@
+from Configs.logs_utils import escribir_log
 from Datos.db_conexion import ejecutar_sql
 
-def crear_tabla(conn, config):
-    """
-    Crea la tabla EquiposAD si no existe, usando reconexión automática.
-    """
-    query = """
+# Códigos de estado guardados como TINYINT (migración 2); PingStatus y
+# EstadoAD pasan a ser columnas calculadas con el texto de siempre
+CODIGOS_PING = {"Inactivo": 0, "Activo": 1, "Timeout": 2, "Error": 3}
+CODIGOS_AD = {"Removido de AD": 0, "Dentro de AD": 1}
+CODIGOS_OUTBOX = {"Pendiente": 0, "Entregada": 1, "Descartada": 2}
+
+# Segundos en el estado actual (activo o inactivo), calculado al leer
+_SEGUNDOS_EN_ESTADO = "DATEDIFF(SECOND, COALESCE(ActivoDesde, InactivoDesde), SYSDATETIME())"
+
+# TiempoPing ("HH:MM:SS") y ActivoTiempo ("Nd HH:MM:SS") se calculan a partir
+# de las marcas de transición: no hace falta reescribir la fila mientras el
+# estado no cambia y no se pierden al reiniciar el script
+_TIEMPO_PING = (
+    f"CASE WHEN {_SEGUNDOS_EN_ESTADO} < 36000 THEN '0' ELSE '' END"
+    f" + CAST({_SEGUNDOS_EN_ESTADO} / 3600 AS VARCHAR(10))"
+    f" + RIGHT(CONVERT(VARCHAR(8), DATEADD(SECOND, {_SEGUNDOS_EN_ESTADO} % 3600, 0), 108), 6)"
+)
+_ACTIVO_TIEMPO = (
+    f"CASE WHEN ActivoDesde IS NOT NULL THEN"
+    f" CAST({_SEGUNDOS_EN_ESTADO} / 86400 AS VARCHAR(10)) + 'd '"
+    f" + CONVERT(VARCHAR(8), DATEADD(SECOND, {_SEGUNDOS_EN_ESTADO} % 86400, 0), 108) END"
+)
+
+# ------------------------
+# Migración 1: esquema base (tablas creadas por versiones anteriores)
+# ------------------------
+# Cada sentencia va en su propio lote: SQL Server no deja usar en un lote
+# una columna agregada por ALTER TABLE en ese mismo lote
+SENTENCIAS_TABLAS = [
+    f"""
         IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='EquiposAD' AND xtype='U')
         CREATE TABLE EquiposAD (
             Nombre NVARCHAR(255) PRIMARY KEY,
@@ -19,15 +45,304 @@ def crear_tabla(conn, config):
             Ubicacion NVARCHAR(255),
             EstadoCuenta NVARCHAR(50),
             PingStatus NVARCHAR(50),
-            TiempoPing NVARCHAR(50),
-            ActivoTiempo NVARCHAR(30) NULL,
-            InactivoDesde DATETIME NULL,
+            MetodoPing NVARCHAR(20) NULL,
+            ActivoDesde DATETIME2 NULL,
+            InactivoDesde DATETIME2 NULL,
+            TiempoPing AS ({_TIEMPO_PING}),
+            ActivoTiempo AS ({_ACTIVO_TIEMPO}),
             EstadoAD NVARCHAR(50) DEFAULT 'Dentro de AD',
             UltimoWebhook DATE NULL,
             UltimaActualizacion DATETIME DEFAULT GETDATE()
         )
+    """,
+
+    # Tablas creadas antes de los sondeos TCP
+    """
+        IF COL_LENGTH('EquiposAD', 'MetodoPing') IS NULL
+            ALTER TABLE EquiposAD ADD MetodoPing NVARCHAR(20) NULL
+    """,
+
+    # Tablas creadas con los contadores TiempoPing / ActivoTiempo
+    """
+        IF COL_LENGTH('EquiposAD', 'ActivoDesde') IS NULL
+            ALTER TABLE EquiposAD ADD ActivoDesde DATETIME2 NULL
+    """,
+    """
+        IF EXISTS (SELECT * FROM sys.columns c JOIN sys.types t ON c.user_type_id = t.user_type_id
+                   WHERE c.object_id = OBJECT_ID('EquiposAD') AND c.name = 'InactivoDesde'
+                     AND t.name = 'datetime')
+            ALTER TABLE EquiposAD ALTER COLUMN InactivoDesde DATETIME2 NULL
+    """,
+    """
+        IF COLUMNPROPERTY(OBJECT_ID('EquiposAD'), 'TiempoPing', 'IsComputed') = 0
+            ALTER TABLE EquiposAD DROP COLUMN TiempoPing
+    """,
+    f"""
+        IF COL_LENGTH('EquiposAD', 'TiempoPing') IS NULL
+            ALTER TABLE EquiposAD ADD TiempoPing AS ({_TIEMPO_PING})
+    """,
+    """
+        IF COLUMNPROPERTY(OBJECT_ID('EquiposAD'), 'ActivoTiempo', 'IsComputed') = 0
+            ALTER TABLE EquiposAD DROP COLUMN ActivoTiempo
+    """,
+    f"""
+        IF COL_LENGTH('EquiposAD', 'ActivoTiempo') IS NULL
+            ALTER TABLE EquiposAD ADD ActivoTiempo AS ({_ACTIVO_TIEMPO})
+    """,
+
+    # Ciclos que se pasaron de PING_INTERVAL (Modulos/ciclo.py)
+    """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='CiclosEscaneo' AND xtype='U')
+        CREATE TABLE CiclosEscaneo (
+            Id INT IDENTITY(1,1) PRIMARY KEY,
+            Inicio DATETIME NOT NULL,
+            Duracion FLOAT,
+            Presupuesto FLOAT,
+            DuracionAD FLOAT,
+            DuracionPing FLOAT,
+            DuracionSQL FLOAT,
+            DuracionAlertas FLOAT,
+            Equipos INT,
+            Recortados INT,
+            CiclosSaltados INT,
+            Accion NVARCHAR(20)
+        )
+    """,
+]
+
+
+# ------------------------
+# Migración 2: columnas tipadas, códigos de estado, índices y clave de AlertasEnviadas
+# ------------------------
+def _es_tipo(tabla, columna, tipo):
+    return (
+        f"EXISTS (SELECT * FROM sys.columns c JOIN sys.types t ON c.user_type_id = t.user_type_id"
+        f" WHERE c.object_id = OBJECT_ID('{tabla}') AND c.name = '{columna}' AND t.name = '{tipo}')"
+    )
+
+
+def _texto_codigo(columna, codigos):
+    casos = " ".join(f"WHEN {codigo} THEN N'{texto}'" for texto, codigo in codigos.items())
+    return f"CASE {columna} {casos} END"
+
+
+def _codigo_texto(columna, codigos):
+    casos = " ".join(f"WHEN N''{texto}'' THEN {codigo}" for texto, codigo in codigos.items())
+    return f"CASE {columna} {casos} END"
+
+
+def _convertir_columna(tabla, columna, tipo, expresion):
+    """
+    Pasos para cambiar el tipo de una columna NVARCHAR conservando los datos:
+    columna nueva, copia convertida, baja de la vieja y renombre. Cada paso
+    se puede repetir si la migración se cortó a mitad de camino.
+    """
+    nueva = f"{columna}Nuevo"
+    return [
+        f"""
+            IF {_es_tipo(tabla, columna, 'nvarchar')} AND COL_LENGTH('{tabla}', '{nueva}') IS NULL
+                ALTER TABLE {tabla} ADD {nueva} {tipo} NULL
+        """,
+        f"""
+            IF COL_LENGTH('{tabla}', '{nueva}') IS NOT NULL AND COL_LENGTH('{tabla}', '{columna}') IS NOT NULL
+                EXEC(N'UPDATE {tabla} SET {nueva} = {expresion}')
+        """,
+        f"""
+            IF COL_LENGTH('{tabla}', '{nueva}') IS NOT NULL AND COL_LENGTH('{tabla}', '{columna}') IS NOT NULL
+                ALTER TABLE {tabla} DROP COLUMN {columna}
+        """,
+        f"""
+            IF COL_LENGTH('{tabla}', '{nueva}') IS NOT NULL AND COL_LENGTH('{tabla}', '{columna}') IS NULL
+                EXEC sp_rename '{tabla}.{nueva}', '{columna}', 'COLUMN'
+        """,
+    ]
+
+
+def _codificar_columna(tabla, columna, codigo, codigos, definicion):
+    """
+    Pasos para reemplazar una columna de texto libre por un código TINYINT:
+    la columna de texto queda como columna calculada a partir del código.
+    """
+    return [
+        f"""
+            IF COL_LENGTH('{tabla}', '{codigo}') IS NULL
+                ALTER TABLE {tabla} ADD {codigo} {definicion}
+        """,
+        f"""
+            IF COLUMNPROPERTY(OBJECT_ID('{tabla}'), '{columna}', 'IsComputed') = 0
+                EXEC(N'UPDATE {tabla} SET {codigo} = COALESCE({_codigo_texto(columna, codigos)}, {codigo})')
+        """,
+        # El DEFAULT sin nombre de la columna vieja impide borrarla
+        f"""
+            DECLARE @restriccion SYSNAME = (
+                SELECT d.name FROM sys.default_constraints d
+                JOIN sys.columns c ON c.object_id = d.parent_object_id AND c.column_id = d.parent_column_id
+                WHERE d.parent_object_id = OBJECT_ID('{tabla}') AND c.name = '{columna}'
+            );
+            IF @restriccion IS NOT NULL
+                EXEC(N'ALTER TABLE {tabla} DROP CONSTRAINT ' + @restriccion)
+        """,
+        f"""
+            IF COLUMNPROPERTY(OBJECT_ID('{tabla}'), '{columna}', 'IsComputed') = 0
+                ALTER TABLE {tabla} DROP COLUMN {columna}
+        """,
+        f"""
+            IF COL_LENGTH('{tabla}', '{columna}') IS NULL
+                ALTER TABLE {tabla} ADD {columna} AS ({_texto_codigo(codigo, codigos)})
+        """,
+    ]
+
+
+# Fechas de AD como "2024-05-01 12:34:56+00:00" (UTC); "N/A" y el 1601 de
+# "nunca" quedan en NULL
+_FECHA_AD = "NULLIF(TRY_CONVERT(DATETIME2, LEFT({0}, 19), 120), ''1601-01-01'')"
+
+SENTENCIAS_TIPADAS = (
+    _convertir_columna("EquiposAD", "CreadoEl", "DATETIME2", _FECHA_AD.format("CreadoEl"))
+    + _convertir_columna("EquiposAD", "UltimoLogon", "DATETIME2", _FECHA_AD.format("UltimoLogon"))
+    + _convertir_columna("EquiposAD", "EstadoCuenta", "INT", "TRY_CONVERT(INT, EstadoCuenta)")
+    + _codificar_columna("EquiposAD", "PingStatus", "CodigoPing", CODIGOS_PING, "TINYINT NULL")
+    + _codificar_columna(
+        "EquiposAD", "EstadoAD", "CodigoAD", CODIGOS_AD,
+        f"TINYINT NOT NULL CONSTRAINT DF_EquiposAD_CodigoAD DEFAULT {CODIGOS_AD['Dentro de AD']}"
+    )
+    + [
+        """
+            IF COL_LENGTH('EquiposAD', 'FilaVersion') IS NULL
+                ALTER TABLE EquiposAD ADD FilaVersion ROWVERSION
+        """,
+        # Candidatos a alerta: equipos dentro de AD ordenados por InactivoDesde
+        """
+            IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_EquiposAD_CodigoAD_InactivoDesde'
+                           AND object_id = OBJECT_ID('EquiposAD'))
+                CREATE INDEX IX_EquiposAD_CodigoAD_InactivoDesde ON EquiposAD (CodigoAD, InactivoDesde)
+                    INCLUDE (IP, Descripcion, Responsable, Ubicacion, UltimoWebhook)
+        """,
+
+        # AlertasEnviadas con clave (Nombre, Fecha): la tabla vieja no tenía
+        # clave, así que primero se limpian nulos y duplicados
+        """
+            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='AlertasEnviadas' AND xtype='U')
+            CREATE TABLE AlertasEnviadas (
+                Nombre NVARCHAR(255) NOT NULL,
+                Fecha DATE NOT NULL,
+                CONSTRAINT PK_AlertasEnviadas PRIMARY KEY (Nombre, Fecha)
+            )
+        """,
+        """
+            IF OBJECT_ID('PK_AlertasEnviadas') IS NULL
+            BEGIN
+                DELETE FROM AlertasEnviadas WHERE Nombre IS NULL OR Fecha IS NULL;
+                WITH repetidas AS (
+                    SELECT ROW_NUMBER() OVER (PARTITION BY Nombre, Fecha ORDER BY (SELECT NULL)) AS n
+                    FROM AlertasEnviadas
+                )
+                DELETE FROM repetidas WHERE n > 1;
+            END
+        """,
+        """
+            IF OBJECT_ID('PK_AlertasEnviadas') IS NULL
+                ALTER TABLE AlertasEnviadas ALTER COLUMN Nombre NVARCHAR(255) NOT NULL
+        """,
+        """
+            IF OBJECT_ID('PK_AlertasEnviadas') IS NULL
+                ALTER TABLE AlertasEnviadas ALTER COLUMN Fecha DATE NOT NULL
+        """,
+        """
+            IF OBJECT_ID('PK_AlertasEnviadas') IS NULL
+                ALTER TABLE AlertasEnviadas ADD CONSTRAINT PK_AlertasEnviadas PRIMARY KEY (Nombre, Fecha)
+        """,
+    ]
+)
+
+# ------------------------
+# Migración 3: bandeja de salida de alertas (AlertOutbox)
+# ------------------------
+SENTENCIAS_OUTBOX = [
+    # Una fila por alerta; Clave ("<Nombre>:<Fecha>") es la clave de
+    # deduplicación: una alerta por equipo y día, se encole las veces que sea
+    """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='AlertOutbox' AND xtype='U')
+        CREATE TABLE AlertOutbox (
+            Id BIGINT IDENTITY(1,1) CONSTRAINT PK_AlertOutbox PRIMARY KEY,
+            Clave NVARCHAR(300) NOT NULL CONSTRAINT UQ_AlertOutbox_Clave UNIQUE,
+            Nombre NVARCHAR(255) NOT NULL,
+            Fecha DATE NOT NULL,
+            Payload NVARCHAR(MAX) NOT NULL,
+            Estado TINYINT NOT NULL CONSTRAINT DF_AlertOutbox_Estado DEFAULT 0,
+            Intentos INT NOT NULL CONSTRAINT DF_AlertOutbox_Intentos DEFAULT 0,
+            ProximoIntento DATETIME2 NOT NULL CONSTRAINT DF_AlertOutbox_Proximo DEFAULT SYSDATETIME(),
+            UltimoError NVARCHAR(500) NULL,
+            Creado DATETIME2 NOT NULL CONSTRAINT DF_AlertOutbox_Creado DEFAULT SYSDATETIME(),
+            Entregado DATETIME2 NULL
+        )
+    """,
+    # Lo que busca el entregador: pendientes vencidas, las más viejas primero
+    """
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_AlertOutbox_Estado_Proximo')
+            CREATE INDEX IX_AlertOutbox_Estado_Proximo ON AlertOutbox (Estado, ProximoIntento)
+    """,
+    # Los candidatos a alerta excluyen lo ya encolado hoy
     """
-    if ejecutar_sql(conn, query, config=config):
-        print("[OK] Tabla 'EquiposAD' verificada o creada.")
-    else:
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_AlertOutbox_Nombre_Fecha')
+            CREATE INDEX IX_AlertOutbox_Nombre_Fecha ON AlertOutbox (Nombre, Fecha)
+    """,
+]
+
+# (versión, descripción, sentencias). Solo se agregan al final: una versión
+# ya aplicada en alguna base no se modifica.
+MIGRACIONES = [
+    (1, "Esquema base: EquiposAD y CiclosEscaneo", SENTENCIAS_TABLAS),
+    (2, "Columnas tipadas, códigos de estado, índices y clave de AlertasEnviadas", SENTENCIAS_TIPADAS),
+    (3, "Bandeja de salida de alertas (AlertOutbox)", SENTENCIAS_OUTBOX),
+]
+VERSION_ESQUEMA = MIGRACIONES[-1][0]
+
+QUERY_TABLA_VERSIONES = """
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='VersionEsquema' AND xtype='U')
+    CREATE TABLE VersionEsquema (
+        Version INT PRIMARY KEY,
+        Descripcion NVARCHAR(200),
+        AplicadaEl DATETIME2 NOT NULL DEFAULT SYSDATETIME()
+    )
+"""
+
+estado_esquema = {"version": None}  # versión aplicada (None = sin verificar)
+
+
+def crear_tabla(conn, config):
+    """
+    Pone el esquema al día con las migraciones pendientes (MIGRACIONES) y
+    registra cada una en VersionEsquema. Una vez verificado no vuelve a
+    consultar la base, así que se puede llamar en cada reconexión.
+    Las sentencias van directo a SQL Server, nunca al spool local.
+    Devuelve True si el esquema quedó en VERSION_ESQUEMA.
+    """
+    if estado_esquema["version"] == VERSION_ESQUEMA:
+        return True
+
+    if not ejecutar_sql(conn, QUERY_TABLA_VERSIONES, config=config, spool=False):
         print("[ERROR] No se pudo crear/verificar la tabla.")
+        return False
+    filas = conn.ejecutar("SELECT ISNULL(MAX(Version), 0) FROM VersionEsquema", fetch=True, diferible=False)
+    if not filas:
+        print("[ERROR] No se pudo leer la versión del esquema.")
+        return False
+
+    version = filas[0][0]
+    for numero, descripcion, sentencias in MIGRACIONES:
+        if numero <= version:
+            continue
+        if not all(ejecutar_sql(conn, query, config=config, spool=False) for query in sentencias):
+            print(f"[ERROR] Falló la migración {numero} del esquema ({descripcion}).")
+            return False
+        ejecutar_sql(
+            conn, "INSERT INTO VersionEsquema (Version, Descripcion) VALUES (?, ?)",
+            (numero, descripcion), config=config, spool=False
+        )
+        escribir_log(f"Migración {numero} del esquema aplicada: {descripcion}", tipo="INFO")
+        version = numero
+
+    estado_esquema["version"] = version
+    print(f"[OK] Esquema verificado (versión {version}).")
+    return True
@@ -539,6 +539,10 @@ def abrir_gui_pro():
             "DB_PASSWORD": db_pass.get() if db_trusted.get().lower() != "yes" else "",
         }
 
+        # Conservar opciones avanzadas que se editan directo en Config.json
+        for clave, valor in config.items():
+            values.setdefault(clave, valor)
+
         if guardar_config(values):
             config_result = values
             root.destroy()
@@ -0,0 +1,206 @@
+# ---------------------------------------
+# Archivo: Modulos/ad_sync.py
+# Sincronización incremental del inventario de AD (uSNChanged)
+# ---------------------------------------
+
+from ldap3 import BASE
+from ldap3.protocol.microsoft import show_deleted_control
+from Configs.logs_utils import escribir_log
+from Datos.db_conexion_extras import ejecutar_sql_reintento
+from Datos.db_table import CODIGOS_AD
+from Modulos.ad_utils import (
+    ATRIBUTOS_EQUIPO, armar_equipo, buscar_paginado,
+    estado_ping, invalidar_conexion_ad, obtener_conexion_ad, olvidar_huellas,
+    page_size_ad, valor_atributo
+)
+
+# Cada cuántas pasadas incrementales se fuerza una lectura completa
+# (corrige equipos movidos fuera de AD_SEARCH_BASE, que el delta no ve)
+AD_SYNC_FULL_CADA = 120
+
+# Estado en memoria de la sincronización. Al reiniciar el script se
+# hace una lectura completa y se vuelve a tomar la marca de agua.
+estado_sync = {
+    "usn": None,             # highestCommittedUSN tomado antes de la última lectura
+    "dc": None,              # dsServiceName del DC que emitió la marca (el USN es por DC)
+    "naming_context": None,  # raíz del dominio, donde viven los objetos borrados
+    "inventario": {},        # objectGUID -> dict de equipo
+    "pasadas": 0,            # pasadas incrementales desde la última lectura completa
+}
+
+
+def _guid(resultado):
+    """
+    objectGUID crudo (bytes): sirve de clave estable aunque el equipo se renombre
+    o pase a ser un tombstone.
+    """
+    raw = resultado.get("raw_attributes", {}).get("objectGUID")
+    return raw[0] if raw else None
+
+
+def _leer_rootdse(conn):
+    """
+    Lee del rootDSE la marca de agua actual y la identidad del DC.
+    """
+    conn.search("", "(objectClass=*)", search_scope=BASE, attributes=[
+        "highestCommittedUSN", "dsServiceName", "defaultNamingContext"
+    ])
+    if not conn.response:
+        raise Exception("No se pudo leer el rootDSE")
+
+    atributos = conn.response[0]["attributes"]
+    return {
+        "usn": int(valor_atributo(atributos, "highestCommittedUSN")),
+        "dc": valor_atributo(atributos, "dsServiceName"),
+        "naming_context": valor_atributo(atributos, "defaultNamingContext"),
+    }
+
+
+def _sincronizacion_completa(conn, config, rootdse):
+    """
+    Lee todos los equipos y reemplaza el inventario.
+    Devuelve los nombres que estaban en el inventario anterior y ya no están.
+    """
+    inventario = {}
+    resultados = buscar_paginado(
+        conn, config["AD_SEARCH_BASE"], "(objectClass=computer)",
+        ATRIBUTOS_EQUIPO + ["objectGUID"], page_size_ad(config)
+    )
+    for resultado in resultados:
+        guid = _guid(resultado)
+        if guid:
+            inventario[guid] = armar_equipo(resultado["attributes"])
+
+    nombres_nuevos = {eq["nombre"] for eq in inventario.values()}
+    removidos = [
+        eq["nombre"] for eq in estado_sync["inventario"].values()
+        if eq["nombre"] not in nombres_nuevos
+    ]
+
+    estado_sync.update({
+        "usn": rootdse["usn"],
+        "dc": rootdse["dc"],
+        "naming_context": rootdse["naming_context"],
+        "inventario": inventario,
+        "pasadas": 0,
+    })
+    escribir_log(f"Sincronización AD completa: {len(inventario)} equipos (USN {rootdse['usn']})", tipo="INFO")
+    return removidos
+
+
+def _sincronizacion_incremental(conn, config, rootdse):
+    """
+    Pide al DC solo los equipos creados, modificados o borrados desde la
+    última marca de agua y aplica el delta sobre el inventario.
+    El delta se arma completo antes de aplicarlo: si la lectura falla,
+    el inventario y la marca de agua quedan como estaban.
+    """
+    desde = estado_sync["usn"] + 1
+    page_size = page_size_ad(config)
+
+    cambiados = {}
+    resultados = buscar_paginado(
+        conn, config["AD_SEARCH_BASE"],
+        f"(&(objectClass=computer)(uSNChanged>={desde}))",
+        ATRIBUTOS_EQUIPO + ["objectGUID"], page_size
+    )
+    for resultado in resultados:
+        guid = _guid(resultado)
+        if guid:
+            cambiados[guid] = armar_equipo(resultado["attributes"])
+
+    # Los borrados pasan a CN=Deleted Objects como tombstones: solo se ven
+    # con el control "show deleted" y buscando desde la raíz del dominio
+    borrados = []
+    resultados = buscar_paginado(
+        conn, estado_sync["naming_context"],
+        f"(&(objectClass=computer)(isDeleted=TRUE)(uSNChanged>={desde}))",
+        ["objectGUID"], page_size, controls=[show_deleted_control()]
+    )
+    for resultado in resultados:
+        guid = _guid(resultado)
+        if guid:
+            borrados.append(guid)
+
+    # Aplicar el delta
+    inventario = estado_sync["inventario"]
+    removidos = []
+    for guid, equipo in cambiados.items():
+        anterior = inventario.get(guid)
+        if anterior and anterior["nombre"] != equipo["nombre"]:
+            removidos.append(anterior["nombre"])  # renombrado
+        inventario[guid] = equipo
+
+    for guid in borrados:
+        anterior = inventario.pop(guid, None)
+        if anterior:
+            removidos.append(anterior["nombre"])
+
+    estado_sync["usn"] = rootdse["usn"]
+    estado_sync["pasadas"] += 1
+
+    if cambiados or removidos:
+        escribir_log(
+            f"Sincronización AD incremental: {len(cambiados)} cambiados, "
+            f"{len(removidos)} removidos (USN {rootdse['usn']})", tipo="INFO"
+        )
+    return removidos
+
+
+def sincronizar_equipos_ad(config):
+    """
+    Mantiene el inventario de equipos al día usando uSNChanged como marca de agua.
+    La primera pasada (o si cambia el DC, o cada AD_SYNC_FULL_CADA pasadas) lee
+    todo; las demás solo traen el delta desde la última marca.
+    Devuelve (equipos, removidos): la lista completa del inventario y los
+    nombres que salieron de AD en esta pasada.
+    Si AD falla, devuelve el último inventario conocido sin removidos.
+    """
+    try:
+        full_cada = int(config.get("AD_SYNC_FULL_CADA", AD_SYNC_FULL_CADA))
+    except (TypeError, ValueError):
+        full_cada = AD_SYNC_FULL_CADA
+
+    removidos = []
+    try:
+        conn = obtener_conexion_ad(config)
+        # La marca se toma ANTES de leer: lo que cambie durante la lectura
+        # vuelve a aparecer en el próximo delta (aplicarlo dos veces es inocuo)
+        rootdse = _leer_rootdse(conn)
+
+        completa = (
+            estado_sync["usn"] is None
+            or rootdse["dc"] != estado_sync["dc"]  # USN de otro DC no es comparable
+            or rootdse["usn"] < estado_sync["usn"]
+            or estado_sync["pasadas"] >= full_cada
+        )
+
+        if completa:
+            removidos = _sincronizacion_completa(conn, config, rootdse)
+        else:
+            removidos = _sincronizacion_incremental(conn, config, rootdse)
+
+    except Exception as e:
+        invalidar_conexion_ad()
+        escribir_log(f"Excepción en sincronización AD: {e}", tipo="ERROR")
+
+    return list(estado_sync["inventario"].values()), removidos
+
+
+# ------------------------
+# Marcar equipos removidos de AD
+# ------------------------
+def marcar_removidos_ad(conn, nombres):
+    """
+    Marca en EquiposAD los equipos que salieron de AD y deja de seguir su ping.
+    """
+    query = """
+        UPDATE EquiposAD
+        SET CodigoAD = ?, UltimaActualizacion = GETDATE()
+        WHERE Nombre = ?
+    """
+    for nombre in nombres:
+        ejecutar_sql_reintento(conn, query, (CODIGOS_AD["Removido de AD"], nombre))
+        estado_ping.pop(nombre, None)
+        olvidar_huellas([nombre])  # si vuelve a AD, su fila se reescribe
+        escribir_log(f"Equipo removido de AD: {nombre}", tipo="INFO")
@@ -1,19 +1,31 @@
 
-import socket
-import subprocess
-import platform
 import time
-from datetime import datetime
-from ldap3 import Server, Connection, ALL
-from Datos.db_conexion import conectar_sql
+from datetime import datetime, timezone
+from ldap3 import Server, Connection, NONE, BASE
+from ldap3.protocol.formatters.formatters import format_time, format_ad_timestamp, format_integer
+from Datos.db_conexion_extras import ejecutar_sql_fetch, ejecutar_sql_reintento
+from Datos.db_pool import espera_backoff
+from Datos.db_table import CODIGOS_AD, CODIGOS_PING
 from Configs.logs_utils import escribir_log
+from Modulos.dns_utils import resolver_equipos, ip_desde_dns_record, NO_RESUELVE
+from Modulos.ping_utils import (
+    hacer_ping_rtt, barrido_icmp, modo_tcp, ping_timeout, puertos_tcp, sondear_equipo, sondear_tcp_varios
+)
+from Modulos.escritor_sql import encolar_fila, escritor_activo, vaciar_escritor
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import RLock
 from cryptography.fernet import Fernet  # <-- nuevo
 
 estado_ping = {}
 
+# Avisos de configuración que se registran una sola vez por proceso
+avisos = {"barrido_paralelo": False}
+
+# Hilos de sondeo de insertar_o_actualizar: viven todo el proceso, así cada
+# uno conserva entre ciclos su conexión del pool, su cursor y sus sentencias
+# preparadas (PoolSQL cierra la conexión de un hilo cuando el hilo termina)
+ejecutores = {"sondeo": None, "hilos": 0}
+
 # ------------------------
 # Helpers de encriptación
 # ------------------------
@@ -51,6 +63,78 @@ def _maybe_decrypt(value):
 
 
 
+# ------------------------
+# Sesión LDAP persistente
+# ------------------------
+# Sin get_info=ALL no se descarga el esquema, así que los atributos que
+# ldap3 formateaba con él se formatean explícitamente (mismo resultado).
+FORMATO_AD = {
+    "whenCreated": format_time,
+    "lastLogonTimestamp": format_ad_timestamp,
+    "userAccountControl": format_integer,
+}
+
+# Segundos sin uso tras los cuales se verifica la conexión antes de usarla
+# (AD corta las conexiones inactivas a los 900 s por MaxConnIdleTime)
+AD_IDLE_CHECK = 300
+
+_sesion_ad = {"conn": None, "clave": None, "ultimo_uso": 0.0}
+_sesion_lock = RLock()
+
+
+def _conexion_viva(conn):
+    """
+    Consulta barata al rootDSE para saber si la conexión sigue abierta.
+    """
+    try:
+        return conn.search("", "(objectClass=*)", search_scope=BASE, attributes=["currentTime"])
+    except Exception:
+        return False
+
+
+def invalidar_conexion_ad():
+    """
+    Descarta la sesión actual; la próxima llamada a obtener_conexion_ad vuelve a autenticar.
+    Llamar cuando una operación LDAP falla.
+    """
+    with _sesion_lock:
+        conn = _sesion_ad["conn"]
+        _sesion_ad.update({"conn": None, "clave": None, "ultimo_uso": 0.0})
+    if conn:
+        try:
+            conn.unbind()
+        except Exception:
+            pass
+
+
+def obtener_conexion_ad(config):
+    """
+    Devuelve la conexión LDAP compartida (scanner y validador de la GUI),
+    autenticando solo la primera vez, cuando cambian las credenciales o
+    cuando la sesión anterior se invalidó por un error.
+    Acepta credenciales en texto plano o encriptadas.
+    """
+    server = config["AD_SERVER"]
+    user = _maybe_decrypt(config.get("AD_USER", ""))
+    password = _maybe_decrypt(config.get("AD_PASSWORD", ""))
+    clave = (server, user, password)
+
+    with _sesion_lock:
+        conn = _sesion_ad["conn"]
+        if conn and _sesion_ad["clave"] == clave and conn.bound and not conn.closed:
+            inactiva = time.monotonic() - _sesion_ad["ultimo_uso"]
+            if inactiva < AD_IDLE_CHECK or _conexion_viva(conn):
+                _sesion_ad["ultimo_uso"] = time.monotonic()
+                return conn
+
+        invalidar_conexion_ad()
+        srv = Server(server, get_info=NONE, connect_timeout=5, formatter=FORMATO_AD)
+        conn = Connection(srv, user=user, password=password, auto_bind=True, receive_timeout=30)
+        _sesion_ad.update({"conn": conn, "clave": clave, "ultimo_uso": time.monotonic()})
+        escribir_log(f"Sesión LDAP abierta con {server}", tipo="INFO")
+        return conn
+
+
 # ------------------------
 # Validar credenciales AD
 # ------------------------
@@ -58,244 +142,675 @@ def validar_ad(credenciales):
     """
     Valida paso por paso qué campo de Active Directory está incorrecto.
     Devuelve un diccionario con el primer error encontrado.
+    Si todo está bien, la sesión queda abierta y el scanner la reutiliza.
     """
     server = credenciales.get("AD_SERVER")
-    user = credenciales.get("AD_USER")
-    password = credenciales.get("AD_PASSWORD")
     base = credenciales.get("AD_SEARCH_BASE")
 
     # Validar que el servidor existe
-    try:
-        srv = Server(server, get_info=ALL)
-    except Exception as e:
-        return {"ok": False, "error": "AD_SERVER", "detalle": str(e)}
+    if not server:
+        return {"ok": False, "error": "AD_SERVER", "detalle": "AD_SERVER vacío"}
 
     # Validar credenciales
     try:
-        conn = Connection(srv, user=user, password=password, auto_bind=True)
+        conn = obtener_conexion_ad(credenciales)
     except Exception as e:
         return {"ok": False, "error": "AD_USER/AD_PASSWORD", "detalle": str(e)}
 
-    # Validar base de búsqueda
+    # Validar base de búsqueda (solo el objeto base, sin recorrer el subárbol)
     try:
-        conn.search(base, "(objectClass=*)", attributes=["cn"])
+        if not conn.search(base, "(objectClass=*)", search_scope=BASE, attributes=["cn"]):
+            invalidar_conexion_ad()
+            return {"ok": False, "error": "AD_SEARCH_BASE", "detalle": str(conn.result.get("description"))}
     except Exception as e:
+        invalidar_conexion_ad()
         return {"ok": False, "error": "AD_SEARCH_BASE", "detalle": str(e)}
 
     return {"ok": True}
+
+
 # ------------------------
 # Obtener equipos desde AD
 # ------------------------
+ATRIBUTOS_EQUIPO = [
+    "name", "dNSHostName", "operatingSystem", "operatingSystemVersion",
+    "description", "whenCreated", "lastLogonTimestamp", "managedBy",
+    "location", "userAccountControl"
+]
 
+# Tamaño de página por defecto (AD corta en MaxPageSize = 1000)
+AD_PAGE_SIZE = 500
 
-def obtener_equipos_ad(config):
+
+def valor_atributo(atributos, nombre):
     """
-    Obtiene los equipos de AD usando las credenciales actuales.
-    Acepta credenciales en texto plano o encriptadas.
+    Devuelve el atributo como texto, igual que str(entry.atributo) de ldap3:
+    un solo valor -> ese valor, varios -> la lista, ninguno -> "N/A".
+    """
+    valor = atributos.get(nombre)
+    if isinstance(valor, (list, tuple)):
+        if not valor:
+            return "N/A"
+        if len(valor) == 1:
+            valor = valor[0]
+    if valor is None or valor == "":
+        return "N/A"
+    return str(valor)
+
+
+def armar_equipo(atributos):
     """
-    equipos = []
+    Convierte los atributos de un objeto computer en el dict que usa el scanner.
+    La IP queda sin resolver; la completa resolver_equipos (Modulos/dns_utils).
+    """
+    return {
+        "nombre": valor_atributo(atributos, "name"),
+        "so": valor_atributo(atributos, "operatingSystem"),
+        "descripcion": valor_atributo(atributos, "description"),
+        "ip": NO_RESUELVE,
+        "nombredns": valor_atributo(atributos, "dNSHostName"),
+        "versionso": valor_atributo(atributos, "operatingSystemVersion"),
+        "creadoel": valor_atributo(atributos, "whenCreated"),
+        "ultimologon": valor_atributo(atributos, "lastLogonTimestamp"),
+        "responsable": valor_atributo(atributos, "managedBy"),
+        "ubicacion": valor_atributo(atributos, "location"),
+        "estadocuenta": valor_atributo(atributos, "userAccountControl")
+    }
+
+
+def page_size_ad(config):
+    """
+    Tamaño de página LDAP configurado en AD_PAGE_SIZE (por defecto 500).
+    """
+    try:
+        return int(config.get("AD_PAGE_SIZE", AD_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return AD_PAGE_SIZE
+
+
+def buscar_paginado(conn, base, filtro, atributos, page_size, controls=None):
+    """
+    Generador sobre una búsqueda LDAP con el control de resultados paginados
+    (Simple Paged Results). Entrega cada searchResEntry apenas llega su página.
+    Lanza excepción si el servidor corta la búsqueda con error, para que el
+    llamador no confunda un resultado parcial con uno completo.
+    """
+    resultados = conn.extend.standard.paged_search(
+        base,
+        filtro,
+        attributes=atributos,
+        controls=controls,
+        paged_size=page_size,
+        generator=True
+    )
+    for resultado in resultados:
+        # Las referencias (searchResRef) no traen atributos
+        if resultado.get("type") != "searchResEntry":
+            continue
+        yield resultado
+
+    if conn.result and conn.result.get("result", 0) != 0:
+        raise Exception(f"Búsqueda LDAP incompleta: {conn.result.get('description')} {conn.result.get('message', '')}")
+
+
+def iterar_equipos_ad(config, page_size=None, resumen=None):
+    """
+    Generador: recorre los equipos de AD página por página y entrega cada
+    equipo apenas llega su página, sin cargar todo el dominio en memoria.
+    El tamaño de página se toma de AD_PAGE_SIZE en config (por defecto 500).
+    Si se pasa 'resumen' (dict), al terminar queda {"ok": bool, "total": int}
+    para distinguir una lectura completa de una cortada por error.
+    """
+    if page_size is None:
+        page_size = page_size_ad(config)
+    if resumen is None:
+        resumen = {}
+    resumen.update({"ok": False, "total": 0})
+
+    total = 0
     try:
-        server = Server(config["AD_SERVER"], get_info=ALL)
-        user = _maybe_decrypt(config.get("AD_USER", ""))
-        password = _maybe_decrypt(config.get("AD_PASSWORD", ""))
-        conn = Connection(server, user=user, password=password, auto_bind=True)
-        conn.search(
-            config["AD_SEARCH_BASE"],
-            "(objectClass=computer)",
-            attributes=[
-                "name", "dNSHostName", "operatingSystem", "operatingSystemVersion",
-                "description", "whenCreated", "lastLogonTimestamp", "managedBy",
-                "location", "userAccountControl"
-            ]
+        conn = obtener_conexion_ad(config)
+        resultados = buscar_paginado(
+            conn, config["AD_SEARCH_BASE"], "(objectClass=computer)",
+            ATRIBUTOS_EQUIPO, page_size
         )
-        for entry in conn.entries:
-            nombre = str(entry.name)
-            so = str(entry.operatingSystem) if hasattr(entry, 'operatingSystem') else "N/A"
-            desc = str(entry.description) if hasattr(entry, 'description') else "N/A"
-            nombre_dns = str(entry.dNSHostName) if hasattr(entry, 'dNSHostName') else "N/A"
-            version_so = str(entry.operatingSystemVersion) if hasattr(entry, 'operatingSystemVersion') else "N/A"
-            creado_el = str(entry.whenCreated) if hasattr(entry, 'whenCreated') else "N/A"
-            ultimo_logon = str(entry.lastLogonTimestamp) if hasattr(entry, 'lastLogonTimestamp') else "N/A"
-            responsable = str(entry.managedBy) if hasattr(entry, 'managedBy') else "N/A"
-            ubicacion = str(entry.location) if hasattr(entry, 'location') else "N/A"
-            estado_cuenta = str(entry.userAccountControl) if hasattr(entry, 'userAccountControl') else "N/A"
-
-            try:
-                ip = socket.gethostbyname(nombre)
-            except socket.gaierror:
-                ip = "No resuelve"
-
-            equipos.append({
-                "nombre": nombre,
-                "so": so,
-                "descripcion": desc,
-                "ip": ip,
-                "nombredns": nombre_dns,
-                "versionso": version_so,
-                "creadoel": creado_el,
-                "ultimologon": ultimo_logon,
-                "responsable": responsable,
-                "ubicacion": ubicacion,
-                "estadocuenta": estado_cuenta
-            })
-
-        escribir_log(f"Equipos obtenidos desde AD: {len(equipos)}", tipo="INFO")
+        for resultado in resultados:
+            total += 1
+            resumen["total"] = total
+            yield armar_equipo(resultado["attributes"])
+
+        resumen["ok"] = True
+        escribir_log(f"Equipos obtenidos desde AD: {total}", tipo="INFO")
 
     except Exception as e:
-        escribir_log(f"Excepción al leer AD: {e}", tipo="ERROR")
+        invalidar_conexion_ad()
+        escribir_log(f"Excepción al leer AD (tras {total} equipos): {e}", tipo="ERROR")
 
-    return equipos
 
 # ------------------------
-# Función de ping
+# Mapa de IPs desde las zonas DNS integradas en AD
 # ------------------------
-def hacer_ping(host):
-    try:
-        param = "-n" if platform.system().lower() == "windows" else "-c"
-        result = subprocess.run(["ping", param, "1", host], capture_output=True, timeout=6)
-        estado = "Activo" if result.returncode == 0 else "Inactivo"
+def _zona_dns_dn(config):
+    """
+    DN de la zona DNS a leer: DNS_ZONA_DN si está en config; si no, la zona
+    del dominio de AD_SEARCH_BASE en la partición DomainDnsZones.
+    """
+    if config.get("DNS_ZONA_DN"):
+        return config["DNS_ZONA_DN"]
 
-        if estado != "Activo":
-            escribir_log(f"Ping fallido: {host} → {estado}", tipo="WARNING")
-        return estado
+    dominio = [p.strip() for p in config["AD_SEARCH_BASE"].split(",") if p.strip().upper().startswith("DC=")]
+    zona = ".".join(p[3:] for p in dominio)
+    return f"DC={zona},CN=MicrosoftDNS,DC=DomainDnsZones,{','.join(dominio)}"
+
+
+def leer_mapa_dns_ad(config):
+    """
+    Lee de una sola vez (búsqueda paginada) los registros A de la zona DNS
+    integrada en AD y devuelve {nombre: ip}, con el nombre corto y el FQDN
+    en minúsculas. Reemplaza miles de consultas DNS por una lectura LDAP.
+    Si falla, devuelve {} y resolver_equipos consulta al DNS como siempre.
+    """
+    zona_dn = _zona_dns_dn(config)
+    zona = zona_dn.split(",")[0].strip()[3:].lower()  # "DC=lab.local" -> "lab.local"
+    mapa = {}
+    try:
+        conn = obtener_conexion_ad(config)
+        resultados = buscar_paginado(
+            conn, zona_dn, "(&(objectClass=dnsNode)(!(dNSTombstoned=TRUE)))",
+            ["dc", "dnsRecord"], page_size_ad(config)
+        )
+        for resultado in resultados:
+            nodo = valor_atributo(resultado["attributes"], "dc").lower()
+            if nodo in ("n/a", "@"):
+                continue
+            for raw in resultado.get("raw_attributes", {}).get("dnsRecord", []):
+                ip = ip_desde_dns_record(raw)
+                if ip:
+                    mapa[nodo] = ip
+                    mapa[f"{nodo}.{zona}"] = ip
+                    break
+
+        escribir_log(f"Registros A leídos desde la zona DNS de AD ({zona}): {len(mapa) // 2}", tipo="INFO")
 
-    except subprocess.TimeoutExpired:
-        escribir_log(f"Ping timeout: {host}", tipo="ERROR")
-        return "Timeout"
     except Exception as e:
-        escribir_log(f"Error en ping {host}: {e}", tipo="ERROR")
-        return "Error"
+        invalidar_conexion_ad()
+        escribir_log(f"Excepción al leer la zona DNS de AD: {e}", tipo="ERROR")
+        return {}
+
+    return mapa
+
+
+def obtener_equipos_ad(config):
+    """
+    Obtiene los equipos de AD usando las credenciales actuales.
+    Acepta credenciales en texto plano o encriptadas.
+    Devuelve la lista completa con IPs resueltas; para procesar por páginas
+    usar iterar_equipos_ad + resolver_equipos.
+    Con DNS_MODO = "ad" las IPs salen de la zona DNS de AD (leer_mapa_dns_ad).
+    """
+    mapa = leer_mapa_dns_ad(config) if config.get("DNS_MODO", "").lower() == "ad" else None
+    return list(resolver_equipos(iterar_equipos_ad(config), config, mapa=mapa))
+
+# ------------------------
+# Función de ping
+# ------------------------
+def hacer_ping(host, config=None):
+    """
+    Devuelve solo el estado del ping (ver ping_utils.hacer_ping_rtt).
+    """
+    estado, _ = hacer_ping_rtt(host, config)
+    return estado
 
 # ------------------------
-# Ejecutar SQL con reintento
+# Insertar o actualizar equipos con multithreading para ping
 # ------------------------
-def ejecutar_sql_reintento(conn, query, params=(), reintentos=3, espera=5):
+# Segundos acumulados en los MERGE de EquiposAD (los lee Modulos/ciclo.py)
+metricas_sql = {"segundos": 0.0}
+
+
+def destino_ping(eq):
+    """
+    Con la IP ya resuelta al leer AD, el ping no vuelve a consultar DNS.
+    """
+    return eq["ip"] if eq["ip"] != NO_RESUELVE else eq["nombre"]
+
+
+# MERGE de una fila de resultado (ver preparar_resultado)
+QUERY_MERGE_EQUIPO = """
+    MERGE EquiposAD AS target
+    USING (SELECT ? AS Nombre, ? AS SO, ? AS Descripcion, ? AS IP, ? AS NombreDNS,
+                  ? AS VersionSO, ? AS CreadoEl, ? AS UltimoLogon, ? AS Responsable,
+                  ? AS Ubicacion, ? AS EstadoCuenta, ? AS CodigoPing, ? AS ActivoDesde,
+                  ? AS InactivoDesde, ? AS CodigoAD, ? AS MetodoPing) AS src
+    ON target.Nombre = src.Nombre
+    WHEN MATCHED THEN
+        UPDATE SET target.SO = src.SO,
+                   target.Descripcion = src.Descripcion,
+                   target.IP = src.IP,
+                   target.NombreDNS = src.NombreDNS,
+                   target.VersionSO = src.VersionSO,
+                   target.CreadoEl = src.CreadoEl,
+                   target.UltimoLogon = src.UltimoLogon,
+                   target.Responsable = src.Responsable,
+                   target.Ubicacion = src.Ubicacion,
+                   target.EstadoCuenta = src.EstadoCuenta,
+                   target.CodigoPing = src.CodigoPing,
+                   target.ActivoDesde = src.ActivoDesde,
+                   target.InactivoDesde = src.InactivoDesde,
+                   target.CodigoAD = src.CodigoAD,
+                   target.MetodoPing = src.MetodoPing,
+                   target.UltimaActualizacion = GETDATE()
+    WHEN NOT MATCHED THEN
+        INSERT (Nombre, SO, Descripcion, IP, NombreDNS, VersionSO, CreadoEl,
+                UltimoLogon, Responsable, Ubicacion, EstadoCuenta, CodigoPing,
+                ActivoDesde, InactivoDesde, CodigoAD, MetodoPing)
+        VALUES (src.Nombre, src.SO, src.Descripcion, src.IP, src.NombreDNS,
+                src.VersionSO, src.CreadoEl, src.UltimoLogon, src.Responsable,
+                src.Ubicacion, src.EstadoCuenta, src.CodigoPing, src.ActivoDesde,
+                src.InactivoDesde, src.CodigoAD, src.MetodoPing);
+"""
+
+# Modo SQL_MODO = "lote": los resultados del ciclo se cargan en una tabla
+# temporal con fast_executemany y se aplican con un solo MERGE por lote
+SQL_LOTE = 1000
+
+QUERY_TEMP_RESULTADOS = """
+    IF OBJECT_ID('tempdb..#ResultadosPing') IS NOT NULL DROP TABLE #ResultadosPing;
+    CREATE TABLE #ResultadosPing (
+        Nombre NVARCHAR(255) PRIMARY KEY,
+        SO NVARCHAR(255),
+        Descripcion NVARCHAR(255),
+        IP NVARCHAR(50),
+        NombreDNS NVARCHAR(255),
+        VersionSO NVARCHAR(255),
+        CreadoEl DATETIME2 NULL,
+        UltimoLogon DATETIME2 NULL,
+        Responsable NVARCHAR(255),
+        Ubicacion NVARCHAR(255),
+        EstadoCuenta INT NULL,
+        CodigoPing TINYINT NULL,
+        ActivoDesde DATETIME2 NULL,
+        InactivoDesde DATETIME2 NULL,
+        CodigoAD TINYINT NOT NULL,
+        MetodoPing NVARCHAR(20) NULL
+    );
+"""
+
+QUERY_INSERT_TEMP = """
+    INSERT INTO #ResultadosPing (Nombre, SO, Descripcion, IP, NombreDNS, VersionSO, CreadoEl,
+                                 UltimoLogon, Responsable, Ubicacion, EstadoCuenta, CodigoPing,
+                                 ActivoDesde, InactivoDesde, CodigoAD, MetodoPing)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+QUERY_MERGE_LOTE = """
+    MERGE EquiposAD AS target
+    USING #ResultadosPing AS src
+    ON target.Nombre = src.Nombre
+    WHEN MATCHED THEN
+        UPDATE SET target.SO = src.SO,
+                   target.Descripcion = src.Descripcion,
+                   target.IP = src.IP,
+                   target.NombreDNS = src.NombreDNS,
+                   target.VersionSO = src.VersionSO,
+                   target.CreadoEl = src.CreadoEl,
+                   target.UltimoLogon = src.UltimoLogon,
+                   target.Responsable = src.Responsable,
+                   target.Ubicacion = src.Ubicacion,
+                   target.EstadoCuenta = src.EstadoCuenta,
+                   target.CodigoPing = src.CodigoPing,
+                   target.ActivoDesde = src.ActivoDesde,
+                   target.InactivoDesde = src.InactivoDesde,
+                   target.CodigoAD = src.CodigoAD,
+                   target.MetodoPing = src.MetodoPing,
+                   target.UltimaActualizacion = GETDATE()
+    WHEN NOT MATCHED THEN
+        INSERT (Nombre, SO, Descripcion, IP, NombreDNS, VersionSO, CreadoEl,
+                UltimoLogon, Responsable, Ubicacion, EstadoCuenta, CodigoPing,
+                ActivoDesde, InactivoDesde, CodigoAD, MetodoPing)
+        VALUES (src.Nombre, src.SO, src.Descripcion, src.IP, src.NombreDNS,
+                src.VersionSO, src.CreadoEl, src.UltimoLogon, src.Responsable,
+                src.Ubicacion, src.EstadoCuenta, src.CodigoPing, src.ActivoDesde,
+                src.InactivoDesde, src.CodigoAD, src.MetodoPing);
+"""
+
+
+def _duracion(desde):
+    """
+    Tiempo transcurrido desde 'desde' como "Nd HH:MM:SS" (solo para mostrar).
+    """
+    segundos = int((datetime.now() - desde).total_seconds()) if desde else 0
+    return f"{segundos // 86400}d {segundos % 86400 // 3600:02}:{segundos % 3600 // 60:02}:{segundos % 60:02}"
+
+
+def _fecha_ad(texto):
+    """
+    Fecha de AD en texto ("2024-05-01 12:34:56+00:00") a DATETIME2 en UTC;
+    "N/A" o el 1601 de "nunca" -> None.
+    """
+    try:
+        fecha = datetime.fromisoformat(texto)
+    except (TypeError, ValueError):
+        return None
+    if fecha.tzinfo:
+        fecha = fecha.astimezone(timezone.utc).replace(tzinfo=None)
+    return None if fecha.year <= 1601 else fecha
+
+
+def _entero(texto):
+    try:
+        return int(texto)
+    except (TypeError, ValueError):
+        return None
+
+
+def preparar_resultado(eq, ping, rtt, estado_ad, metodo=None):
+    """
+    Actualiza estado_ping con el resultado del sondeo y devuelve la fila
+    para EquiposAD (parámetros de QUERY_MERGE_EQUIPO / QUERY_INSERT_TEMP).
+    'metodo' es lo que probó que el equipo está vivo ("ICMP", "TCP/445"...).
+    Fechas, userAccountControl y estados van con sus tipos de columna
+    (DATETIME2, INT y los códigos TINYINT de Datos/db_table).
+    En lugar de contadores se guardan las marcas de la última transición
+    (ActivoDesde / InactivoDesde): mientras el estado no cambie, la fila
+    tampoco, y TiempoPing / ActivoTiempo se calculan en SQL al leer.
+    """
+    inactivo = ping in ("Inactivo", "Timeout", "Error")
+
+    # Actualizar estado_ping
+    if eq["nombre"] in estado_ping:
+        anterior = estado_ping[eq["nombre"]]["estado"]
+        if anterior != ping:
+            escribir_log(f"Estado de {eq['nombre']} cambió de {anterior} a {ping}")
+            estado_ping[eq["nombre"]]["estado"] = ping
+            estado_ping[eq["nombre"]]["contador"] = 1
+        else:
+            estado_ping[eq["nombre"]]["contador"] += 1
+    else:
+        estado_ping[eq["nombre"]] = {"estado": ping, "contador": 1}
+
+    estado = estado_ping[eq["nombre"]]
+    estado["rtt"] = rtt
+    estado["metodo"] = metodo
+
+    # Marcar la transición solo cuando cambia de activo a inactivo o al revés
+    if inactivo:
+        estado["activo_desde"] = None
+        if not estado.get("inactivo_desde"):
+            estado["inactivo_desde"] = datetime.now()
+    else:
+        estado["inactivo_desde"] = None
+        if not estado.get("activo_desde"):
+            estado["activo_desde"] = datetime.now()
+
+    fila = (
+        eq["nombre"], eq["so"], eq["descripcion"], eq["ip"], eq["nombredns"],
+        eq["versionso"], _fecha_ad(eq["creadoel"]), _fecha_ad(eq["ultimologon"]), eq["responsable"],
+        eq["ubicacion"], _entero(eq["estadocuenta"]), CODIGOS_PING.get(ping), estado["activo_desde"],
+        estado["inactivo_desde"], CODIGOS_AD[estado_ad], metodo
+    )
+
+    desde = estado["inactivo_desde"] or estado["activo_desde"]
+    texto_rtt = f" {rtt} ms" if rtt is not None else ""
+    texto_rtt += f" ({metodo})" if metodo and metodo != "ICMP" else ""
+    print(f"[PING] {eq['nombre']} ({eq['ip']}) → {ping}{texto_rtt} | {estado_ad} ({_duracion(desde)} desde {desde:%Y-%m-%d %H:%M:%S})")
+    return fila
+
+
+def cargar_estado_ping(conn):
+    """
+    Carga de EquiposAD el último estado y sus marcas de transición, así el
+    tiempo activo/inactivo sigue contando después de reiniciar el script.
+    """
+    filas = ejecutar_sql_fetch(conn, """
+        SELECT Nombre, PingStatus, ActivoDesde, InactivoDesde
+        FROM EquiposAD
+        WHERE CodigoPing IS NOT NULL AND CodigoAD = ?
+    """, (CODIGOS_AD["Dentro de AD"],))
+    for nombre, ping, activo_desde, inactivo_desde in filas:
+        estado_ping[nombre] = {
+            "estado": ping, "contador": 1,
+            "activo_desde": activo_desde, "inactivo_desde": inactivo_desde,
+        }
+    escribir_log(f"Estado de ping cargado desde EquiposAD: {len(filas)} equipos", tipo="INFO")
+
+
+# SQL_SOLO_CAMBIOS: huella de la última fila escrita por equipo. Solo se
+# escribe si cambió algo o si pasaron SQL_HEARTBEAT segundos (0 = nunca).
+SQL_HEARTBEAT = 3600
+huellas_sql = {}  # nombre -> (huella, instante monotonic de la escritura)
+
+
+def hay_cambios(fila, config=None):
+    """
+    Con SQL_SOLO_CAMBIOS activo, devuelve False si la fila es igual a la
+    última escrita para ese equipo y el heartbeat no venció. Si hay que
+    escribir, registra la nueva huella (olvidar_huellas la descarta si la
+    escritura falla). Sin SQL_SOLO_CAMBIOS siempre devuelve True.
+    """
+    config = config or {}
+    if str(config.get("SQL_SOLO_CAMBIOS", "no")).lower() not in ("yes", "si", "sí", "true", "1"):
+        return True
+    try:
+        heartbeat = float(config.get("SQL_HEARTBEAT", SQL_HEARTBEAT))
+    except (TypeError, ValueError):
+        heartbeat = SQL_HEARTBEAT
+
+    huella = tuple(fila)
+    ahora = time.monotonic()
+    anterior = huellas_sql.get(fila[0])
+    if anterior and anterior[0] == huella and (heartbeat <= 0 or ahora - anterior[1] < heartbeat):
+        return False
+    huellas_sql[fila[0]] = (huella, ahora)
+    return True
+
+
+def olvidar_huellas(nombres):
+    """
+    Descarta la huella de estos equipos: la próxima fila se escribe sí o sí.
+    """
+    for nombre in nombres:
+        huellas_sql.pop(nombre, None)
+
+
+def registrar_resultado(conn, eq, ping, rtt, estado_ad, metodo=None, config=None):
+    """
+    Actualiza estado_ping y hace el MERGE del equipo en EquiposAD (una fila,
+    una transacción) si hay cambios (ver hay_cambios). Lo usan tanto el modo
+    por hilos como el asíncrono.
+    """
+    fila = preparar_resultado(eq, ping, rtt, estado_ad, metodo)
+    if not hay_cambios(fila, config):
+        return
+    inicio = time.monotonic()
+    if not ejecutar_sql_reintento(conn, QUERY_MERGE_EQUIPO, fila, clave=f"EquiposAD:{fila[0]}"):
+        olvidar_huellas([fila[0]])
+    metricas_sql["segundos"] += time.monotonic() - inicio
+
+
+def sql_lote(config):
+    """
+    SQL_LOTE configurado (filas por MERGE), o 0 si SQL_MODO no es "lote".
+    """
+    config = config or {}
+    if str(config.get("SQL_MODO", "fila")).lower() != "lote":
+        return 0
+    try:
+        return max(1, int(config.get("SQL_LOTE", SQL_LOTE)))
+    except (TypeError, ValueError):
+        return SQL_LOTE
+
+
+def _merge_lote(conn, filas, reintentos=3):
+    """
+    Carga 'filas' en #ResultadosPing y aplica un único MERGE, todo en una
+    transacción sobre la conexión del hilo (PoolSQL.transaccion, que
+    descarta la conexión si se cayó). Devuelve True si se confirmó.
+    Con SQL Server caído (o spool pendiente) no se intenta: ver guardar_resultados_lote.
+    """
+    if conn.usar_spool():
+        return False
     for intento in range(1, reintentos + 1):
         try:
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            conn.commit()
+            with conn.transaccion() as cursor:
+                cursor.execute(QUERY_TEMP_RESULTADOS)
+                cursor.fast_executemany = True
+                cursor.executemany(QUERY_INSERT_TEMP, filas)
+                cursor.execute(QUERY_MERGE_LOTE)
             return True
         except Exception as e:
-            escribir_log(f"SQL intento {intento} fallido: {e}", tipo="ERROR")
+            escribir_log(f"MERGE por lote intento {intento} fallido ({len(filas)} filas): {e}", tipo="ERROR")
             if intento < reintentos:
-                time.sleep(espera)
-                # Intentar reconectar (si conectar_sql soporta config debería recibir config)
-                try:
-                    conn = conectar_sql()
-                except Exception:
-                    pass
-            else:
-                return False
+                time.sleep(espera_backoff(intento))
+    return False
 
-# ------------------------
-# Insertar o actualizar equipos con multithreading para ping
-# ------------------------
-# Lock global para acceso a SQL
-sql_lock = Lock()
 
+def guardar_resultados_lote(conn, filas, lote=SQL_LOTE):
+    """
+    Escribe las filas de un ciclo en EquiposAD con MERGE set-based, de a
+    'lote' filas por transacción. Si un equipo aparece dos veces vale la
+    última fila (el MERGE no admite claves repetidas en el origen).
+    Si el lote no llega a SQL Server, con spool sus filas quedan en disco
+    como MERGE de una fila y cuentan como guardadas.
+    Devuelve la cantidad de filas confirmadas.
+    """
+    filas = list({fila[0]: fila for fila in filas}.values())
+    guardadas = 0
+    for desde in range(0, len(filas), lote):
+        bloque = filas[desde:desde + lote]
+        inicio = time.monotonic()
+        if _merge_lote(conn, bloque) or conn.diferir(
+            [(QUERY_MERGE_EQUIPO, fila, f"EquiposAD:{fila[0]}") for fila in bloque]
+        ):
+            guardadas += len(bloque)
+        else:
+            olvidar_huellas([fila[0] for fila in bloque])
+        metricas_sql["segundos"] += time.monotonic() - inicio
+    return guardadas
 
-def insertar_o_actualizar(conn, equipos, equipos_ad_actuales, ping_interval, max_threads=10):
+
+def escribir_grupo(conn, filas):
     """
-    Inserta o actualiza los registros de AD en la base de datos.
-    Los pings se hacen en paralelo, pero las consultas SQL se serializan usando un lock.
+    Función de escritura del escritor SQL (Modulos/escritor_sql): un grupo
+    de filas en una sola transacción sobre la conexión del hilo escritor.
     """
+    return guardar_resultados_lote(conn, filas, max(1, len(filas)))
 
-    def procesar_equipo(eq):
-        ping = hacer_ping(eq["nombre"])
-        estado_ad = "Dentro de AD" if eq["nombre"] in equipos_ad_actuales else "Removido de AD"
 
-        # Actualizar estado_ping
-        if eq["nombre"] in estado_ping:
-            anterior = estado_ping[eq["nombre"]]["estado"]
-            if anterior != ping:
-                escribir_log(f"Estado de {eq['nombre']} cambió de {anterior} a {ping}")
-                estado_ping[eq["nombre"]]["estado"] = ping
-                estado_ping[eq["nombre"]]["contador"] = 1
-            else:
-                estado_ping[eq["nombre"]]["contador"] += 1
-        else:
-            estado_ping[eq["nombre"]] = {"estado": ping, "contador": 1}
+def ejecutor_sondeo(max_threads):
+    """
+    ThreadPoolExecutor de sondeo compartido entre ciclos (se crea una vez, o
+    de nuevo si cambia la cantidad de hilos).
+    """
+    if ejecutores["sondeo"] is None or ejecutores["hilos"] != max_threads:
+        if ejecutores["sondeo"] is not None:
+            ejecutores["sondeo"].shutdown(wait=True)
+        ejecutores["sondeo"] = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="sondeo")
+        ejecutores["hilos"] = max_threads
+    return ejecutores["sondeo"]
+
 
-        inactivo_desde = estado_ping[eq["nombre"]].get("inactivo_desde")
-        if ping in ("Inactivo", "Timeout", "Error"):
-            if not inactivo_desde:
-                estado_ping[eq["nombre"]]["inactivo_desde"] = datetime.now()
+def detener_ejecutores():
+    """
+    Cierra los hilos de sondeo (y con ellos sus conexiones del pool). Se
+    llama al terminar el programa.
+    """
+    if ejecutores["sondeo"] is not None:
+        ejecutores["sondeo"].shutdown(wait=True)
+    ejecutores.update({"sondeo": None, "hilos": 0})
+
+
+def insertar_o_actualizar(conn, equipos, equipos_ad_actuales, ping_interval, max_threads=10, config=None):
+    """
+    Inserta o actualiza los registros de AD en la base de datos.
+    Los pings se hacen en paralelo; cada hilo escribe por su propia conexión del pool.
+    'equipos' puede ser una lista o un generador (iterar_equipos_ad): cada equipo
+    se encola apenas llega. Si equipos_ad_actuales es None, todos se consideran
+    dentro de AD. 'config' elige el motor de ping (PING_MODO, PING_TIMEOUT) y
+    los puertos TCP de respaldo (TCP_PUERTOS, TCP_MODO).
+    Con PING_MODO = "barrido" todos los equipos se sondean juntos desde un solo
+    socket (barrido_icmp); los que no responden pasan por sondear_tcp_varios y
+    después se registran los resultados. Los equipos sin IP (NO_RESUELVE: el
+    DNS, con su caché negativa, ya falló) quedan Inactivo sin sondearse. En ese modo TCP siempre es respaldo:
+    TCP_MODO = "paralelo" no aplica (se avisa una vez en el log).
+    Con SQL_MODO = "lote" las filas del ciclo se juntan y se escriben al final
+    con guardar_resultados_lote (un MERGE por cada SQL_LOTE filas).
+    Con SQL_MODO = "escritor" cada fila va a la cola del escritor SQL
+    (Modulos/escritor_sql), que agrupa los commits en su propio hilo; el
+    escaneo solo espera a que la cola se vacíe al terminar.
+    Con SQL_SOLO_CAMBIOS solo se escriben los equipos que cambiaron (hay_cambios).
+    Devuelve la cantidad de equipos procesados.
+    """
+    lote = sql_lote(config)
+    escritor = escritor_activo()
+    filas = []
+
+    def procesar_equipo(eq, resultado=None):
+        ping, rtt, metodo = resultado or sondear_equipo(destino_ping(eq), config)
+        if equipos_ad_actuales is None or eq["nombre"] in equipos_ad_actuales:
+            estado_ad = "Dentro de AD"
         else:
-            estado_ping[eq["nombre"]]["inactivo_desde"] = None
-
-        # Calcular tiempo total en segundos
-        tiempo_total_segundos = estado_ping[eq["nombre"]]["contador"] * ping_interval
-
-        # Formato viejo (HH:MM:SS) para compatibilidad
-        horas = tiempo_total_segundos // 3600
-        minutos = (tiempo_total_segundos % 3600) // 60
-        segundos = tiempo_total_segundos % 60
-        tiempo_formateado = f"{horas:02}:{minutos:02}:{segundos:02}"
-
-        # Nuevo campo ActivoTiempo (NULL si está inactivo)
-        if ping not in ("Inactivo", "Timeout", "Error"):
-            dias = tiempo_total_segundos // 86400
-            horas_activo = (tiempo_total_segundos % 86400) // 3600
-            minutos_activo = (tiempo_total_segundos % 3600) // 60
-            segundos_activo = tiempo_total_segundos % 60
-            activo_tiempo = f"{dias}d {horas_activo:02}:{minutos_activo:02}:{segundos_activo:02}"
+            estado_ad = "Removido de AD"
+
+        if lote or escritor:
+            fila = preparar_resultado(eq, ping, rtt, estado_ad, metodo)
+            if not hay_cambios(fila, config):
+                return
+            if escritor:
+                encolar_fila(fila)
+            else:
+                filas.append(fila)
         else:
-            activo_tiempo = None  # Pasará como NULL a SQL Server
-
-        # Preparar fecha de inactivo para SQL Server
-        inactivo_sql = estado_ping[eq["nombre"]]["inactivo_desde"]
-        
-
-        query = """
-            MERGE EquiposAD AS target
-            USING (SELECT ? AS Nombre, ? AS SO, ? AS Descripcion, ? AS IP, ? AS NombreDNS,
-                          ? AS VersionSO, ? AS CreadoEl, ? AS UltimoLogon, ? AS Responsable,
-                          ? AS Ubicacion, ? AS EstadoCuenta, ? AS PingStatus, ? AS TiempoPing,
-                          ? AS InactivoDesde, ? AS EstadoAD, ? AS ActivoTiempo) AS src
-            ON target.Nombre = src.Nombre
-            WHEN MATCHED THEN
-                UPDATE SET target.SO = src.SO,
-                           target.Descripcion = src.Descripcion,
-                           target.IP = src.IP,
-                           target.NombreDNS = src.NombreDNS,
-                           target.VersionSO = src.VersionSO,
-                           target.CreadoEl = src.CreadoEl,
-                           target.UltimoLogon = src.UltimoLogon,
-                           target.Responsable = src.Responsable,
-                           target.Ubicacion = src.Ubicacion,
-                           target.EstadoCuenta = src.EstadoCuenta,
-                           target.PingStatus = src.PingStatus,
-                           target.TiempoPing = src.TiempoPing,
-                           target.InactivoDesde = src.InactivoDesde,
-                           target.EstadoAD = src.EstadoAD,
-                           target.ActivoTiempo = src.ActivoTiempo,
-                           target.UltimaActualizacion = GETDATE()
-            WHEN NOT MATCHED THEN
-                INSERT (Nombre, SO, Descripcion, IP, NombreDNS, VersionSO, CreadoEl,
-                        UltimoLogon, Responsable, Ubicacion, EstadoCuenta, PingStatus,
-                        TiempoPing, InactivoDesde, EstadoAD, ActivoTiempo)
-                VALUES (src.Nombre, src.SO, src.Descripcion, src.IP, src.NombreDNS,
-                        src.VersionSO, src.CreadoEl, src.UltimoLogon, src.Responsable,
-                        src.Ubicacion, src.EstadoCuenta, src.PingStatus, src.TiempoPing,
-                        src.InactivoDesde, src.EstadoAD, src.ActivoTiempo);
-        """
-
-        with sql_lock:
-            ejecutar_sql_reintento(conn, query, (
-                eq["nombre"], eq["so"], eq["descripcion"], eq["ip"], eq["nombredns"],
-                eq["versionso"], eq["creadoel"], eq["ultimologon"], eq["responsable"],
-                eq["ubicacion"], eq["estadocuenta"], ping, tiempo_formateado,
-                inactivo_sql, estado_ad, activo_tiempo
-            ))
-
-        texto_fecha = f" | Inactivo desde: {estado_ping[eq['nombre']].get('inactivo_desde')}" if estado_ping[eq["nombre"]].get('inactivo_desde') else ""
-        print(f"[PING] {eq['nombre']} ({eq['ip']}) → {ping} | {estado_ad} ({tiempo_formateado}){texto_fecha}")
+            registrar_resultado(conn, eq, ping, rtt, estado_ad, metodo, config)
+
+    if (config or {}).get("PING_MODO", "").lower() == "barrido":
+        equipos = list(equipos)
+        # Al barrido solo van IPs: un nombre sin resolver se consultaría al DNS
+        # en medio del envío (frenando a todo el bloque) y en cada ciclo
+        sin_ip = [eq for eq in equipos if eq["ip"] == NO_RESUELVE]
+        con_ip = [eq for eq in equipos if eq["ip"] != NO_RESUELVE]
+        try:
+            resultados = barrido_icmp([eq["ip"] for eq in con_ip], config)
+        except PermissionError as e:
+            escribir_log(f"Barrido ICMP no permitido ({e}); se sondea host por host", tipo="WARNING")
+            resultados = None
+
+        if resultados is not None:
+            resultados = {
+                destino: (estado, rtt, "ICMP" if estado == "Activo" else None)
+                for destino, (estado, rtt) in resultados.items()
+            }
+            puertos = puertos_tcp(config)
+            if puertos and modo_tcp(config) == "paralelo" and not avisos["barrido_paralelo"]:
+                avisos["barrido_paralelo"] = True
+                escribir_log(
+                    "PING_MODO = barrido ignora TCP_MODO = paralelo: TCP solo para los que no responden ICMP",
+                    tipo="WARNING"
+                )
+            sin_respuesta = [destino for destino, r in resultados.items() if r[0] != "Activo"]
+            if puertos and sin_respuesta:
+                resultados.update(sondear_tcp_varios(sin_respuesta, puertos, ping_timeout(config)))
+
+            for eq in con_ip:
+                procesar_equipo(eq, resultados[eq["ip"]])
+            for eq in sin_ip:
+                procesar_equipo(eq, ("Inactivo", None, None))
+            if filas:
+                guardar_resultados_lote(conn, filas, lote)
+            if escritor:
+                vaciar_escritor()
+            return len(equipos)
 
     # Ejecutar pings en paralelo
-    with ThreadPoolExecutor(max_workers=max_threads) as executor:
-        futures = [executor.submit(procesar_equipo, eq) for eq in equipos]
-        for _ in as_completed(futures):
-            pass
+    executor = ejecutor_sondeo(max_threads)
+    futures = [executor.submit(procesar_equipo, eq) for eq in equipos]
+    for _ in as_completed(futures):
+        pass
+
+    if filas:
+        guardar_resultados_lote(conn, filas, lote)
+    if escritor:
+        vaciar_escritor()
+    return len(futures)
 
 
@@ -0,0 +1,175 @@
+# ---------------------------------------
+# Archivo: Modulos/ciclo.py
+# Ciclo a ritmo fijo: presupuesto por fase y manejo de atrasos
+# ---------------------------------------
+
+import math
+import time
+from datetime import datetime
+from Configs.logs_utils import escribir_log
+from Datos.db_conexion_extras import ejecutar_sql_reintento
+from Modulos.ad_utils import estado_ping, metricas_sql
+
+# Qué hacer cuando un ciclo se pasa de PING_INTERVAL:
+#   "saltar":    se pierden los ciclos vencidos y se retoma en el próximo tick
+#   "recortar":  igual que saltar, y el ciclo siguiente deja afuera los equipos
+#                de menor prioridad para entrar en el presupuesto
+#   "recuperar": los ciclos vencidos arrancan sin espera (hasta CICLO_RECUPERAR_MAX)
+CICLO_SOBRECARGA = "saltar"
+CICLO_RECUPERAR_MAX = 3
+
+# Parte de PING_INTERVAL asignada a cada fase (se puede cambiar con
+# CICLO_PRESUPUESTO_AD, CICLO_PRESUPUESTO_PING, ... en la configuración)
+CICLO_PRESUPUESTO = {"ad": 0.15, "ping": 0.55, "sql": 0.2, "alertas": 0.1}
+
+estado_ciclo = {
+    "proximo": None,        # instante (monotonic) en que arranca el próximo ciclo
+    "costo_equipo": None,   # segundos de ping + SQL por equipo (promedio móvil)
+    "recortados": set(),    # equipos que quedaron afuera en el último ciclo
+    "excedidos": 0,         # ciclos que se pasaron del presupuesto desde el arranque
+}
+
+
+def iniciar_ciclo():
+    """
+    Marca el arranque de un ciclo. Devuelve la medición que completan las fases.
+    """
+    return {"inicio": time.monotonic(), "fecha": datetime.now(), "fases": {}, "sql_inicial": metricas_sql["segundos"]}
+
+
+def presupuesto_fase(config, fase, intervalo):
+    """
+    Segundos de PING_INTERVAL que le tocan a una fase.
+    """
+    try:
+        parte = float(config.get(f"CICLO_PRESUPUESTO_{fase.upper()}", CICLO_PRESUPUESTO[fase]))
+    except (TypeError, ValueError):
+        parte = CICLO_PRESUPUESTO[fase]
+    return intervalo * parte
+
+
+def iniciar_escaneo(medicion):
+    """
+    Marca el arranque del escaneo. Guarda el tiempo de AD acumulado hasta acá:
+    lo que la lectura de AD/DNS sume durante el escaneo no es tiempo de ping.
+    Devuelve el instante de arranque.
+    """
+    medicion["ad_al_escanear"] = medicion["fases"].get("ad", 0.0)
+    return time.monotonic()
+
+
+def cerrar_escaneo(medicion, inicio_escaneo):
+    """
+    Reparte el tiempo del escaneo entre AD, ping y SQL: el MERGE se mide en
+    registrar_resultado, la lectura de AD/DNS en el generador que la
+    consume (main._leer_y_cachear), el resto es espera de ping.
+    """
+    total = time.monotonic() - inicio_escaneo
+    sql = metricas_sql["segundos"] - medicion["sql_inicial"]
+    ad = medicion["fases"].get("ad", 0.0) - medicion.pop("ad_al_escanear", medicion["fases"].get("ad", 0.0))
+    medicion["fases"]["sql"] = sql
+    medicion["fases"]["ping"] = max(0.0, total - sql - ad)
+
+
+def _prioridad(eq):
+    """
+    0: quedó afuera el ciclo anterior | 1: activo o sin historia | 2: inactivo.
+    """
+    if eq["nombre"] in estado_ciclo["recortados"]:
+        return 0
+    estado = estado_ping.get(eq["nombre"])
+    if estado and estado["estado"] != "Activo":
+        return 2
+    return 1
+
+
+def recortar_equipos(equipos, intervalo, config):
+    """
+    Con CICLO_SOBRECARGA = "recortar", deja solo los equipos que entran en el
+    presupuesto de ping + SQL según el costo por equipo medido. Los que quedan
+    afuera pasan primero en el ciclo siguiente, así ninguno se posterga dos veces.
+    Devuelve la lista a sondear (o 'equipos' sin tocar si no hace falta recortar).
+    """
+    costo = estado_ciclo["costo_equipo"]
+    if config.get("CICLO_SOBRECARGA", CICLO_SOBRECARGA).lower() != "recortar" or not costo:
+        return equipos
+
+    equipos = list(equipos)
+    capacidad = int((presupuesto_fase(config, "ping", intervalo) + presupuesto_fase(config, "sql", intervalo)) / costo)
+    if len(equipos) <= capacidad:
+        estado_ciclo["recortados"] = set()
+        return equipos
+
+    ordenados = sorted(equipos, key=_prioridad)
+    estado_ciclo["recortados"] = {eq["nombre"] for eq in ordenados[capacidad:]}
+    escribir_log(
+        f"Ciclo recortado: {len(estado_ciclo['recortados'])} de {len(equipos)} equipos quedan para el próximo ciclo",
+        tipo="WARNING"
+    )
+    return ordenados[:capacidad]
+
+
+def _registrar_exceso(conn, medicion, duracion, intervalo, equipos, accion, saltados):
+    """
+    Deja constancia del ciclo excedido en el log y en la tabla CiclosEscaneo.
+    """
+    fases = medicion["fases"]
+    estado_ciclo["excedidos"] += 1
+    detalle = ", ".join(f"{fase} {segundos:.1f}s" for fase, segundos in fases.items())
+    escribir_log(
+        f"Ciclo excedido: {duracion:.1f}s de {intervalo}s ({detalle}); "
+        f"{equipos} equipos; acción: {accion}; ciclos saltados: {saltados}",
+        tipo="WARNING"
+    )
+
+    query = """
+        INSERT INTO CiclosEscaneo (Inicio, Duracion, Presupuesto, DuracionAD, DuracionPing,
+                                   DuracionSQL, DuracionAlertas, Equipos, Recortados,
+                                   CiclosSaltados, Accion)
+        SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (SELECT 1 FROM CiclosEscaneo WHERE Inicio = ?)
+    """
+    ejecutar_sql_reintento(conn, query, (
+        medicion["fecha"], round(duracion, 3), intervalo,
+        round(fases.get("ad", 0.0), 3), round(fases.get("ping", 0.0), 3),
+        round(fases.get("sql", 0.0), 3), round(fases.get("alertas", 0.0), 3),
+        equipos, len(estado_ciclo["recortados"]), saltados, accion,
+        medicion["fecha"]  # idempotente si se reenvía desde el spool local
+    ))
+
+
+def cerrar_ciclo(conn, medicion, equipos, intervalo, config):
+    """
+    Cierra el ciclo: controla el presupuesto de cada fase, registra el exceso
+    si lo hubo y calcula cuánto dormir para que los ciclos arranquen a ritmo
+    fijo (cada PING_INTERVAL desde el primero, no PING_INTERVAL después de
+    terminar). Devuelve los segundos de espera.
+    """
+    ahora = time.monotonic()
+    duracion = ahora - medicion["inicio"]
+    accion = config.get("CICLO_SOBRECARGA", CICLO_SOBRECARGA).lower()
+
+    for fase, segundos in medicion["fases"].items():
+        if fase in CICLO_PRESUPUESTO and segundos > presupuesto_fase(config, fase, intervalo):
+            escribir_log(f"Fase {fase} fuera de presupuesto: {segundos:.1f}s", tipo="WARNING")
+
+    if equipos:
+        costo = (medicion["fases"].get("ping", 0.0) + medicion["fases"].get("sql", 0.0)) / equipos
+        anterior = estado_ciclo["costo_equipo"]
+        estado_ciclo["costo_equipo"] = costo if anterior is None else 0.7 * anterior + 0.3 * costo
+
+    proximo = (estado_ciclo["proximo"] or medicion["inicio"]) + intervalo
+    saltados = 0
+    if ahora > proximo:
+        atraso = ahora - proximo
+        if accion == "recuperar" and atraso <= CICLO_RECUPERAR_MAX * intervalo:
+            pass  # arrancar ya, sin perder la grilla
+        else:
+            saltados = math.ceil(atraso / intervalo)
+            proximo += saltados * intervalo
+
+    if duracion > intervalo:
+        _registrar_exceso(conn, medicion, duracion, intervalo, equipos, accion, saltados)
+
+    estado_ciclo["proximo"] = proximo
+    return max(0.0, proximo - time.monotonic())
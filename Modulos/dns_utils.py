@@ -0,0 +1,162 @@
+# ---------------------------------------
+# Archivo: Modulos/dns_utils.py
+# Resolución DNS concurrente con caché (positiva y negativa)
+# ---------------------------------------
+
+import socket
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
+from Configs.logs_utils import escribir_log
+from Datos.db_conexion_extras import ejecutar_sql_fetch
+
+DNS_WORKERS = 50        # Consultas DNS simultáneas
+DNS_TTL = 1200          # Segundos que se reutiliza una IP resuelta (TTL por defecto de AD DNS)
+DNS_NEG_TTL = 60        # Espera inicial antes de reintentar un nombre que no resuelve
+DNS_NEG_TTL_MAX = 3600  # Tope del backoff para nombres que siguen sin resolver
+
+NO_RESUELVE = "No resuelve"
+
+# gaierror que indican DNS caído o lento (no que el nombre no exista):
+# EAI_AGAIN en Linux, WSATRY_AGAIN (11002) en Windows
+_ERRORES_TRANSITORIOS = {getattr(socket, "EAI_AGAIN", -3), 11002}
+
+# host -> {"ip": str | None, "expira": monotonic, "fallos": int}
+cache_dns = {}
+# nombre -> última IP conocida en EquiposAD.IP (respaldo si el DNS no responde)
+ips_conocidas = {}
+_cache_lock = Lock()
+
+
+def cargar_ips_conocidas(conn):
+    """
+    Carga las IPs guardadas en EquiposAD para usarlas como respaldo
+    cuando el DNS no está disponible.
+    """
+    filas = ejecutar_sql_fetch(conn, "SELECT Nombre, IP FROM EquiposAD WHERE IP IS NOT NULL AND IP <> ?", (NO_RESUELVE,))
+    for nombre, ip in filas:
+        ips_conocidas[nombre] = ip
+    escribir_log(f"IPs conocidas cargadas desde EquiposAD: {len(ips_conocidas)}", tipo="INFO")
+
+
+def ip_desde_dns_record(raw):
+    """
+    Extrae la IPv4 de un valor dnsRecord (estructura DNS_RECORD de MS-DNSP).
+    Cabecera de 24 bytes: DataLength(2) Type(2) Version(1) Rank(1) Flags(2)
+    Serial(4) TtlSeconds(4) Reserved(4) TimeStamp(4), luego los datos.
+    Devuelve None si no es un registro A.
+    """
+    if len(raw) < 28:
+        return None
+    largo, tipo = struct.unpack_from("<HH", raw, 0)
+    if tipo != 1 or largo != 4:  # 1 = DNS_TYPE_A
+        return None
+    return socket.inet_ntoa(raw[24:28])
+
+
+def _host_de(eq):
+    """
+    Nombre a consultar: el FQDN de dNSHostName si existe, si no el nombre corto.
+    """
+    nombre_dns = eq.get("nombredns")
+    if nombre_dns and nombre_dns != "N/A":
+        return nombre_dns
+    return eq["nombre"]
+
+
+def _desde_cache(host):
+    """
+    Devuelve (encontrado, ip) si hay una respuesta vigente en caché.
+    """
+    with _cache_lock:
+        entrada = cache_dns.get(host)
+    if entrada and entrada["expira"] > time.monotonic():
+        return True, entrada["ip"] or NO_RESUELVE
+    return False, None
+
+
+def _resolver_host(host, nombre, ttl, neg_ttl):
+    """
+    Resuelve un host y actualiza la caché.
+    - Éxito: se guarda por 'ttl' segundos.
+    - Nombre inexistente: "No resuelve" con backoff exponencial.
+    - DNS caído: última IP conocida (caché vencida o EquiposAD.IP), sin cachear.
+    """
+    try:
+        ip = socket.gethostbyname(host)
+        with _cache_lock:
+            cache_dns[host] = {"ip": ip, "expira": time.monotonic() + ttl, "fallos": 0}
+        ips_conocidas[nombre] = ip
+        return ip
+
+    except socket.gaierror as e:
+        if e.errno not in _ERRORES_TRANSITORIOS:
+            with _cache_lock:
+                fallos = cache_dns.get(host, {}).get("fallos", 0) + 1
+                espera = min(neg_ttl * 2 ** (fallos - 1), DNS_NEG_TTL_MAX)
+                cache_dns[host] = {"ip": None, "expira": time.monotonic() + espera, "fallos": fallos}
+            return NO_RESUELVE
+        error = e
+
+    except OSError as e:
+        error = e
+
+    with _cache_lock:
+        anterior = cache_dns.get(host, {}).get("ip")
+    ip = anterior or ips_conocidas.get(nombre)
+    escribir_log(f"DNS no disponible para {host} ({error}); se usa IP conocida: {ip}", tipo="WARNING")
+    return ip or NO_RESUELVE
+
+
+def resolver_equipos(equipos, config=None, mapa=None):
+    """
+    Generador: resuelve la IP de cada equipo en paralelo (DNS_WORKERS consultas
+    a la vez) y entrega cada equipo apenas tiene su IP en eq["ip"].
+    Acepta una lista o un generador (iterar_equipos_ad): los equipos se
+    resuelven a medida que llegan, sin esperar a la última página.
+    Las respuestas en caché se entregan sin consultar al DNS.
+    Si se pasa 'mapa' (nombre -> IP, ver leer_mapa_dns_ad), se usa primero
+    y solo los equipos que no aparecen en él se consultan al DNS.
+    """
+    config = config or {}
+    try:
+        workers = int(config.get("DNS_WORKERS", DNS_WORKERS))
+        ttl = int(config.get("DNS_TTL", DNS_TTL))
+        neg_ttl = int(config.get("DNS_NEG_TTL", DNS_NEG_TTL))
+    except (TypeError, ValueError):
+        workers, ttl, neg_ttl = DNS_WORKERS, DNS_TTL, DNS_NEG_TTL
+
+    def resolver(eq):
+        eq["ip"] = _resolver_host(_host_de(eq), eq["nombre"], ttl, neg_ttl)
+        return eq
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pendientes = set()
+        for eq in equipos:
+            if mapa:
+                ip = mapa.get(_host_de(eq).lower()) or mapa.get(eq["nombre"].lower())
+                if ip:
+                    eq["ip"] = ip
+                    ips_conocidas[eq["nombre"]] = ip
+                    yield eq
+                    continue
+
+            encontrado, ip = _desde_cache(_host_de(eq))
+            if encontrado:
+                eq["ip"] = ip
+                yield eq
+                continue
+
+            pendientes.add(executor.submit(resolver, eq))
+
+            # Limitar lo que queda en vuelo para no acumular todo el dominio
+            if len(pendientes) >= workers * 4:
+                listos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    yield futuro.result()
+
+        while pendientes:
+            listos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                yield futuro.result()
@@ -0,0 +1,286 @@
+# ---------------------------------------
+# Archivo: Modulos/escaneo_async.py
+# Ciclo de escaneo con asyncio: miles de sondeos concurrentes en un hilo
+# ---------------------------------------
+
+import asyncio
+import itertools
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from Configs.logs_utils import escribir_log
+from Modulos.ad_utils import (
+    destino_ping, guardar_resultados_lote, hay_cambios, preparar_resultado, registrar_resultado,
+    sql_lote
+)
+from Modulos.escritor_sql import encolar_fila, escritor_activo, vaciar_escritor
+from Modulos.ping_utils import (
+    abrir_socket_icmp, leer_echo_reply, modo_tcp, paquete_echo, ping_pps, ping_timeout,
+    puertos_tcp, sondear_equipo
+)
+
+ESCANEO_CONCURRENCIA = 2000  # Sondeos en vuelo a la vez
+ESCANEO_HILOS = 50           # Hilos para el ping del sistema si no hay sockets ICMP
+ESCANEO_SOCKETS_WINDOWS = 500  # select() de Windows admite 512 sockets por loop
+
+# Ejecutores del modo async: viven todo el proceso, así el hilo "sql"
+# conserva entre ciclos su conexión del pool y sus sentencias preparadas
+# (PoolSQL cierra la conexión de un hilo cuando el hilo termina)
+ejecutores_async = {"sql": None, "ad": None, "ping": None}
+
+
+def _ejecutor(nombre, hilos):
+    if ejecutores_async[nombre] is None:
+        ejecutores_async[nombre] = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix=nombre)
+    return ejecutores_async[nombre]
+
+
+def detener_ejecutores_async():
+    """
+    Cierra los ejecutores del modo async (y la conexión del hilo "sql").
+    Se llama al terminar el programa.
+    """
+    for nombre, executor in ejecutores_async.items():
+        if executor is not None:
+            executor.shutdown(wait=True)
+        ejecutores_async[nombre] = None
+
+
+def _abrir_motor_icmp(loop, pps):
+    """
+    Motor ICMP asíncrono sobre un único socket: cada sondeo registra un futuro
+    por (ip, secuencia) y el lector del loop lo completa al llegar la respuesta.
+    Los envíos salen a 'pps' paquetes por segundo (PING_PPS, igual que el
+    barrido de ping_utils): a ráfaga libre las respuestas desbordan el buffer
+    de recepción y equipos encendidos quedan Inactivo.
+    Devuelve (sondear, cerrar). Lanza PermissionError si no hay sockets ICMP.
+    """
+    sock, es_raw = abrir_socket_icmp()
+    sock.setblocking(False)
+    icmp_id = os.getpid() & 0xFFFF
+    secuencias = itertools.cycle(range(1, 65536))
+    esperando = {}  # (ip, seq) -> futuro con el instante de llegada
+    intervalo = 1.0 / pps if pps > 0 else 0.0
+    ritmo = {"proximo": loop.time()}  # turno del próximo envío (un solo hilo: sin lock)
+
+    async def esperar_turno():
+        if not intervalo:
+            return
+        ahora = loop.time()
+        turno = max(ahora, ritmo["proximo"])
+        ritmo["proximo"] = turno + intervalo
+        if turno > ahora:
+            await asyncio.sleep(turno - ahora)
+
+    def al_recibir():
+        while True:
+            try:
+                data, direccion = sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            echo = leer_echo_reply(data)
+            if not echo or (es_raw and echo[0] != icmp_id):
+                continue
+            futuro = esperando.pop((direccion[0], echo[1]), None)
+            if futuro and not futuro.done():
+                futuro.set_result(loop.time())
+
+    loop.add_reader(sock.fileno(), al_recibir)
+
+    async def sondear(ip, timeout):
+        seq = next(secuencias)
+        clave = (ip, seq)
+        futuro = loop.create_future()
+        esperando[clave] = futuro
+        try:
+            await esperar_turno()
+            while True:
+                try:
+                    sock.sendto(paquete_echo(icmp_id, seq), (ip, 0))
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(0.005)  # buffer de envío lleno
+            enviado = loop.time()
+            recibido = await asyncio.wait_for(futuro, timeout)
+            return "Activo", round((recibido - enviado) * 1000, 2)
+        except asyncio.TimeoutError:
+            escribir_log(f"Ping fallido: {ip} → Inactivo", tipo="WARNING")
+            return "Inactivo", None
+        except OSError as e:
+            escribir_log(f"Ping fallido: {ip} → Inactivo ({e})", tipo="WARNING")
+            return "Inactivo", None
+        finally:
+            esperando.pop(clave, None)
+
+    def cerrar():
+        loop.remove_reader(sock.fileno())
+        sock.close()
+
+    return sondear, cerrar
+
+
+async def _conectar_tcp(ip, puerto, timeout):
+    """
+    Un connect() TCP. Devuelve ("Activo", rtt_ms, "TCP/<puerto>") si el equipo
+    contesta (SYN-ACK o RST), None si no.
+    """
+    loop = asyncio.get_running_loop()
+    inicio = loop.time()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, puerto), timeout)
+        writer.close()
+    except ConnectionRefusedError:
+        pass
+    except (asyncio.TimeoutError, OSError):
+        return None
+    return "Activo", round((loop.time() - inicio) * 1000, 2), f"TCP/{puerto}"
+
+
+async def _primer_exito(sondeos):
+    """
+    Corre los sondeos a la vez y devuelve el primero que responde
+    (estado, rtt_ms, metodo); cancela el resto. None si ninguno respondió.
+    """
+    tareas = [asyncio.ensure_future(sondeo) for sondeo in sondeos]
+    try:
+        for siguiente in asyncio.as_completed(tareas):
+            resultado = await siguiente
+            if resultado and resultado[0] == "Activo":
+                return resultado
+        return None
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
+
+
+async def _escanear(conn, equipos, equipos_ad_actuales, config):
+    loop = asyncio.get_running_loop()
+    try:
+        limite = int(config.get("ESCANEO_CONCURRENCIA", ESCANEO_CONCURRENCIA))
+    except (TypeError, ValueError):
+        limite = ESCANEO_CONCURRENCIA
+    timeout = ping_timeout(config)
+    puertos = puertos_tcp(config)
+    if os.name == "nt" and puertos:
+        # Cada sondeo puede tener un connect() por puerto abierto a la vez:
+        # por debajo del límite de select() del SelectorEventLoop
+        limite = min(limite, max(1, ESCANEO_SOCKETS_WINDOWS // len(puertos)))
+    semaforo = asyncio.Semaphore(limite)
+    paralelo = modo_tcp(config) == "paralelo"
+    lote = sql_lote(config)
+    escritor = escritor_activo()
+    filas = []
+
+    # Ejecutores dedicados para el trabajo bloqueante:
+    #   - un hilo para pyodbc (la conexión se usa de a una consulta), o para
+    #     encolar en el escritor SQL sin bloquear el loop si la cola está llena
+    #   - un hilo para leer AD/DNS (el generador de iterar_equipos_ad)
+    #   - hilos para el ping del sistema, solo si no hay sockets ICMP
+    sql_executor = _ejecutor("sql", 1)
+    ad_executor = _ejecutor("ad", 1)
+    ping_executor = None
+
+    try:
+        sondear, cerrar = _abrir_motor_icmp(loop, ping_pps(config))
+    except PermissionError as e:
+        escribir_log(f"Sockets ICMP no permitidos ({e}); modo async con ping del sistema", tipo="WARNING")
+        sondear, cerrar = None, None
+        ping_executor = _ejecutor("ping", ESCANEO_HILOS)
+
+    async def sondear_icmp(ip):
+        ping, rtt = await sondear(ip, timeout)
+        return ping, rtt, "ICMP" if ping == "Activo" else None
+
+    async def sondear_ip(ip):
+        if puertos and paralelo:
+            sondeos = [sondear_icmp(ip)] + [_conectar_tcp(ip, puerto, timeout) for puerto in puertos]
+            return await _primer_exito(sondeos) or ("Inactivo", None, None)
+        resultado = await sondear_icmp(ip)
+        if resultado[0] != "Activo" and puertos:
+            sondeos = [_conectar_tcp(ip, puerto, timeout) for puerto in puertos]
+            resultado = await _primer_exito(sondeos) or resultado
+        return resultado
+
+    async def procesar(eq):
+        async with semaforo:
+            destino = destino_ping(eq)
+            try:
+                if sondear:
+                    ip = destino
+                    try:
+                        socket.inet_aton(ip)
+                    except OSError:
+                        infos = await loop.getaddrinfo(destino, None, family=socket.AF_INET)
+                        ip = infos[0][4][0]
+                    ping, rtt, metodo = await sondear_ip(ip)
+                else:
+                    ping, rtt, metodo = await loop.run_in_executor(ping_executor, sondear_equipo, destino, config)
+            except OSError as e:
+                escribir_log(f"Ping fallido: {destino} → Inactivo ({e})", tipo="WARNING")
+                ping, rtt, metodo = "Inactivo", None, None
+
+        if equipos_ad_actuales is None or eq["nombre"] in equipos_ad_actuales:
+            estado_ad = "Dentro de AD"
+        else:
+            estado_ad = "Removido de AD"
+
+        if lote or escritor:
+            fila = preparar_resultado(eq, ping, rtt, estado_ad, metodo)
+            if not hay_cambios(fila, config):
+                return
+            if escritor:
+                await loop.run_in_executor(sql_executor, encolar_fila, fila)
+            else:
+                filas.append(fila)
+            return
+        await loop.run_in_executor(
+            sql_executor, registrar_resultado, conn, eq, ping, rtt, estado_ad, metodo, config
+        )
+
+    tareas = []
+    try:
+        if isinstance(equipos, list):
+            for eq in equipos:
+                tareas.append(asyncio.ensure_future(procesar(eq)))
+        else:
+            # Generador (LDAP/DNS bloqueante): se consume en su propio hilo
+            iterador = iter(equipos)
+            while True:
+                eq = await loop.run_in_executor(ad_executor, next, iterador, None)
+                if eq is None:
+                    break
+                tareas.append(asyncio.ensure_future(procesar(eq)))
+
+        resultados = await asyncio.gather(*tareas, return_exceptions=True)
+        for resultado in resultados:
+            if isinstance(resultado, Exception):
+                escribir_log(f"Error en escaneo async: {resultado}", tipo="ERROR")
+        if filas:
+            await loop.run_in_executor(sql_executor, guardar_resultados_lote, conn, filas, lote)
+        if escritor:
+            await loop.run_in_executor(sql_executor, vaciar_escritor)
+    finally:
+        if cerrar:
+            cerrar()
+
+    return len(tareas)
+
+
+def escanear_async(conn, equipos, equipos_ad_actuales, ping_interval, config=None):
+    """
+    Igual que insertar_o_actualizar, pero cada sondeo es una corrutina:
+    hasta ESCANEO_CONCURRENCIA pings en vuelo sobre un único socket ICMP
+    (más los connect() a TCP_PUERTOS, como respaldo o en paralelo), con pyodbc y la lectura de AD en ejecutores aparte para no bloquear el loop.
+    Devuelve la cantidad de equipos procesados.
+    """
+    # Loop de selectores en todas las plataformas: el Proactor de Windows
+    # no permite add_reader sobre el socket ICMP. En Windows ese loop usa
+    # select() (512 sockets), por eso _escanear acota la concurrencia si
+    # hay sondeos TCP
+    loop = asyncio.SelectorEventLoop()
+    try:
+        return loop.run_until_complete(
+            _escanear(conn, equipos, equipos_ad_actuales, config or {})
+        )
+    finally:
+        loop.close()
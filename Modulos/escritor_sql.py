@@ -0,0 +1,165 @@
+# ---------------------------------------
+# Archivo: Modulos/escritor_sql.py
+# Escritor SQL dedicado: cola acotada, commit agrupado y contrapresión
+# ---------------------------------------
+
+import queue
+import threading
+import time
+from Configs.logs_utils import escribir_log
+
+SQL_COLA_MAX = 5000        # Filas en espera; con la cola llena los sondeos esperan
+SQL_GRUPO_FILAS = 1000     # Filas por transacción
+SQL_GRUPO_ESPERA = 0.5     # Segundos máximos que una fila espera a que se complete su grupo
+
+# Estado del hilo escritor (uno por proceso). Escribe por su propia
+# conexión del pool, así que sus reintentos no frenan al resto.
+estado_escritor = {
+    "hilo": None,
+    "cola": None,
+    "conn": None,       # PoolSQL (Datos/db_pool)
+    "escribir": None,   # escribir(conn, filas) -> filas confirmadas
+    "grupo": SQL_GRUPO_FILAS,
+    "espera": SQL_GRUPO_ESPERA,
+    "grupos": 0,        # transacciones confirmadas desde el arranque
+    "descartadas": 0,   # filas que no se pudieron escribir tras los reintentos
+}
+
+_FIN = object()
+
+
+def escritor_activo(config=None):
+    """
+    True si SQL_MODO = "escritor" (o, sin config, si el hilo ya está corriendo).
+    """
+    if config is None:
+        return estado_escritor["hilo"] is not None
+    return str((config or {}).get("SQL_MODO", "fila")).lower() == "escritor"
+
+
+def _parametro(config, clave, defecto, tipo=float):
+    try:
+        return tipo(config.get(clave, defecto))
+    except (TypeError, ValueError):
+        return defecto
+
+
+def _juntar_grupo(cola, primera):
+    """
+    A partir de 'primera', saca filas de la cola hasta completar el grupo
+    (SQL_GRUPO_FILAS) o hasta que vence SQL_GRUPO_ESPERA. Devuelve (filas, fin).
+    """
+    filas = [primera]
+    limite = time.monotonic() + estado_escritor["espera"]
+    while len(filas) < estado_escritor["grupo"]:
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            break
+        try:
+            fila = cola.get(timeout=restante)
+        except queue.Empty:
+            break
+        if fila is _FIN:
+            return filas, True
+        filas.append(fila)
+    return filas, False
+
+
+def _escribir_grupo(filas):
+    """
+    Un grupo = una transacción sobre la conexión del escritor. Si la función
+    de escritura falla tras sus reintentos (el pool ya reconecta si hizo
+    falta), el grupo se descarta: ella se encarga de que el próximo ciclo
+    lo vuelva a escribir.
+    """
+    guardadas = estado_escritor["escribir"](estado_escritor["conn"], filas)
+    if guardadas:
+        estado_escritor["grupos"] += 1
+        return
+
+    estado_escritor["descartadas"] += len(filas)
+    escribir_log(f"Escritor SQL: grupo de {len(filas)} filas descartado", tipo="ERROR")
+
+
+def _bucle_escritor():
+    cola = estado_escritor["cola"]
+    try:
+        _ciclo_escritor(cola)
+    finally:
+        estado_escritor["conn"].descartar()  # cerrar la conexión del hilo escritor
+
+
+def _ciclo_escritor(cola):
+    fin = False
+    while not fin:
+        primera = cola.get()
+        if primera is _FIN:
+            cola.task_done()
+            break
+        filas, fin = _juntar_grupo(cola, primera)
+        try:
+            _escribir_grupo(filas)
+        except Exception as e:
+            escribir_log(f"Error en el escritor SQL: {e}", tipo="ERROR")
+        finally:
+            for _ in range(len(filas) + (1 if fin else 0)):
+                cola.task_done()
+
+
+def iniciar_escritor(conn, config, escribir):
+    """
+    Arranca el hilo escritor; usa su propia conexión del pool 'conn'.
+    'escribir(conn, filas)' confirma un grupo en una transacción y devuelve
+    las filas guardadas (Modulos/ad_utils.escribir_grupo para EquiposAD).
+    Los parámetros salen de config: SQL_COLA_MAX (tamaño de la cola),
+    SQL_GRUPO_FILAS (filas por transacción) y SQL_GRUPO_ESPERA (segundos
+    para juntar un grupo).
+    """
+    if estado_escritor["hilo"] is not None:
+        return
+
+    estado_escritor.update({
+        "conn": conn,
+        "escribir": escribir,
+        "cola": queue.Queue(maxsize=max(1, _parametro(config, "SQL_COLA_MAX", SQL_COLA_MAX, int))),
+        "grupo": max(1, _parametro(config, "SQL_GRUPO_FILAS", SQL_GRUPO_FILAS, int)),
+        "espera": max(0.0, _parametro(config, "SQL_GRUPO_ESPERA", SQL_GRUPO_ESPERA)),
+    })
+    hilo = threading.Thread(target=_bucle_escritor, name="escritor-sql", daemon=True)
+    estado_escritor["hilo"] = hilo
+    hilo.start()
+    escribir_log(
+        f"Escritor SQL iniciado (cola {estado_escritor['cola'].maxsize}, "
+        f"grupo {estado_escritor['grupo']} filas / {estado_escritor['espera']}s)",
+        tipo="INFO"
+    )
+
+
+def encolar_fila(fila):
+    """
+    Entrega una fila de EquiposAD al escritor. Si la cola está llena, espera
+    a que se libere lugar (contrapresión: los sondeos van al ritmo de SQL
+    solo cuando SQL no da abasto).
+    """
+    estado_escritor["cola"].put(fila)
+
+
+def vaciar_escritor():
+    """
+    Espera a que el escritor confirme todas las filas encoladas (se llama al
+    final de cada escaneo, antes de las alertas que leen EquiposAD).
+    """
+    if estado_escritor["cola"] is not None:
+        estado_escritor["cola"].join()
+
+
+def detener_escritor():
+    """
+    Escribe lo pendiente y detiene el hilo.
+    """
+    hilo = estado_escritor["hilo"]
+    if hilo is None:
+        return
+    estado_escritor["cola"].put(_FIN)
+    hilo.join()
+    estado_escritor.update({"hilo": None, "cola": None, "conn": None})
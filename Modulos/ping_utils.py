@@ -0,0 +1,490 @@
+# ---------------------------------------
+# Archivo: Modulos/ping_utils.py
+# Motor de sondeo ICMP dentro del proceso (sin lanzar 'ping')
+# ---------------------------------------
+
+import errno
+import os
+import platform
+import select
+import selectors
+import socket
+import struct
+import subprocess
+import threading
+import time
+from collections import deque
+import ping3
+from Configs.logs_utils import escribir_log
+
+PING_TIMEOUT = 2  # Segundos de espera por la respuesta ICMP
+PING_PPS = 1000   # Ritmo máximo de envío del barrido (paquetes por segundo)
+ICMP_RCVBUF = 4 * 1024 * 1024  # Buffer de recepción del socket ICMP compartido
+
+# Si el sistema no permite sockets ICMP (ni raw ni datagrama sin privilegios),
+# se pasa una sola vez al 'ping' del sistema y se deja constancia en el log.
+_motor = {"icmp_disponible": True}
+
+
+def ping_timeout(config=None):
+    """
+    PING_TIMEOUT configurado (segundos, admite decimales).
+    """
+    try:
+        return float((config or {}).get("PING_TIMEOUT", PING_TIMEOUT))
+    except (TypeError, ValueError):
+        return PING_TIMEOUT
+
+
+def ping_sistema(host):
+    """
+    Ping con el comando del sistema (un proceso por host). Motor anterior,
+    se usa solo si no hay sockets ICMP o si PING_MODO = "sistema".
+    Devuelve (estado, None): este motor no mide el RTT.
+    """
+    try:
+        param = "-n" if platform.system().lower() == "windows" else "-c"
+        result = subprocess.run(["ping", param, "1", host], capture_output=True, timeout=6)
+        estado = "Activo" if result.returncode == 0 else "Inactivo"
+
+        if estado != "Activo":
+            escribir_log(f"Ping fallido: {host} → {estado}", tipo="WARNING")
+        return estado, None
+
+    except subprocess.TimeoutExpired:
+        escribir_log(f"Ping timeout: {host}", tipo="ERROR")
+        return "Timeout", None
+    except Exception as e:
+        escribir_log(f"Error en ping {host}: {e}", tipo="ERROR")
+        return "Error", None
+
+
+def ping_icmp(host, timeout=PING_TIMEOUT):
+    """
+    Un echo request ICMP con ping3 sobre un socket propio. En Linux sin root
+    ping3 usa el socket ICMP de datagrama sin privilegios (net.ipv4.ping_group_range).
+    Devuelve (estado, rtt_ms):
+      - ("Activo", rtt)     hubo respuesta
+      - ("Inactivo", None)  sin respuesta en 'timeout', host desconocido o inalcanzable
+      - ("Error", None)     fallo local inesperado
+    Lanza PermissionError si el sistema no permite abrir sockets ICMP.
+    """
+    try:
+        rtt = ping3.ping(host, timeout=timeout, unit="ms")
+    except PermissionError:
+        raise
+    except OSError as e:
+        if e.errno in (errno.EPERM, errno.EACCES):
+            raise PermissionError(str(e)) from e
+        escribir_log(f"Error en ping {host}: {e}", tipo="ERROR")
+        return "Error", None
+    except Exception as e:
+        escribir_log(f"Error en ping {host}: {e}", tipo="ERROR")
+        return "Error", None
+
+    # ping3 devuelve None (timeout) o False (error ICMP / host desconocido)
+    if rtt is None or rtt is False:
+        escribir_log(f"Ping fallido: {host} → Inactivo", tipo="WARNING")
+        return "Inactivo", None
+
+    return "Activo", round(rtt, 2)
+
+
+def hacer_ping_rtt(host, config=None):
+    """
+    Sondea un host con el motor configurado en PING_MODO ("icmp" por defecto,
+    "sistema" para el comando ping). Devuelve (estado, rtt_ms o None).
+    """
+    modo = (config or {}).get("PING_MODO", "icmp").lower()
+
+    if modo == "icmp" and _motor["icmp_disponible"]:
+        try:
+            return ping_icmp(host, ping_timeout(config))
+        except PermissionError as e:
+            _motor["icmp_disponible"] = False
+            escribir_log(f"Sockets ICMP no permitidos ({e}); se usa el ping del sistema", tipo="WARNING")
+
+    return ping_sistema(host)
+
+
+# ------------------------
+# Barrido ICMP sobre un solo socket (estilo fping)
+# ------------------------
+def _checksum(data):
+    """
+    Checksum de Internet (RFC 1071) en orden de red.
+    """
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def paquete_echo(icmp_id, seq):
+    """
+    Echo request ICMP (tipo 8) con 32 bytes de relleno.
+    """
+    payload = b"AD-Scanner".ljust(32, b"\0")
+    cabecera = struct.pack("!BBHHH", 8, 0, 0, icmp_id, seq)
+    suma = _checksum(cabecera + payload)
+    return struct.pack("!BBHHH", 8, 0, suma, icmp_id, seq) + payload
+
+
+def leer_echo_reply(data):
+    """
+    Devuelve (identificador, secuencia) si 'data' es un echo reply ICMP,
+    si no None. Acepta el paquete con cabecera IPv4 (raw) o sin ella (datagrama).
+    """
+    if data and data[0] >> 4 == 4:  # trae cabecera IPv4: saltearla
+        data = data[(data[0] & 0x0F) * 4:]
+    if len(data) < 8:
+        return None
+
+    tipo, _, _, rid, rseq = struct.unpack("!BBHHH", data[:8])
+    if tipo != 0:
+        return None
+    return rid, rseq
+
+
+def abrir_socket_icmp():
+    """
+    Socket ICMP raw o, sin privilegios en Linux, de datagrama, con el buffer
+    de recepción ampliado a ICMP_RCVBUF (las respuestas de un barrido llegan
+    juntas; con el buffer por defecto se pierden y el equipo queda Inactivo).
+    Devuelve (socket, es_raw). Lanza PermissionError si ninguno está permitido.
+    """
+    try:
+        sock, es_raw = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+    except PermissionError:
+        try:
+            sock, es_raw = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+        except OSError as e:
+            raise PermissionError(str(e)) from e
+
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, ICMP_RCVBUF)
+    except OSError:
+        pass  # el sistema lo limita (ej. net.core.rmem_max): queda el que permita
+    return sock, es_raw
+
+
+def ping_pps(config=None):
+    """
+    PING_PPS configurado (paquetes por segundo; 0 = sin límite).
+    """
+    try:
+        return float((config or {}).get("PING_PPS", PING_PPS))
+    except (TypeError, ValueError):
+        return PING_PPS
+
+
+def _barrido_bloque(destinos, timeout, pps):
+    """
+    Barre hasta 65535 IPs con un socket: el número de secuencia identifica
+    a cada destino y cada uno tiene su propio plazo.
+    """
+    resultados = {destino: ("Inactivo", None) for destino in destinos}
+    sock, es_raw = abrir_socket_icmp()
+    # En sockets de datagrama el kernel reemplaza el identificador,
+    # por eso en ese caso solo se compara la secuencia y la IP de origen
+    icmp_id = os.getpid() & 0xFFFF
+    intervalo = 1.0 / pps if pps > 0 else 0.0
+
+    with sock:
+        sock.setblocking(False)
+        pendientes = {}        # seq -> (destino, ip, enviado)
+        orden = deque()        # (plazo, seq) en orden de envío = orden de plazo
+        siguiente = 0
+        proximo_envio = time.monotonic()
+
+        while siguiente < len(destinos) or pendientes:
+            ahora = time.monotonic()
+
+            # Enviar lo que corresponde según el ritmo (PING_PPS)
+            while siguiente < len(destinos) and ahora >= proximo_envio:
+                destino = destinos[siguiente]
+                seq = siguiente + 1
+                try:
+                    sock.sendto(paquete_echo(icmp_id, seq), (destino, 0))
+                    pendientes[seq] = (destino, destino, time.monotonic())
+                    orden.append((time.monotonic() + timeout, seq))
+                except BlockingIOError:
+                    break  # buffer lleno: se reintenta en la próxima vuelta
+                except OSError as e:
+                    # red inalcanzable: queda Inactivo
+                    escribir_log(f"Ping fallido: {destino} → Inactivo ({e})", tipo="WARNING")
+                siguiente += 1
+                proximo_envio += intervalo
+
+            # Vencer los plazos cumplidos
+            while orden and (orden[0][1] not in pendientes or orden[0][0] <= ahora):
+                _, seq = orden.popleft()
+                pendientes.pop(seq, None)
+
+            if siguiente >= len(destinos) and not pendientes:
+                break
+
+            # Esperar respuestas hasta el próximo envío o el próximo plazo
+            limites = [orden[0][0]] if orden else []
+            if siguiente < len(destinos):
+                limites.append(proximo_envio)
+            espera = max(0.0, min(limites) - time.monotonic()) if limites else 0.0
+            listos, _, _ = select.select([sock], [], [], espera)
+            if not listos:
+                continue
+
+            while True:
+                try:
+                    data, direccion = sock.recvfrom(2048)
+                except (BlockingIOError, InterruptedError):
+                    break
+                recibido = time.monotonic()
+
+                echo = leer_echo_reply(data)
+                if not echo or (es_raw and echo[0] != icmp_id):
+                    continue
+                rseq = echo[1]
+
+                pendiente = pendientes.get(rseq)
+                if pendiente and direccion[0] == pendiente[1]:
+                    del pendientes[rseq]
+                    resultados[pendiente[0]] = ("Activo", round((recibido - pendiente[2]) * 1000, 2))
+
+    return resultados
+
+
+def barrido_icmp(destinos, config=None):
+    """
+    Envía un echo request a todos los destinos desde un único socket, a
+    PING_PPS paquetes por segundo, y espera las respuestas de todos en paralelo:
+    la lista completa se resuelve en aproximadamente un PING_TIMEOUT (más el
+    tiempo de envío), en vez de un timeout por host.
+    Solo IPs literales: un nombre obligaría a consultar DNS dentro del bucle
+    de envío y frenaría a todo el bloque; esos destinos quedan Inactivo sin
+    enviarse (resolverlos antes, con dns_utils y su caché).
+    Devuelve {destino: (estado, rtt_ms)} con los mismos estados que ping_icmp.
+    Lanza PermissionError si el sistema no permite sockets ICMP.
+    """
+    pps = ping_pps(config)
+    timeout = ping_timeout(config)
+
+    unicos, resultados = [], {}
+    for destino in dict.fromkeys(destinos):
+        try:
+            socket.inet_aton(destino)
+            unicos.append(destino)
+        except OSError:
+            escribir_log(f"Barrido ICMP: {destino} no es una IP; queda Inactivo", tipo="WARNING")
+            resultados[destino] = ("Inactivo", None)
+
+    # El número de secuencia es de 16 bits: bloques de 65535 destinos
+    for inicio in range(0, len(unicos), 65535):
+        resultados.update(_barrido_bloque(unicos[inicio:inicio + 65535], timeout, pps))
+    return resultados
+
+
+# ------------------------
+# Sondeo TCP (equipos que filtran ICMP)
+# ------------------------
+TCP_PUERTOS = ""        # Ej. "445,3389,135,5985"; vacío = solo ICMP
+TCP_MAX_SOCKETS = 400   # Conexiones TCP abiertas a la vez en sondear_tcp_varios
+
+# connect() no bloqueante en curso (Linux / Windows)
+_CONNECT_EN_CURSO = {0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035}
+# Un RST también prueba que el equipo está encendido
+_CONEXION_RECHAZADA = {errno.ECONNREFUSED, 10061}
+
+
+def puertos_tcp(config=None):
+    """
+    Lista de puertos de TCP_PUERTOS ("445,3389,..."). Vacía si no hay.
+    """
+    texto = str((config or {}).get("TCP_PUERTOS", TCP_PUERTOS) or "")
+    return [int(p) for p in texto.replace(";", ",").split(",") if p.strip().isdigit()]
+
+
+def modo_tcp(config=None):
+    """
+    "respaldo": TCP solo si ICMP falla | "paralelo": ICMP y TCP a la vez.
+    """
+    return str((config or {}).get("TCP_MODO", "respaldo")).lower()
+
+
+def _iniciar_conexion(ip, puerto):
+    """
+    Inicia un connect() no bloqueante. Devuelve (socket, codigo).
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    return sock, sock.connect_ex((ip, puerto))
+
+
+def sondear_tcp_varios(destinos, puertos, timeout, max_sockets=TCP_MAX_SOCKETS):
+    """
+    TCP connect a cada puerto de cada destino, con hasta max_sockets conexiones
+    abiertas a la vez. Un destino queda "Activo" con el primer puerto que
+    contesta (SYN-ACK o RST: ambos prueban que el equipo está encendido) y sus
+    demás intentos se cancelan.
+    Devuelve {destino: (estado, rtt_ms, metodo)}.
+    """
+    resultados = {destino: ("Inactivo", None, None) for destino in destinos}
+    cola = deque((destino, puerto) for destino in destinos for puerto in puertos)
+    selector = selectors.DefaultSelector()
+    abiertos = {}      # socket -> (destino, puerto, inicio, plazo)
+    por_destino = {}   # destino -> sockets abiertos
+
+    def cerrar(sock):
+        destino = abiertos.pop(sock)[0]
+        por_destino[destino].discard(sock)
+        selector.unregister(sock)
+        sock.close()
+
+    def marcar_activo(destino, puerto, inicio):
+        if resultados[destino][0] != "Activo":
+            resultados[destino] = ("Activo", round((time.monotonic() - inicio) * 1000, 2), f"TCP/{puerto}")
+        for otro in list(por_destino.get(destino, ())):
+            cerrar(otro)
+
+    try:
+        while cola or abiertos:
+            # Llenar la ventana de conexiones
+            while cola and len(abiertos) < max_sockets:
+                destino, puerto = cola.popleft()
+                if resultados[destino][0] == "Activo":
+                    continue
+                inicio = time.monotonic()
+                try:
+                    sock, codigo = _iniciar_conexion(destino, puerto)
+                except OSError:
+                    continue
+                if codigo in _CONEXION_RECHAZADA:
+                    sock.close()
+                    marcar_activo(destino, puerto, inicio)
+                    continue
+                if codigo not in _CONNECT_EN_CURSO:
+                    sock.close()
+                    continue
+                selector.register(sock, selectors.EVENT_WRITE)
+                abiertos[sock] = (destino, puerto, inicio, inicio + timeout)
+                por_destino.setdefault(destino, set()).add(sock)
+
+            if not abiertos:
+                continue
+
+            plazo = min(datos[3] for datos in abiertos.values())
+            for clave, _ in selector.select(max(0.0, plazo - time.monotonic())):
+                sock = clave.fileobj
+                if sock not in abiertos:
+                    continue  # cerrado por el éxito de otro puerto del mismo destino
+                destino, puerto, inicio, _ = abiertos[sock]
+                codigo = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if codigo == 0 or codigo in _CONEXION_RECHAZADA:
+                    marcar_activo(destino, puerto, inicio)
+                else:
+                    cerrar(sock)
+
+            ahora = time.monotonic()
+            for sock in [s for s, datos in abiertos.items() if datos[3] <= ahora]:
+                cerrar(sock)
+    finally:
+        for sock in list(abiertos):
+            cerrar(sock)
+        selector.close()
+
+    return resultados
+
+
+def _sondeo_paralelo(host, puertos, timeout):
+    """
+    Echo ICMP y connect() a cada puerto al mismo tiempo, esperando en un único
+    select: el primero que responde decide. Devuelve (estado, rtt_ms, metodo)
+    o None si el sistema no permite sockets ICMP y ningún puerto respondió.
+    """
+    ip = socket.gethostbyname(host)
+    selector = selectors.DefaultSelector()
+    sockets = []
+    inicio = time.monotonic()
+    icmp_id = (os.getpid() ^ threading.get_ident()) & 0xFFFF
+
+    try:
+        try:
+            icmp, es_raw = abrir_socket_icmp()
+            sockets.append(icmp)
+            icmp.setblocking(False)
+            icmp.sendto(paquete_echo(icmp_id, 1), (ip, 0))
+            selector.register(icmp, selectors.EVENT_READ, ("ICMP", es_raw))
+        except PermissionError:
+            icmp = None
+
+        for puerto in puertos:
+            sock, codigo = _iniciar_conexion(ip, puerto)
+            sockets.append(sock)
+            if codigo in _CONEXION_RECHAZADA:
+                return "Activo", round((time.monotonic() - inicio) * 1000, 2), f"TCP/{puerto}"
+            if codigo in _CONNECT_EN_CURSO:
+                selector.register(sock, selectors.EVENT_WRITE, (puerto, None))
+
+        plazo = inicio + timeout
+        while selector.get_map() and time.monotonic() < plazo:
+            for clave, _ in selector.select(max(0.0, plazo - time.monotonic())):
+                metodo, es_raw = clave.data
+                sock = clave.fileobj
+                if metodo == "ICMP":
+                    try:
+                        data, direccion = sock.recvfrom(2048)
+                    except (BlockingIOError, InterruptedError):
+                        continue
+                    echo = leer_echo_reply(data)
+                    if echo and direccion[0] == ip and echo[1] == 1 and (not es_raw or echo[0] == icmp_id):
+                        return "Activo", round((time.monotonic() - inicio) * 1000, 2), "ICMP"
+                else:
+                    codigo = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if codigo == 0 or codigo in _CONEXION_RECHAZADA:
+                        return "Activo", round((time.monotonic() - inicio) * 1000, 2), f"TCP/{metodo}"
+                    selector.unregister(sock)
+
+        return ("Inactivo", None, None) if icmp else None
+    finally:
+        selector.close()
+        for sock in sockets:
+            sock.close()
+
+
+def sondear_equipo(host, config=None):
+    """
+    Sondeo completo de un host: ICMP y, si hay TCP_PUERTOS, connect() TCP
+    como respaldo (TCP_MODO = "respaldo") o en paralelo ("paralelo").
+    Devuelve (estado, rtt_ms, metodo) donde metodo es "ICMP", "TCP/<puerto>"
+    o None si el equipo no respondió.
+    """
+    puertos = puertos_tcp(config)
+    timeout = ping_timeout(config)
+    tcp_probado = False
+
+    if puertos and modo_tcp(config) == "paralelo" and _motor["icmp_disponible"]:
+        try:
+            resultado = _sondeo_paralelo(host, puertos, timeout)
+            if resultado:
+                if resultado[0] != "Activo":
+                    escribir_log(f"Ping fallido: {host} → Inactivo (ICMP y TCP)", tipo="WARNING")
+                return resultado
+            # Sin sockets ICMP: los puertos ya se probaron y ninguno respondió,
+            # queda solo el ping del sistema (sin repetir los connect())
+            tcp_probado = True
+        except OSError as e:
+            escribir_log(f"Ping fallido: {host} → Inactivo ({e})", tipo="WARNING")
+            return "Inactivo", None, None
+
+    estado, rtt = hacer_ping_rtt(host, config)
+    if estado == "Activo":
+        return estado, rtt, "ICMP"
+
+    if puertos and not tcp_probado:
+        resultado = sondear_tcp_varios([host], puertos, timeout)[host]
+        if resultado[0] == "Activo":
+            escribir_log(f"{host} no responde ICMP pero sí {resultado[2]}", tipo="INFO")
+            return resultado
+
+    return estado, rtt, None
@@ -0,0 +1,216 @@
+# ---------------------------------------
+# Archivo: Modulos/planificador.py
+# Planificación del ping por equipo (cola de prioridad por tiempo):
+# intervalo adaptativo o repartido a lo largo de PING_INTERVAL
+# ---------------------------------------
+
+import heapq
+import itertools
+import time
+import zlib
+from datetime import datetime
+from Configs.logs_utils import escribir_log
+from Modulos.ad_utils import estado_ping
+
+PLAN_CONFIRMAR = 15            # Segundos hasta re-sondear un equipo que acaba de cambiar de estado
+PLAN_CONFIRMACIONES = 2        # Sondeos rápidos después de un cambio
+PLAN_ESTABLE_SONDEOS = 10      # Sondeos iguales seguidos para duplicar el intervalo
+PLAN_ESTABLE_MAX = 16          # Tope del intervalo de un equipo estable (veces PING_INTERVAL)
+PLAN_CUARENTENA_DESDE = 21600  # Segundos inactivo para pasar a cuarentena (6 h)
+PLAN_CUARENTENA_MAX = 3600     # Tope del backoff en cuarentena (segundos)
+PLAN_CUARENTENA_TIMEOUT = 0.5  # PING_TIMEOUT de los equipos en cuarentena
+PLAN_PPS = 0                   # Tope global de sondeos por segundo (0 = sin tope)
+
+# Estado en memoria del planificador. Al reiniciar el script todos los
+# equipos vuelven a sondearse de inmediato.
+estado_plan = {
+    "cola": [],        # heap de (instante monotonic, secuencia, nombre)
+    "proximo": {},     # nombre -> instante vigente (las entradas viejas del heap se descartan)
+    "equipos": {},     # nombre -> dict de equipo del inventario actual
+    "sondeos": {},     # nombre -> sondeos hechos por el planificador
+    "cuarentena": {},  # nombre -> sondeos seguidos en cuarentena
+    "vencio": {},      # nombre -> instante programado del sondeo en curso
+    "fichas": None,    # cubeta de PLAN_PPS: fichas disponibles
+    "recarga": None,   # último instante en que se recargó la cubeta
+}
+_secuencia = itertools.count()
+
+
+def _parametro(config, clave, defecto):
+    try:
+        return float(config.get(clave, defecto))
+    except (TypeError, ValueError):
+        return defecto
+
+
+def _programar(nombre, instante):
+    estado_plan["proximo"][nombre] = instante
+    heapq.heappush(estado_plan["cola"], (instante, next(_secuencia), nombre))
+
+
+def fase_equipo(nombre, base):
+    """
+    Desfase estable del equipo dentro del intervalo (0 <= fase < base):
+    el mismo nombre cae siempre en el mismo punto del ciclo.
+    """
+    return zlib.crc32(nombre.lower().encode("utf-8")) / 2 ** 32 * base
+
+
+def sincronizar_plan(equipos, base=None):
+    """
+    Alinea el planificador con el inventario: los equipos nuevos se sondean
+    de inmediato (o en su fase dentro del intervalo si se pasa 'base') y los
+    que ya no están se olvidan.
+    """
+    actuales = {eq["nombre"]: eq for eq in equipos}
+    ahora = time.monotonic()
+
+    for nombre in list(estado_plan["proximo"]):
+        if nombre not in actuales:
+            estado_plan["proximo"].pop(nombre, None)
+            estado_plan["sondeos"].pop(nombre, None)
+            estado_plan["cuarentena"].pop(nombre, None)
+            estado_plan["vencio"].pop(nombre, None)
+
+    for nombre in actuales:
+        if nombre not in estado_plan["proximo"]:
+            _programar(nombre, ahora + (fase_equipo(nombre, base) if base else 0))
+
+    estado_plan["equipos"] = actuales
+
+
+def _fichas(pps, ahora):
+    """
+    Cubeta de fichas de PLAN_PPS: se recarga a 'pps' por segundo con
+    capacidad de un segundo, y nunca menos de una ficha (con PLAN_PPS < 1
+    la cubeta tiene que poder llegar a 1 para sondear).
+    Devuelve las fichas disponibles.
+    """
+    capacidad = max(1.0, pps)
+    if estado_plan["fichas"] is None:
+        estado_plan["fichas"] = capacidad
+    else:
+        transcurrido = ahora - estado_plan["recarga"]
+        estado_plan["fichas"] = min(capacidad, estado_plan["fichas"] + transcurrido * pps)
+    estado_plan["recarga"] = ahora
+    return estado_plan["fichas"]
+
+
+def equipos_vencidos(config=None):
+    """
+    Saca de la cola los equipos cuyo sondeo ya venció, sin pasar de PLAN_PPS
+    sondeos por segundo: lo que no entra queda en la cola para la próxima vuelta.
+    Devuelve (normales, en_cuarentena): los segundos se sondean con timeout corto.
+    """
+    cola = estado_plan["cola"]
+    ahora = time.monotonic()
+    normales, en_cuarentena = [], []
+    pps = _parametro(config or {}, "PLAN_PPS", PLAN_PPS)
+    fichas = _fichas(pps, ahora) if pps > 0 else None
+
+    while cola and cola[0][0] <= ahora:
+        if fichas is not None and fichas < 1:
+            break
+        instante, _, nombre = heapq.heappop(cola)
+        if estado_plan["proximo"].get(nombre) != instante:
+            continue  # reprogramado o fuera del inventario
+        eq = estado_plan["equipos"].get(nombre)
+        if eq is None:
+            continue
+        estado_plan["proximo"][nombre] = None  # en curso hasta reprogramar_equipos
+        estado_plan["vencio"][nombre] = instante
+        if fichas is not None:
+            fichas -= 1
+        if nombre in estado_plan["cuarentena"]:
+            en_cuarentena.append(eq)
+        else:
+            normales.append(eq)
+
+    if fichas is not None:
+        estado_plan["fichas"] = fichas
+    return normales, en_cuarentena
+
+
+def _intervalo(nombre, config, base):
+    """
+    Segundos hasta el próximo sondeo según lo que devolvió el último:
+    - recién cambió de estado: re-sondeo rápido para confirmar
+    - estable: el intervalo se duplica cada PLAN_ESTABLE_SONDEOS, hasta PLAN_ESTABLE_MAX
+    - inactivo hace más de PLAN_CUARENTENA_DESDE: cuarentena con backoff exponencial
+    """
+    estado = estado_ping.get(nombre)
+    if not estado:
+        return base
+
+    inactivo_desde = estado.get("inactivo_desde")
+    if estado["estado"] != "Activo" and inactivo_desde:
+        inactivo = (datetime.now() - inactivo_desde).total_seconds()
+        if inactivo >= _parametro(config, "PLAN_CUARENTENA_DESDE", PLAN_CUARENTENA_DESDE):
+            pasos = estado_plan["cuarentena"].get(nombre, 0) + 1
+            if pasos == 1:
+                escribir_log(f"{nombre} pasa a cuarentena (inactivo hace {int(inactivo)} s)", tipo="INFO")
+            estado_plan["cuarentena"][nombre] = pasos
+            tope = max(_parametro(config, "PLAN_CUARENTENA_MAX", PLAN_CUARENTENA_MAX), base)
+            return min(base * 2 ** pasos, tope)
+
+    if estado_plan["cuarentena"].pop(nombre, None):
+        escribir_log(f"{nombre} sale de cuarentena", tipo="INFO")
+
+    contador = estado["contador"]
+    primero = estado_plan["sondeos"].get(nombre, 0) <= 1
+    if not primero and contador <= _parametro(config, "PLAN_CONFIRMACIONES", PLAN_CONFIRMACIONES):
+        return min(_parametro(config, "PLAN_CONFIRMAR", PLAN_CONFIRMAR), base)
+
+    cada = max(1, int(_parametro(config, "PLAN_ESTABLE_SONDEOS", PLAN_ESTABLE_SONDEOS)))
+    factor = min(2 ** ((contador - 1) // cada), _parametro(config, "PLAN_ESTABLE_MAX", PLAN_ESTABLE_MAX))
+    return base * factor
+
+
+def reprogramar_equipos(equipos, config, base):
+    """
+    Vuelve a poner en la cola los equipos recién sondeados, cada uno con su
+    intervalo según estado_ping.
+    """
+    ahora = time.monotonic()
+    for eq in equipos:
+        nombre = eq["nombre"]
+        if nombre not in estado_plan["proximo"]:
+            continue  # salió del inventario mientras se sondeaba
+        estado_plan["sondeos"][nombre] = estado_plan["sondeos"].get(nombre, 0) + 1
+        _programar(nombre, ahora + _intervalo(nombre, config, base))
+
+
+def reprogramar_repartidos(equipos, base):
+    """
+    Ritmo fijo por equipo: el próximo sondeo es un intervalo después del
+    programado (no del real), así cada equipo conserva su fase. Si el sondeo
+    se atrasó más de un intervalo, se salta al siguiente punto de su fase.
+    """
+    ahora = time.monotonic()
+    for eq in equipos:
+        nombre = eq["nombre"]
+        if nombre not in estado_plan["proximo"]:
+            continue
+        instante = estado_plan["vencio"].pop(nombre, ahora) + base
+        if instante <= ahora:
+            instante += base * (int((ahora - instante) // base) + 1)
+        _programar(nombre, instante)
+
+
+def segundos_hasta_proximo():
+    """
+    Segundos hasta el próximo sondeo programado (None si la cola está vacía).
+    """
+    cola = estado_plan["cola"]
+    while cola and estado_plan["proximo"].get(cola[0][2]) != cola[0][0]:
+        heapq.heappop(cola)  # entrada vieja
+    if not cola:
+        return None
+    return max(0.0, cola[0][0] - time.monotonic())
+
+
+def config_cuarentena(config):
+    """
+    Copia de la configuración con el timeout corto de la cuarentena.
+    """
+    return dict(config, PING_TIMEOUT=_parametro(config, "PLAN_CUARENTENA_TIMEOUT", PLAN_CUARENTENA_TIMEOUT))
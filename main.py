@@ -1,47 +1,186 @@
 
 import time
 from  Datos.db_conexion import conectar_sql
+from Datos.db_spool import spool_activo
 from Datos.db_table import crear_tabla
-from Modulos.ad_utils import obtener_equipos_ad, insertar_o_actualizar
+from Modulos.ad_utils import (
+    iterar_equipos_ad, insertar_o_actualizar, leer_mapa_dns_ad, cargar_estado_ping, escribir_grupo,
+    detener_ejecutores
+)
+from Modulos.escritor_sql import escritor_activo, iniciar_escritor, detener_escritor
+from Modulos.ad_sync import sincronizar_equipos_ad, marcar_removidos_ad
+from Modulos.dns_utils import resolver_equipos, cargar_ips_conocidas
+from Modulos.escaneo_async import escanear_async, detener_ejecutores_async
+from Modulos.ciclo import iniciar_ciclo, iniciar_escaneo, cerrar_escaneo, recortar_equipos, cerrar_ciclo
+from Modulos.planificador import (
+    sincronizar_plan, equipos_vencidos, reprogramar_equipos, reprogramar_repartidos,
+    segundos_hasta_proximo, config_cuarentena
+)
 from Interfaz import  gui_config
 from Configs.webhook_utils import enviar_notificacion_webhook
+from Configs.webhook_alerts import cargar_webhook_config, entregar_alertas
+from Configs.webhook_outbox import iniciar_entregador, detener_entregador
 
 
 
+# ------------------------
+# INVENTARIO DE AD EN MEMORIA
+# ------------------------
+def _leer_y_cachear(equipos, resumen, inventario, medicion):
+    """
+    Deja pasar los equipos tal como llegan de AD (el ping no espera a la última
+    página) y, si la lectura terminó bien, reemplaza la copia en memoria.
+    El tiempo esperando cada equipo de AD/DNS se suma a la fase "ad" de la
+    medición del ciclo (la lectura ocurre mientras corre el escaneo).
+    """
+    nuevos = []
+    iterador = iter(equipos)
+    while True:
+        inicio = time.monotonic()
+        eq = next(iterador, None)
+        medicion["fases"]["ad"] = medicion["fases"].get("ad", 0.0) + time.monotonic() - inicio
+        if eq is None:
+            break
+        nuevos.append(eq)
+        yield eq
+
+    if resumen.get("ok"):
+        inventario[:] = nuevos
+
+
+def _sondear(conn, equipos, ping_interval, config, escaneo_modo):
+    """
+    Ping + registro en SQL con el motor elegido en ESCANEO_MODO.
+    """
+    if escaneo_modo == "async":
+        return escanear_async(conn, equipos, None, ping_interval=ping_interval, config=config)
+    return insertar_o_actualizar(conn, equipos, None, ping_interval=ping_interval, config=config)
+
+
 # ------------------------
 # BUCLE PRINCIPAL
 # ------------------------
 def main(config):
     PING_INTERVAL = int(config["PING_INTERVAL"])
+    # Cada cuánto se relee AD; entre lecturas el ping usa el inventario en memoria
+    AD_REFRESH_INTERVAL = int(config.get("AD_REFRESH_INTERVAL", 900))
+    # "completo": relee todo AD en cada refresco | "incremental": solo el delta por uSNChanged
+    AD_SYNC_MODE = config.get("AD_SYNC_MODE", "completo").lower()
+    # "resolver": una consulta DNS por equipo | "ad": leer la zona DNS integrada en AD
+    DNS_MODO = config.get("DNS_MODO", "resolver").lower()
+    # "hilos": pool de 10 hilos | "async": miles de sondeos concurrentes con asyncio
+    ESCANEO_MODO = config.get("ESCANEO_MODO", "hilos").lower()
+    # "ciclo": todos los equipos juntos cada PING_INTERVAL
+    # "adaptativa": intervalo propio por equipo según su historia (planificador)
+    # "repartida": cada equipo cada PING_INTERVAL, repartidos a lo largo del intervalo
+    PLANIFICACION = config.get("PLANIFICACION", "ciclo").lower()
     
-    # Conectar a SQL pasando config
-    conn = conectar_sql(config)
+    # Conectar a SQL pasando config (con SQL_SPOOL, sin esperar a que SQL Server responda)
+    conn = conectar_sql(config, spool=spool_activo(config))
     if not conn:
         print("[ERROR] No se pudo conectar a la base de datos.")
         return
 
-    # Crear la tabla si no existe
+    # Poner el esquema al día (migraciones versionadas). Si SQL Server no
+    # responde al arrancar, se aplica al reconectar, antes de vaciar el spool
     crear_tabla(conn, config)
+    conn.al_reconectar = lambda: crear_tabla(conn, config)
+
+    # Últimas IPs guardadas: respaldo si el DNS no responde
+    cargar_ips_conocidas(conn)
+    # Último estado y marcas ActivoDesde/InactivoDesde: el tiempo no se reinicia
+    cargar_estado_ping(conn)
+
+    # SQL_MODO = "escritor": un hilo con su conexión del pool agrupa los MERGE de EquiposAD
+    if escritor_activo(config):
+        iniciar_escritor(conn, config, escribir_grupo)
+
+    # Las alertas se encolan en AlertOutbox; este hilo las envía y reintenta
+    iniciar_entregador(conn, cargar_webhook_config()["outbox"], entregar_alertas)
+
+    inventario = []
+    proxima_lectura_ad = 0.0
 
     try:
         while True:
-            # Obtener equipos de AD usando config actual
-            equipos = obtener_equipos_ad(config)
-            if not equipos:
-                print("[WARN] No se encontraron equipos en AD.")
-                time.sleep(PING_INTERVAL)
-                continue
+            medicion = iniciar_ciclo()
+
+            # Releer AD solo cuando vence AD_REFRESH_INTERVAL (o si todavía no hay inventario)
+            releido = time.monotonic() >= proxima_lectura_ad or not inventario
+            if releido:
+                proxima_lectura_ad = time.monotonic() + AD_REFRESH_INTERVAL
+                mapa_dns = leer_mapa_dns_ad(config) if DNS_MODO == "ad" else None
+
+                if AD_SYNC_MODE == "incremental":
+                    # Inventario en memoria actualizado solo con lo que cambió en AD
+                    equipos, removidos = sincronizar_equipos_ad(config)
+                    inventario[:] = equipos
+                    if removidos:
+                        marcar_removidos_ad(conn, removidos)
+                    # resolver_equipos completa eq["ip"] sobre los mismos dicts del inventario
+                    equipos = resolver_equipos(inventario, config, mapa=mapa_dns)
+                else:
+                    # Obtener equipos de AD por páginas: el DNS y el ping arrancan con
+                    # la primera página mientras las siguientes todavía se están leyendo
+                    resumen = {}
+                    equipos = iterar_equipos_ad(config, resumen=resumen)
+                    equipos = _leer_y_cachear(
+                        resolver_equipos(equipos, config, mapa=mapa_dns), resumen, inventario, medicion
+                    )
+            else:
+                equipos = inventario
+            # Lo que tarde el generador de AD/DNS se suma después, al consumirlo
+            medicion["fases"]["ad"] = time.monotonic() - medicion["inicio"]
 
-            equipos_ad_actuales = [eq["nombre"] for eq in equipos]
+            if PLANIFICACION in ("adaptativa", "repartida"):
+                # Cada equipo tiene su propio vencimiento: se sondean solo los que tocan
+                repartida = PLANIFICACION == "repartida"
+                if releido:
+                    for _ in equipos:
+                        pass  # completar la lectura de AD/DNS (llena el inventario)
+                    sincronizar_plan(inventario, base=PING_INTERVAL if repartida else None)
+                if not inventario:
+                    print("[WARN] No se encontraron equipos en AD.")
+                    time.sleep(PING_INTERVAL)
+                    continue
+
+                normales, en_cuarentena = equipos_vencidos(config)
+                procesados = 0
+                if normales:
+                    procesados += _sondear(conn, normales, PING_INTERVAL, config, ESCANEO_MODO)
+                if en_cuarentena:
+                    procesados += _sondear(conn, en_cuarentena, PING_INTERVAL, config_cuarentena(config), ESCANEO_MODO)
+                if repartida:
+                    reprogramar_repartidos(normales, PING_INTERVAL)
+                else:
+                    reprogramar_equipos(normales + en_cuarentena, config, PING_INTERVAL)
+                if procesados:
+                    enviar_notificacion_webhook(conn)
+
+                # Dormir hasta el próximo vencimiento (o la próxima lectura de AD)
+                espera = segundos_hasta_proximo()
+                espera = min(PING_INTERVAL if espera is None else espera, proxima_lectura_ad - time.monotonic())
+                time.sleep(max(espera, 1))
+                continue
 
             # Insertar o actualizar equipos en DB usando ping
-            insertar_o_actualizar(conn, equipos, equipos_ad_actuales, ping_interval=PING_INTERVAL)
-            
-            enviar_notificacion_webhook(conn)
+            equipos = recortar_equipos(equipos, PING_INTERVAL, config)
+            inicio_escaneo = iniciar_escaneo(medicion)
+            procesados = _sondear(conn, equipos, PING_INTERVAL, config, ESCANEO_MODO)
+            cerrar_escaneo(medicion, inicio_escaneo)
+            if procesados:
+                inicio_alertas = time.monotonic()
+                enviar_notificacion_webhook(conn)
+                medicion["fases"]["alertas"] = time.monotonic() - inicio_alertas
+            else:
+                print("[WARN] No se encontraron equipos en AD.")
 
-            
-            print(f"[INFO] Actualización completada. Esperando {PING_INTERVAL} segundos...\n")
-            time.sleep(PING_INTERVAL)
+            # Ritmo fijo: el próximo ciclo arranca PING_INTERVAL después del anterior
+            # (también cuando no hubo equipos, para no perder la grilla ni el registro)
+            espera = cerrar_ciclo(conn, medicion, procesados, PING_INTERVAL, config)
+            if procesados:
+                print(f"[INFO] Actualización completada. Esperando {espera:.0f} segundos...\n")
+            time.sleep(espera)
 
     except KeyboardInterrupt:
         print("\n[INFO] Script detenido manualmente.")
@@ -49,6 +188,14 @@ def main(config):
     except Exception as e:
         print("[ERROR] Ocurrió un error inesperado:", e)
 
+    finally:
+        # Confirmar lo que quedó en la cola del escritor SQL
+        detener_escritor()
+        detener_entregador()
+        # Hilos de sondeo compartidos entre ciclos (cierran sus conexiones SQL)
+        detener_ejecutores()
+        detener_ejecutores_async()
+
 
 # ------------------------
 # INICIO DEL PROGRAMA
@@ -0,0 +1,106 @@
+# ---------------------------------------
+# Archivo: tests/test_webhook_alerts.py
+# Parámetros de la consulta de candidatos a alerta contra una conexión
+# falsa que verifica tipo y orden de cada '?' según el SQL que lo rodea
+# ---------------------------------------
+
+import os
+import re
+import sys
+import tempfile
+import types
+import unittest
+from datetime import date, datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import pyodbc  # noqa: F401
+except ImportError:
+    # Solo hace falta para importar Datos/db_pool; la prueba no abre conexiones
+    _pyodbc = types.ModuleType("pyodbc")
+    _pyodbc.Error = _pyodbc.OperationalError = _pyodbc.InterfaceError = Exception
+    sys.modules["pyodbc"] = _pyodbc
+
+# webhook_alerts crea secret.key en el directorio actual al importarse
+_DIR_ORIGINAL = os.getcwd()
+os.chdir(tempfile.mkdtemp())
+try:
+    from Configs import webhook_alerts
+finally:
+    os.chdir(_DIR_ORIGINAL)
+
+
+# (expresión que termina justo antes del '?', tipo esperado)
+_CONTEXTOS = [
+    (r"DATEDIFF\(SECOND, e\.InactivoDesde, $", datetime),
+    (r"CodigoAD = $", int),
+    (r"DATEADD\(SECOND, -$", int),
+    (r"DATEADD\(SECOND, -\?, $", datetime),
+    (r"\.Fecha = $", date),
+]
+
+
+class ConexionVerificadora:
+    """
+    Imita PoolSQL.ejecutar: por cada '?' busca qué tipo corresponde según
+    el texto anterior y falla si el parámetro en esa posición no lo es.
+    """
+
+    def __init__(self, test, filas):
+        self.test = test
+        self.filas = filas
+        self.consultas = []
+
+    def ejecutar(self, query, params=(), fetch=False, **kwargs):
+        texto = " ".join(query.split())
+        posiciones = [m.start() for m in re.finditer(r"\?", texto)]
+        self.test.assertEqual(len(posiciones), len(params), "cantidad de parámetros")
+        for i, (pos, valor) in enumerate(zip(posiciones, params)):
+            previo = texto[:pos]
+            esperado = next((tipo for patron, tipo in _CONTEXTOS if re.search(patron, previo)), None)
+            self.test.assertIsNotNone(esperado, f"'?' {i + 1} sin contexto conocido: ...{previo[-40:]}")
+            self.test.assertIsInstance(valor, esperado, f"'?' {i + 1} tras ...{previo[-40:]}")
+            if esperado is date:
+                self.test.assertNotIsInstance(valor, datetime, f"'?' {i + 1} es una fecha, no un instante")
+            if esperado is int:
+                self.test.assertNotIsInstance(valor, bool)
+        self.consultas.append((texto, tuple(params)))
+        return self.filas if fetch else True
+
+
+class TestCandidatosAlerta(unittest.TestCase):
+
+    def _enviar(self, filas):
+        conn = ConexionVerificadora(self, filas)
+        cfg = {"webhook_url": "http://127.0.0.1/alertas", "min_seconds_inactivo": 300, "outbox": {}}
+        with mock.patch.object(webhook_alerts, "cargar_webhook_config", return_value=cfg), \
+                mock.patch.object(webhook_alerts, "encolar_outbox") as encolar, \
+                mock.patch.object(webhook_alerts, "entregador_activo", return_value=True), \
+                mock.patch.object(webhook_alerts, "avisar_entregador"):
+            webhook_alerts.enviar_alertas_inactividad(conn)
+        return conn, encolar
+
+    def test_parametros_en_orden_y_tipo(self):
+        conn, _ = self._enviar([])
+        self.assertEqual(len(conn.consultas), 1)
+        _, params = conn.consultas[0]
+        self.assertEqual(params[1], webhook_alerts.CODIGOS_AD["Dentro de AD"])
+        self.assertEqual(params[2], 300)
+
+    def test_candidatos_van_al_outbox(self):
+        inactivo = datetime(2026, 10, 17, 8, 0, 0)
+        filas = [("PC-01", "10.0.0.5", inactivo, "Servidor", "TI", "Sala 1", 900)]
+        _, encolar = self._enviar(filas)
+        entradas = encolar.call_args[0][1]
+        self.assertEqual(len(entradas), 1)
+        clave, nombre, fecha, payload = entradas[0]
+        self.assertEqual(nombre, "PC-01")
+        self.assertEqual(clave, f"PC-01:{fecha.isoformat()}")
+        self.assertEqual(payload["inactivo_desde"], inactivo.isoformat())
+        self.assertEqual(payload["segundos_inactivo"], 900)
+
+
+if __name__ == "__main__":
+    unittest.main()